@@ -0,0 +1,147 @@
+import logging
+import secrets
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import g, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class TokenError(Exception):
+    """Raised when a session token is missing, invalid, expired or revoked"""
+
+
+class TokenManager:
+    """Signed, expiring session tokens carrying user_id and role.
+
+    Verification is a local HMAC check, no database round trip. Revocation
+    is an in-memory cache: logout revokes a single token id until it would
+    have expired anyway, and revoke_user() invalidates every token a user
+    was issued before now (e.g. after a role change).
+
+    With a message bus (attach_bus) each revocation is published as it
+    happens and applied by every worker, so a logout served by one worker
+    holds on all of them. They must share the secret, or tokens from one are
+    rejected by the others. A worker started later only learns revocations
+    made from then on, and delivery is at most once, like presence.
+    """
+
+    def __init__(self, secret, max_age=12 * 3600, salt='rider-session'):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret, salt=salt)
+        self._lock = threading.Lock()
+        self._revoked = {}     # jti -> unix time the token expires
+        self._not_before = {}  # user_id -> tokens issued before this are invalid
+        self.bus = None
+        self.worker_id = uuid.uuid4().hex
+        self._counters = {'bus_messages': 0, 'remote_revocations': 0}
+
+    # Sharing across workers
+
+    def attach_bus(self, bus, channel='session_revocations'):
+        """Share revocations with the other workers on bus (before the bus is started)"""
+        self.bus = bus
+        self._channel = channel
+        bus.subscribe(channel, self.apply_remote)
+
+    def _publish(self, op, **fields):
+        if self.bus is None:
+            return
+        self.bus.publish(self._channel, dict(fields, op=op, worker=self.worker_id))
+        with self._lock:
+            self._counters['bus_messages'] += 1
+
+    def apply_remote(self, message):
+        """Apply another worker's revocation"""
+        if message.get('worker') == self.worker_id:
+            return
+        with self._lock:
+            if message['op'] == 'revoke':
+                self._revoke(message['jti'], message['expires'])
+            elif message['op'] == 'revoke_user':
+                self._revoke_user(message['user'], message['not_before'])
+            self._counters['remote_revocations'] += 1
+
+    def _revoke(self, jti, expires):
+        """Caller holds the lock"""
+        now = time.time()
+        self._revoked[jti] = expires
+        # Expired entries can go; their tokens fail the signature age check
+        for old in [j for j, exp in self._revoked.items() if exp < now]:
+            del self._revoked[old]
+
+    def _revoke_user(self, user_id, not_before):
+        """Caller holds the lock"""
+        self._not_before[user_id] = max(not_before, self._not_before.get(user_id, 0))
+
+    def issue(self, user_id, role):
+        claims = {'uid': user_id, 'role': role, 'jti': secrets.token_hex(8), 'iat': time.time()}
+        return self._serializer.dumps(claims)
+
+    def verify(self, token):
+        """Return the token claims as {'user_id', 'role', 'jti', 'iat'}"""
+        if not token:
+            raise TokenError('Missing session token')
+        try:
+            claims = self._serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            raise TokenError('Session expired, please log in again')
+        except BadSignature:
+            raise TokenError('Invalid session token')
+
+        with self._lock:
+            if claims['jti'] in self._revoked:
+                raise TokenError('Session has been logged out')
+            if claims['iat'] < self._not_before.get(claims['uid'], 0):
+                raise TokenError('Session is no longer valid, please log in again')
+
+        return {'user_id': claims['uid'], 'role': claims['role'], 'jti': claims['jti'], 'iat': claims['iat']}
+
+    def revoke(self, claims):
+        """Logout: reject this token from now on"""
+        expires = claims['iat'] + self.max_age
+        with self._lock:
+            self._revoke(claims['jti'], expires)
+        self._publish('revoke', jti=claims['jti'], expires=expires)
+
+    def revoke_user(self, user_id):
+        """Invalidate every token issued to user_id so far"""
+        not_before = time.time()
+        with self._lock:
+            self._revoke_user(user_id, not_before)
+        self._publish('revoke_user', user=user_id, not_before=not_before)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['revoked_tokens'] = len(self._revoked)
+            c['revoked_users'] = len(self._not_before)
+        c['shared'] = self.bus is not None
+        return c
+
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    return None
+
+
+def require_auth(tokens, role=None):
+    """Decorator: verify the bearer token locally and expose its claims as g.auth"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                g.auth = tokens.verify(bearer_token())
+            except TokenError as e:
+                return jsonify({'success': False, 'message': str(e)}), 401
+            if role and g.auth['role'] != role:
+                return jsonify({'success': False, 'message': f'Unauthorized: Only {role}s can perform this action'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,259 @@
+"""Load test of the eventlet server (rider_backend) against the asyncio one (rider_asgi).
+
+For each mode the server is started as a subprocess on --port, then:
+
+  1. connections: --sockets Socket.IO clients connect at once (with an
+     admin token when --username/--password are given) and stay connected;
+     reports how many made it and the connect latency.
+  2. location updates: with those sockets still open, --senders concurrent
+     clients POST /api/update_location for --seconds, cycling through the
+     first --riders rider ids; reports accepted updates per second and
+     request latency. The fan-out to connected dashboards is part of the
+     load. With --ingest socket the first --senders sockets send the fixes
+     as 'location_update' messages of --batch points instead, each waiting
+     for its seq ack (needs an admin --username, which may name the rider).
+
+The load generator itself runs on asyncio and needs aiohttp (for
+socketio.AsyncClient too); the asyncio server needs asyncpg and uvicorn.
+
+Usage: python benchmarks/bench_async_vs_eventlet.py [--modes eventlet,asyncio] [--sockets 1000]
+           [--senders 50] [--seconds 10] [--riders 200] [--username admin --password ...]
+           [--ingest http|socket] [--batch 1]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+import psycopg2
+import socketio
+from dotenv import load_dotenv
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SERVERS = {
+    'eventlet': lambda port: [
+        sys.executable, '-c',
+        'import rider_backend as rb; rb.db_pool.prefill(); rb.start_background_jobs(); '
+        f'rb.socketio.run(rb.app, host="127.0.0.1", port={port}, log_output=False)'
+    ],
+    'asyncio': lambda port: [
+        sys.executable, '-m', 'uvicorn', 'rider_asgi:app', '--host', '127.0.0.1', '--port', str(port),
+        '--log-level', 'warning'
+    ]
+}
+
+
+def rider_ids(limit):
+    load_dotenv()
+    connection = psycopg2.connect(
+        host=os.environ.get('DB_HOST'),
+        port=int(os.environ.get('DB_PORT', 5432)),
+        database=os.environ.get('DB_NAME'),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        sslmode=os.environ.get('DB_SSLMODE', 'require')
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT user_id FROM users WHERE role = 'rider' ORDER BY user_id LIMIT %s", (limit,))
+        ids = [row[0] for row in cursor.fetchall()]
+    connection.close()
+    return ids
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def wait_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url + '/') as response:
+                    if response.status == 200:
+                        return True
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    return False
+
+
+async def login(url, args):
+    if not args.username:
+        return None
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url + '/api/login', json={'username': args.username,
+                                                          'password': args.password}) as response:
+            body = await response.json()
+    return body.get('token')
+
+
+async def open_sockets(url, count, token):
+    """Connect count clients concurrently; returns (clients, connect latencies, received counters)"""
+    received = [0]
+    latencies = []
+
+    async def one():
+        client = socketio.AsyncClient(reconnection=False)
+        client.on('*', lambda *a: received.__setitem__(0, received[0] + 1))
+        started = time.perf_counter()
+        try:
+            await client.connect(url, auth={'token': token} if token else None, transports=['websocket'],
+                                 wait_timeout=30)
+        except Exception:
+            return None
+        latencies.append(time.perf_counter() - started)
+        return client
+
+    clients = await asyncio.gather(*(one() for _ in range(count)))
+    return [c for c in clients if c is not None], latencies, received
+
+
+async def send_locations(url, ids, senders, seconds):
+    """senders loops posting fixes until the deadline; returns (accepted, failed, latencies)"""
+    counts = {'ok': 0, 'failed': 0}
+    latencies = []
+    deadline = time.time() + seconds
+
+    async def sender(index, session):
+        n = index
+        while time.time() < deadline:
+            user_id = ids[n % len(ids)]
+            n += senders
+            fix = {'user_id': user_id, 'latitude': 12.9 + (n % 1000) * 1e-5, 'longitude': 77.6 + (n % 997) * 1e-5}
+            started = time.perf_counter()
+            try:
+                async with session.post(url + '/api/update_location', json=fix) as response:
+                    await response.read()
+                    counts['ok' if response.status == 200 else 'failed'] += 1
+            except aiohttp.ClientError:
+                counts['failed'] += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=senders)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(sender(i, session) for i in range(senders)))
+    return counts['ok'], counts['failed'], latencies
+
+
+async def send_locations_socket(clients, ids, batch, seconds):
+    """Each client sends batches over its socket and waits for the ack; returns like send_locations"""
+    counts = {'ok': 0, 'failed': 0}
+    latencies = []
+    deadline = time.time() + seconds
+
+    async def sender(index, client):
+        n, seq = index, 0
+        while time.time() < deadline:
+            points = []
+            for _ in range(batch):
+                seq += 1
+                n += len(clients)
+                points.append({'seq': seq, 'user_id': ids[n % len(ids)],
+                               'latitude': 12.9 + (n % 1000) * 1e-5, 'longitude': 77.6 + (n % 997) * 1e-5})
+            started = time.perf_counter()
+            try:
+                ack = await client.call('location_update', {'points': points}, timeout=30)
+            except Exception:
+                counts['failed'] += batch
+                continue
+            latencies.append(time.perf_counter() - started)
+            handled = batch if ack.get('success') else len([p for p in points if p['seq'] <= ack.get('ack', 0)])
+            counts['ok'] += handled - len(ack.get('rejected', []))
+            counts['failed'] += batch - handled + len(ack.get('rejected', []))
+
+    await asyncio.gather(*(sender(i, c) for i, c in enumerate(clients)))
+    return counts['ok'], counts['failed'], latencies
+
+
+async def run_mode(mode, args, ids):
+    url = f'http://127.0.0.1:{args.port}'
+    server = subprocess.Popen(SERVERS[mode](args.port), cwd=ROOT, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        if not await wait_ready(url):
+            return {'mode': mode, 'error': 'server did not start'}
+        token = await login(url, args)
+
+        started = time.perf_counter()
+        clients, connect_latencies, received = await open_sockets(url, args.sockets, token)
+        connect_seconds = time.perf_counter() - started
+
+        if args.ingest == 'socket':
+            ok, failed, latencies = await send_locations_socket(clients[:args.senders], ids, args.batch,
+                                                                args.seconds)
+        else:
+            ok, failed, latencies = await send_locations(url, ids, args.senders, args.seconds)
+        # Let the last broadcaster ticks arrive
+        await asyncio.sleep(1)
+        result = {
+            'mode': mode,
+            'connected': len(clients),
+            'connect_s': connect_seconds,
+            'connect_p50_ms': statistics.median(connect_latencies) * 1000 if connect_latencies else 0,
+            'connect_p99_ms': percentile(connect_latencies, 99) * 1000,
+            'updates_per_s': ok / args.seconds,
+            'failed': failed,
+            'update_p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+            'update_p99_ms': percentile(latencies, 99) * 1000,
+            'events_received': received[0]
+        }
+        await asyncio.gather(*(c.disconnect() for c in clients), return_exceptions=True)
+        return result
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+async def main_async(args):
+    ids = rider_ids(args.riders)
+    if not ids:
+        print("No riders in the users table")
+        return
+    results = []
+    for mode in args.modes.split(','):
+        results.append(await run_mode(mode, args, ids))
+
+    print(f"{args.sockets} sockets, {args.senders} {args.ingest} senders for {args.seconds:g}s over {len(ids)} riders"
+          + (f", {args.batch} points per message" if args.ingest == 'socket' else ''))
+    print(f"{'mode':<9} {'connected':>9} {'conn s':>7} {'conn p50':>9} {'conn p99':>9} "
+          f"{'updates/s':>10} {'failed':>7} {'upd p50':>8} {'upd p99':>8} {'events':>9}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['mode']:<9} {r['error']}")
+            continue
+        print(f"{r['mode']:<9} {r['connected']:>9,} {r['connect_s']:>7.2f} {r['connect_p50_ms']:>7.1f}ms "
+              f"{r['connect_p99_ms']:>7.1f}ms {r['updates_per_s']:>10,.0f} {r['failed']:>7,} "
+              f"{r['update_p50_ms']:>6.1f}ms {r['update_p99_ms']:>6.1f}ms {r['events_received']:>9,}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', default='eventlet,asyncio')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--sockets', type=int, default=1000)
+    parser.add_argument('--senders', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--ingest', choices=('http', 'socket'), default='http')
+    parser.add_argument('--batch', type=int, default=1, help="points per 'location_update' with --ingest socket")
+    parser.add_argument('--username', default=None, help='admin account, so sockets receive the fleet')
+    parser.add_argument('--password', default=None)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Throughput of fast queries while a deliberately slow query is in flight.
+
+Runs one greenlet executing SELECT pg_sleep(N) and a number of greenlets
+issuing SELECT 1 against the shared pool, once per DB green mode. With
+'off' the slow query blocks the hub and the fast workers stall; with
+'wait_callback' or 'tpool' they keep going.
+
+Usage: python benchmarks/bench_green_db.py [--slow 2] [--workers 20] [--modes off,wait_callback,tpool]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db_pool import ConnectionPool, configure_green_mode  # noqa: E402
+
+
+def run(mode, db_config, slow_seconds, workers):
+    cursor_factory = configure_green_mode(mode)
+    pool = ConnectionPool(db_config, minconn=workers + 1, maxconn=workers + 1,
+                          sslmode=os.environ.get('DB_SSLMODE', 'require'), cursor_factory=cursor_factory)
+    pool.prefill()
+
+    done = {'fast': 0}
+    stop_at = time.monotonic() + slow_seconds
+
+    def slow_query():
+        with pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(%s)", (slow_seconds,))
+
+    def fast_worker():
+        while time.monotonic() < stop_at:
+            with pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchone()
+            done['fast'] += 1
+            eventlet.sleep(0)
+
+    started = time.monotonic()
+    threads = [eventlet.spawn(slow_query)]
+    # Give the slow query a head start so it is in flight before the fast ones
+    eventlet.sleep(0.05)
+    threads += [eventlet.spawn(fast_worker) for _ in range(workers)]
+    for t in threads:
+        t.wait()
+    elapsed = time.monotonic() - started
+    pool.closeall()
+
+    print(f"{mode:>14}: {done['fast']:>7} fast queries in {elapsed:.2f}s "
+          f"({done['fast'] / elapsed:,.0f} q/s) while pg_sleep({slow_seconds}) ran")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slow', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--modes', default='off,wait_callback,tpool')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_config = {
+        'host': os.environ.get('DB_HOST'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD')
+    }
+    for mode in args.modes.split(','):
+        run(mode, db_config, args.slow, args.workers)
+
+
+if __name__ == '__main__':
+    main()
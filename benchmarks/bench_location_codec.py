@@ -0,0 +1,72 @@
+"""Bytes per location update and encode/decode cost: JSON vs packed.
+
+Compares the legacy per-fix JSON payload (sent twice per fix), the JSON
+'rider_locations_batch' entries and the packed binary batch from
+location_codec, for a batch of N riders.
+
+Usage: python benchmarks/bench_location_codec.py [--batch 200] [--rounds 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from location_codec import encode_packed, decode_packed  # noqa: E402
+
+
+def bench(rounds, fn):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(3)
+    now = datetime.now()
+    fixes = [(rnd.randint(1, 200000), 12.75 + rnd.random() * 0.4, 77.4 + rnd.random() * 0.4,
+              now - timedelta(milliseconds=rnd.randint(0, 250))) for _ in range(args.batch)]
+
+    legacy = [{'user_id': u, 'rider_id': u, 'latitude': lat, 'longitude': lng, 'timestamp': t.isoformat()}
+              for u, lat, lng, t in fixes]
+    batch = {'count': len(fixes), 'riders': [{'user_id': u, 'latitude': lat, 'longitude': lng, 'timestamp': t.isoformat()}
+                                             for u, lat, lng, t in fixes]}
+    packed_input = [(u, lat, lng, int(t.timestamp() * 1000)) for u, lat, lng, t in fixes]
+
+    legacy_text = [json.dumps(p) for p in legacy]
+    legacy_bytes = sum(2 * len(t) for t in legacy_text)  # two events per fix
+    batch_text = json.dumps(batch)
+    packed = encode_packed(packed_input)
+
+    n = len(fixes)
+    print(f"batch of {n} fixes")
+    print(f"{'format':<28}{'bytes/update':>14}{'encode us/batch':>18}{'decode us/batch':>18}")
+    rows = [
+        ('legacy JSON (2 events/fix)', legacy_bytes,
+         bench(args.rounds, lambda: [json.dumps(p) for p in legacy]) * 2,
+         bench(args.rounds, lambda: [json.loads(t) for t in legacy_text]) * 2),
+        ('JSON batch', len(batch_text),
+         bench(args.rounds, lambda: json.dumps(batch)),
+         bench(args.rounds, lambda: json.loads(batch_text))),
+        ('packed batch', len(packed),
+         bench(args.rounds, lambda: encode_packed(packed_input)),
+         bench(args.rounds, lambda: decode_packed(packed))),
+    ]
+    for label, size, enc, dec in rows:
+        print(f"{label:<28}{size / n:>14.1f}{enc * 1e6:>18.1f}{dec * 1e6:>18.1f}")
+
+    worst = max(abs(a[1] - b[1]) + abs(a[2] - b[2]) for a, b in zip(packed_input, decode_packed(packed)))
+    print(f"max coordinate round-trip error: {worst:.2e} deg")
+
+
+if __name__ == '__main__':
+    main()
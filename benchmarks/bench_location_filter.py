@@ -0,0 +1,99 @@
+"""Write volume with and without the ingest-side location filter.
+
+Simulates --riders riders reporting once per --interval seconds for
+--minutes minutes: --parked percent of them stand still, the rest drive
+at about 10 m/s, all with --jitter metres of GPS noise (standard deviation
+per axis). The app's usual noise is mixed in: --resend percent of fixes
+are sent twice and a few per mille are stale (queued) or wild jumps.
+Reports how many fixes would reach the location pipeline and the
+broadcaster, per kind of rider, and the filter's cost per fix. Needs no
+database.
+
+Usage: python benchmarks/bench_location_filter.py [--riders 2000] [--minutes 10] [--interval 1] [--parked 40]
+           [--jitter 1.5] [--resend 2]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from location_filter import LocationFilter, REASONS  # noqa: E402
+
+LAT0, LNG0 = 12.95, 77.60
+M_PER_DEG = 111320.0
+
+
+def fixes(args):
+    """(kind, user_id, lat, lng, location_time) in arrival order"""
+    rnd = random.Random(7)
+    start = datetime.now(timezone.utc) - timedelta(minutes=args.minutes)
+    riders = []
+    for user_id in range(args.riders):
+        parked = rnd.random() * 100 < args.parked
+        riders.append(['parked' if parked else 'moving', user_id,
+                       LAT0 + rnd.uniform(-0.2, 0.2), LNG0 + rnd.uniform(-0.2, 0.2), rnd.uniform(0, 2 * math.pi)])
+
+    result = []
+    steps = int(args.minutes * 60 / args.interval)
+    for step in range(steps):
+        t = start + timedelta(seconds=step * args.interval)
+        for rider in riders:
+            kind, user_id, lat, lng, heading = rider
+            if kind == 'moving':
+                meters = 10 * args.interval
+                lat += math.cos(heading) * meters / M_PER_DEG
+                lng += math.sin(heading) * meters / M_PER_DEG
+                rider[2], rider[3] = lat, lng
+            fix = (kind, user_id, lat + rnd.gauss(0, args.jitter) / M_PER_DEG,
+                   lng + rnd.gauss(0, args.jitter) / M_PER_DEG, t)
+            roll = rnd.random() * 1000
+            if roll < 3:
+                fix = (kind, user_id, fix[2], fix[3], t - timedelta(seconds=30))
+            elif roll < 5:
+                fix = (kind, user_id, fix[2] + 0.05, fix[3], t)
+            result.append(fix)
+            if rnd.random() * 100 < args.resend:
+                result.append(fix)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--riders', type=int, default=2000)
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--parked', type=float, default=40, help='percent of riders standing still')
+    parser.add_argument('--jitter', type=float, default=1.5, help='GPS noise in metres')
+    parser.add_argument('--resend', type=float, default=2, help='percent of fixes sent twice')
+    args = parser.parse_args()
+
+    stream = fixes(args)
+    location_filter = LocationFilter()
+    sent = {'parked': 0, 'moving': 0}
+    kept = {'parked': 0, 'moving': 0}
+    started = time.perf_counter()
+    for kind, user_id, lat, lng, t in stream:
+        sent[kind] += 1
+        if location_filter.check(user_id, lat, lng, t) is None:
+            location_filter.remember(user_id, lat, lng, t)
+            kept[kind] += 1
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.riders} riders, {args.parked:g}% parked, one fix per {args.interval:g}s for {args.minutes:g} min")
+    print(f"{'riders':<8} {'fixes sent':>11} {'written':>9} {'saved':>7}")
+    for kind in ('parked', 'moving'):
+        saved = 1 - kept[kind] / sent[kind] if sent[kind] else 0.0
+        print(f"{kind:<8} {sent[kind]:>11,} {kept[kind]:>9,} {saved:>7.1%}")
+    total_sent, total_kept = sum(sent.values()), sum(kept.values())
+    print(f"{'all':<8} {total_sent:>11,} {total_kept:>9,} {1 - total_kept / total_sent:>7.1%}")
+    stats = location_filter.stats()
+    print('dropped: ' + ', '.join(f"{reason} {stats[reason]:,}" for reason in REASONS))
+    print(f"filter cost: {elapsed / len(stream) * 1e6:.2f} us/fix")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Reconnect storm: replaying offline buffers fix by fix vs one batch upload per rider.
+
+--riders riders each come back with --points buffered fixes. Three ways to
+get them into rider_location_history and rider_latest_location:
+
+  replay  every fix through LocationWriter.submit, as the app did with one
+          /api/update_location per fix (HTTP cost not included), flushed
+          every max_batch riders like the pipeline does
+  insert  LocationUploader with one multi-row INSERT per rider (what the
+          wait_callback green mode uses)
+  copy    LocationUploader with COPY per rider
+
+The points are real rows in the last hour of history, a different minute
+offset per mode so the runs do not skip each other's points as already
+stored.
+
+Usage: python benchmarks/bench_location_upload.py [--riders 200] [--points 300] [--modes replay,insert,copy]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db_pool import ConnectionPool, RoundTripStats, configure_green_mode  # noqa: E402
+from location_history import LocationHistory  # noqa: E402
+from location_pipeline import LocationWriter  # noqa: E402
+from location_upload import LocationUploader, prepare  # noqa: E402
+
+
+def buffers(rider_ids, points, offset_minutes):
+    """Raw upload bodies, one per rider, the way the app would send them"""
+    rnd = random.Random(offset_minutes)
+    end = datetime.now(timezone.utc) - timedelta(minutes=offset_minutes)
+    result = {}
+    for user_id in rider_ids:
+        lat, lng = 12.9 + rnd.random() * 0.2, 77.5 + rnd.random() * 0.2
+        fixes = []
+        for i in range(points):
+            lat += rnd.uniform(-1e-4, 1e-4)
+            lng += rnd.uniform(-1e-4, 1e-4)
+            fixes.append({'latitude': lat, 'longitude': lng,
+                          'timestamp': (end - timedelta(seconds=points - i)).isoformat()})
+        result[user_id] = fixes
+    return result
+
+
+def run(mode, pool, round_trips, history, rider_ids, args, offset_minutes):
+    data = buffers(rider_ids, args.points, offset_minutes)
+    round_trips.begin()
+    started = time.perf_counter()
+    if mode == 'replay':
+        writer = LocationWriter(history, max_batch=500, max_pending=10 ** 6, max_history_pending=10 ** 7)
+        for user_id, fixes in data.items():
+            rows, _, _ = prepare(fixes, history.history_window())
+            for t, lat, lng in rows:
+                writer.submit(user_id, lat, lng, t)
+                if len(writer._pending) >= writer.max_batch:
+                    writer.flush(pool)
+        writer.flush(pool)
+        requests = sum(len(f) for f in data.values())
+    else:
+        uploader = LocationUploader(history, use_copy=mode == 'copy')
+        for user_id, fixes in data.items():
+            rows, _, _ = uploader.prepare({'points': fixes})
+            with pool.connection() as connection:
+                uploader.write(connection, user_id, rows)
+        requests = len(data)
+    elapsed = time.perf_counter() - started
+    trips = round_trips.end(mode)
+    total = len(rider_ids) * args.points
+    print(f"{mode:<7} {requests:>9,} {elapsed:>8.2f} {total / elapsed:>11,.0f} {trips:>12,}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--points', type=int, default=300)
+    parser.add_argument('--modes', default='replay,insert,copy')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_config = {
+        'host': os.environ.get('DB_HOST'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD')
+    }
+    round_trips = RoundTripStats()
+    pool = ConnectionPool(db_config, minconn=1, maxconn=2, sslmode=os.environ.get('DB_SSLMODE', 'require'),
+                          cursor_factory=configure_green_mode('off'), round_trips=round_trips)
+    history = LocationHistory()
+    with pool.connection() as connection:
+        history.ensure_schema(connection)
+        history.ensure_partitions(connection)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM users WHERE role = 'rider' ORDER BY user_id LIMIT %s", (args.riders,))
+            rider_ids = [row['user_id'] for row in cursor.fetchall()]
+        connection.rollback()
+    if not rider_ids:
+        print("No riders in the users table")
+        return
+
+    print(f"{len(rider_ids)} riders x {args.points} buffered fixes")
+    print(f"{'mode':<7} {'requests':>9} {'seconds':>8} {'points/s':>11} {'round trips':>12}")
+    for n, mode in enumerate(args.modes.split(',')):
+        run(mode, pool, round_trips, history, rider_ids, args, offset_minutes=10 * (n + 1))
+    pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
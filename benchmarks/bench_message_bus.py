@@ -0,0 +1,165 @@
+"""Multi-worker check and throughput of the Postgres LISTEN/NOTIFY message bus.
+
+Starts --workers separate processes, each with its own PostgresBus, the
+way gunicorn workers would run. Then:
+
+  1. presence: worker 0 sets a rider online and connects a device; every
+     other worker must see the rider online and the device count, and the
+     device leaving must start the disconnect grace on all of them.
+  2. emit: every worker emits through a python-socketio Server using
+     BusManager to a room that only one socket on another worker is in;
+     each emit must arrive exactly once.
+  3. throughput: every worker publishes --size byte messages for
+     --seconds; reports messages/s published and received per worker, and
+     how many messages went into each NOTIFY.
+
+Usage: python benchmarks/bench_message_bus.py [--workers 4] [--seconds 5] [--size 200]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db_pool import configure_green_mode  # noqa: E402
+from message_bus import BusManager, PostgresBus  # noqa: E402
+from presence import PresenceRegistry  # noqa: E402
+
+RIDER = 424242
+
+
+def db_config():
+    load_dotenv()
+    return {
+        'host': os.environ.get('DB_HOST'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD')
+    }
+
+
+def worker(index, args):
+    """One process; prints a JSON report on stdout"""
+    import socketio
+
+    configure_green_mode('wait_callback')
+    bus = PostgresBus(db_config(), sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    presence = PresenceRegistry(ttl=60, disconnect_grace=5)
+    presence.attach_bus(bus)
+
+    received = {'bench': 0}
+    bus.subscribe('bench', lambda message: received.__setitem__('bench', received['bench'] + 1))
+
+    server = socketio.Server(client_manager=BusManager(bus), async_mode='eventlet')
+    delivered = []
+    server._send_eio_packet = lambda eio_sid, pkt: delivered.append(pkt.data)
+    server.manager.initialize()
+    if index == 1:
+        sid = server.manager.connect('bench-socket', '/')
+        server.manager.enter_room(sid, '/', 'admins')
+
+    bus.start(eventlet.spawn)
+    report = {'worker': index}
+    # Let every listener LISTEN before anything is published
+    eventlet.sleep(args.settle)
+
+    # 1. Presence
+    if index == 0:
+        presence.set_online(RIDER)
+        presence.add_sid('device', RIDER)
+    eventlet.sleep(args.settle)
+    report['sees_online'] = presence.is_online(RIDER)
+    report['first_device_elsewhere'] = index != 0 and not presence.add_sid('other-device', RIDER)
+    presence.remove_sid('other-device')
+    if index == 0:
+        presence.remove_sid('device')
+    eventlet.sleep(args.settle)
+    # Grace (5 s) instead of TTL (60 s) once no worker has a device
+    report['grace_everywhere'] = bool(presence.expire(time.monotonic() + 10))
+
+    # 2. Emit across workers
+    server.emit('bench_event', {'from': index}, to='admins')
+    eventlet.sleep(args.settle)
+    report['emits_delivered'] = len(delivered)
+
+    # 3. Throughput
+    received['bench'] = 0
+    payload = {'data': 'x' * args.size}
+    deadline = time.time() + args.seconds
+    published = 0
+    while time.time() < deadline:
+        for _ in range(100):
+            bus.publish('bench', dict(payload, worker=index, n=published))
+            published += 1
+        eventlet.sleep(0)
+    eventlet.sleep(args.settle)
+    stats = bus.stats()
+    report.update({
+        'published': published,
+        'received': received['bench'],
+        'publish_per_s': round(published / args.seconds),
+        'receive_per_s': round(received['bench'] / args.seconds),
+        'messages_per_notify': round(stats['published'] / stats['notifies'], 1) if stats['notifies'] else 0,
+        'publish_failures': stats['publish_failures']
+    })
+    print(json.dumps(report), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--size', type=int, default=200)
+    parser.add_argument('--settle', type=float, default=1.0)
+    parser.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        worker(args.worker, args)
+        return
+
+    processes = [
+        subprocess.Popen([sys.executable, __file__, '--worker', str(n), '--seconds', str(args.seconds),
+                          '--size', str(args.size), '--settle', str(args.settle)],
+                         stdout=subprocess.PIPE, text=True)
+        for n in range(args.workers)
+    ]
+    reports = []
+    for process in processes:
+        out, _ = process.communicate()
+        lines = [line for line in out.splitlines() if line.startswith('{')]
+        reports.append(json.loads(lines[-1]) if lines else {'worker': '?', 'error': 'no report'})
+
+    total_published = sum(r.get('published', 0) for r in reports)
+    ok = True
+    print(f"{'worker':>6} {'online':>7} {'devices':>8} {'grace':>6} {'emits':>6} "
+          f"{'pub/s':>9} {'recv/s':>9} {'recv %':>7} {'msg/notify':>11}")
+    for r in reports:
+        if 'error' in r:
+            print(f"{r['worker']:>6} {r['error']}")
+            ok = False
+            continue
+        expected_emits = args.workers if r['worker'] == 1 else 0
+        checks = [r['sees_online'], r['worker'] == 0 or r['first_device_elsewhere'], r['grace_everywhere'],
+                  r['emits_delivered'] == expected_emits]
+        ok = ok and all(checks)
+        share = 100.0 * r['received'] / total_published if total_published else 0
+        print(f"{r['worker']:>6} {str(checks[0]):>7} {str(checks[1]):>8} {str(checks[2]):>6} "
+              f"{r['emits_delivered']:>6} {r['publish_per_s']:>9,} {r['receive_per_s']:>9,} "
+              f"{share:>7.1f} {r['messages_per_notify']:>11}")
+    print('PASS' if ok else 'FAIL')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
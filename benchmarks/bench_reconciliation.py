@@ -0,0 +1,165 @@
+"""Timing report for the incremental ledger reconciliation.
+
+Builds a synthetic ledger (--wallets wallets, --transactions rows spread
+over them, balances consistent with the ledger; once, reruns reuse it) and
+times:
+
+  full scan     one GROUP BY over the whole ledger against wallets.balance
+  first run     LedgerReconciler with no checkpoints (a full pass)
+  idle run      nothing changed since the last run
+  incremental   after --delta new transactions on --touched wallets
+  drift         after corrupting one wallet's balance; it must be flagged
+
+Creates users bench_recon_<n>; point it at a scratch database.
+
+Usage: python benchmarks/bench_reconciliation.py [--wallets 10000] [--transactions 5000000] [--delta 10000] [--touched 500]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import ledger_reconciliation  # noqa: E402
+import queries  # noqa: E402
+from db_pool import ConnectionPool  # noqa: E402
+from ledger_reconciliation import LedgerReconciler  # noqa: E402
+
+FULL_SCAN = """
+    SELECT COUNT(*) AS drifting FROM (
+        SELECT w.wallet_id
+        FROM wallets w
+        JOIN wallet_transactions t ON t.wallet_id = w.wallet_id
+        JOIN users u ON u.user_id = w.user_id AND u.username LIKE 'bench_recon_%%'
+        GROUP BY w.wallet_id, w.balance
+        HAVING w.balance <> SUM(CASE WHEN t.transaction_type = 'CREDIT' THEN t.amount ELSE -t.amount END)
+    ) d
+"""
+
+# Random ledger rows for `count` wallets among the bench wallets, with the
+# matching balance change, in one statement
+APPEND = """
+    WITH bench AS (
+        SELECT w.wallet_id, row_number() OVER (ORDER BY w.wallet_id) AS n
+        FROM wallets w JOIN users u ON u.user_id = w.user_id
+        WHERE u.username LIKE 'bench_recon_%%'
+    ), rows AS (
+        SELECT b.wallet_id, (g %% 500) + 1 AS amount,
+               CASE WHEN g %% 3 = 0 THEN 'DEBIT' ELSE 'CREDIT' END AS transaction_type
+        FROM generate_series(1, %(rows)s) AS g
+        JOIN bench b ON b.n = 1 + (g * 7919) %% LEAST(%(wallets)s, (SELECT COUNT(*) FROM bench))
+    ), t AS (
+        INSERT INTO wallet_transactions (wallet_id, amount, transaction_type, category, description, created_at)
+        SELECT wallet_id, amount, transaction_type, 'BENCH', 'bench row', NOW() - INTERVAL '1 hour'
+        FROM rows
+    )
+    UPDATE wallets w SET balance = w.balance + d.delta, last_updated = NOW()
+    FROM (SELECT wallet_id,
+                 SUM(CASE WHEN transaction_type = 'CREDIT' THEN amount ELSE -amount END) AS delta
+          FROM rows GROUP BY wallet_id) d
+    WHERE w.wallet_id = d.wallet_id
+"""
+
+
+def setup(pool, wallets, transactions):
+    queries.ensure_schema(pool, queries.SCHEMA_STATEMENTS + ledger_reconciliation.SCHEMA_STATEMENTS)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+            INSERT INTO users (username, password, role)
+            SELECT 'bench_recon_' || g, 'bench', 'rider' FROM generate_series(1, %s) AS g
+            ON CONFLICT DO NOTHING
+        """, (wallets,))
+        cursor.execute("""
+            INSERT INTO wallets (user_id, balance, last_updated)
+            SELECT user_id, 0, NOW() FROM users WHERE username LIKE 'bench_recon_%%'
+            ON CONFLICT DO NOTHING
+        """)
+        cursor.execute("""
+            SELECT COUNT(*) AS n FROM wallet_transactions t
+            JOIN wallets w ON w.wallet_id = t.wallet_id
+            JOIN users u ON u.user_id = w.user_id
+            WHERE u.username LIKE 'bench_recon_%%'
+        """)
+        missing = transactions - cursor.fetchone()['n']
+        if missing > 0:
+            print(f"inserting {missing:,} transactions...")
+            cursor.execute(APPEND, {'rows': missing, 'wallets': wallets})
+        connection.commit()
+        cursor.execute("ANALYZE wallet_transactions")
+        cursor.execute("ANALYZE wallets")
+        connection.commit()
+
+
+def report(label, result):
+    print(f"{label:<14} {result['total_ms']:>10.1f} {result['wallets_checked']:>10,} "
+          f"{result['transactions_scanned']:>12,} {result['full_rechecks']:>8} {result['drifting']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wallets', type=int, default=10_000)
+    parser.add_argument('--transactions', type=int, default=5_000_000)
+    parser.add_argument('--delta', type=int, default=10_000)
+    parser.add_argument('--touched', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_config = {
+        'host': os.environ.get('DB_HOST'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD')
+    }
+    pool = ConnectionPool(db_config, minconn=1, maxconn=2,
+                          sslmode=os.environ.get('DB_SSLMODE', 'require'), cursor_factory=RealDictCursor)
+    setup(pool, args.wallets, args.transactions)
+    # Bench rows are backdated an hour, so they are settled immediately
+    reconciler = LedgerReconciler(batch_size=args.batch, settle_seconds=60)
+
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        started = time.perf_counter()
+        cursor.execute(FULL_SCAN)
+        drifting = cursor.fetchone()['drifting']
+        connection.rollback()
+        full_ms = (time.perf_counter() - started) * 1000
+
+        print(f"{'run':<14} {'ms':>10} {'wallets':>10} {'tx scanned':>12} {'rechecks':>8} {'drifting':>8}")
+        print(f"{'full scan':<14} {full_ms:>10.1f} {'-':>10} {args.transactions:>12,} {'-':>8} {drifting:>8}")
+
+        # Other wallets in the database are checked too; the numbers cover them
+        report('first run', reconciler.reconcile(connection))
+        report('idle run', reconciler.reconcile(connection))
+
+        cursor.execute(APPEND, {'rows': args.delta, 'wallets': args.touched})
+        connection.commit()
+        report('incremental', reconciler.reconcile(connection))
+
+        cursor.execute("""
+            UPDATE wallets SET balance = balance + 0.01, last_updated = NOW()
+            WHERE wallet_id = (SELECT w.wallet_id FROM wallets w JOIN users u ON u.user_id = w.user_id
+                               WHERE u.username = 'bench_recon_1')
+            RETURNING wallet_id
+        """)
+        corrupted = cursor.fetchone()['wallet_id']
+        connection.commit()
+        report('drift', reconciler.reconcile(connection))
+        flagged = [row['wallet_id'] for row in reconciler.drifting(cursor)]
+        print(f"wallet {corrupted} flagged: {corrupted in flagged}")
+
+        # Undo the corruption so reruns start clean
+        cursor.execute("UPDATE wallets SET balance = balance - 0.01 WHERE wallet_id = %s", (corrupted,))
+        connection.commit()
+        reconciler.reconcile(connection)
+    pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
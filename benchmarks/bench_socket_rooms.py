@@ -0,0 +1,90 @@
+"""Socket messages delivered per location update: everyone vs role rooms.
+
+Connects --admins dashboards and --riders rider apps to a python-socketio
+room manager, once the old way (every socket in FLEET_ROOM, status events
+broadcast to all) and once with socket_rooms.connect_rooms. Then each
+rider sends --updates fixes through LocationBroadcaster and goes offline
+once, and every delivery is counted.
+
+Usage: python benchmarks/bench_socket_rooms.py [--riders 2000] [--admins 10] [--updates 5]
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime
+
+import socketio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import socket_rooms  # noqa: E402
+from location_broadcaster import LocationBroadcaster  # noqa: E402
+from viewport_rooms import ViewportRooms, FLEET_ROOM  # noqa: E402
+
+LAT0, LNG0, SPAN = 12.75, 77.40, 0.4
+NAMESPACE = '/'
+
+
+class CountingSocketIO:
+    """Stands in for flask_socketio.SocketIO: counts deliveries instead of sending"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.deliveries = 0
+
+    def emit(self, event, data, to=None):
+        if to is None:
+            rooms = [None]
+        elif isinstance(to, str):
+            rooms = [to]
+        else:
+            rooms = list(to)
+        self.deliveries += len(list(self.manager.get_participants(NAMESPACE, rooms)))
+
+
+def run(mode, args):
+    manager = socketio.Server().manager
+    clients = [({'user_id': 1_000_000 + n, 'role': 'admin'}) for n in range(args.admins)] + \
+              [({'user_id': n, 'role': 'rider'}) for n in range(args.riders)]
+    for claims in clients:
+        sid = f"s{claims['user_id']}"
+        manager.basic_enter_room(sid, NAMESPACE, None, eio_sid=sid)
+        rooms = [FLEET_ROOM] if mode == 'before' else socket_rooms.connect_rooms(claims)
+        for room in rooms:
+            manager.basic_enter_room(sid, NAMESPACE, room, eio_sid=sid)
+
+    sio = CountingSocketIO(manager)
+    broadcaster = LocationBroadcaster(sio, ViewportRooms(), min_interval=0, min_distance_m=0)
+    rnd = random.Random(3)
+    fixes = 0
+    for _ in range(args.updates):
+        for rider in range(args.riders):
+            broadcaster.publish(rider, LAT0 + rnd.random() * SPAN, LNG0 + rnd.random() * SPAN, datetime.now())
+            fixes += 1
+        broadcaster.flush()
+    location_deliveries = sio.deliveries
+
+    # One offline event per rider
+    for rider in range(args.riders):
+        sio.emit('rider_status_changed', {}, to=None if mode == 'before' else socket_rooms.status_rooms(rider))
+    status_deliveries = sio.deliveries - location_deliveries
+    return fixes, location_deliveries, status_deliveries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--riders', type=int, default=2000)
+    parser.add_argument('--admins', type=int, default=10)
+    parser.add_argument('--updates', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.riders} riders, {args.admins} dashboards, {args.updates} fixes per rider "
+          f"(one per tick, batches and legacy events on)")
+    print(f"{'mode':<8} {'location msgs':>14} {'per fix':>9} {'status msgs':>12} {'per change':>11}")
+    for mode in ('before', 'after'):
+        fixes, locations, statuses = run(mode, args)
+        print(f"{mode:<8} {locations:>14,} {locations / fixes:>9.1f} {statuses:>12,} {statuses / args.riders:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Nearest-rider queries: grid index vs brute-force scan vs SQL.
+
+Generates N riders spread over a city-sized box and times k-nearest and
+within-radius queries. Pass --sql to also time the equivalent haversine
+query in Postgres (loads the points into a temp table; uses the DB_*
+variables from .env).
+
+Usage: python benchmarks/bench_spatial_index.py [--riders 50000] [--queries 1000] [--k 10] [--radius 2] [--sql]
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from spatial_index import GridIndex, haversine_km  # noqa: E402
+
+# Roughly a 45 km x 45 km metro area
+LAT0, LNG0, SPAN = 12.75, 77.40, 0.4
+
+SQL_KNN = """
+    SELECT user_id, dist FROM (
+        SELECT user_id,
+               2 * 6371.0088 * asin(sqrt(
+                   power(sin(radians(latitude - %(lat)s) / 2), 2) +
+                   cos(radians(%(lat)s)) * cos(radians(latitude)) *
+                   power(sin(radians(longitude - %(lng)s) / 2), 2))) AS dist
+        FROM bench_riders
+    ) d
+    WHERE dist <= %(radius)s
+    ORDER BY dist
+    LIMIT %(k)s
+"""
+
+
+def timed(label, queries, fn):
+    started = time.perf_counter()
+    for q in queries:
+        fn(*q)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {elapsed / len(queries) * 1000:10.4f} ms/query")
+
+
+def run_sql(points, queries, k, radius):
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    connection = psycopg2.connect(
+        host=os.environ.get('DB_HOST'), port=int(os.environ.get('DB_PORT', 5432)),
+        dbname=os.environ.get('DB_NAME'), user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'), sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE bench_riders (user_id INTEGER, latitude DOUBLE PRECISION, longitude DOUBLE PRECISION)")
+        from psycopg2.extras import execute_values
+        execute_values(cursor, "INSERT INTO bench_riders VALUES %s", points, page_size=5000)
+        cursor.execute("ANALYZE bench_riders")
+
+        def knn(lat, lng):
+            cursor.execute(SQL_KNN, {'lat': lat, 'lng': lng, 'radius': radius, 'k': k})
+            cursor.fetchall()
+
+        timed(f"sql knn k={k} (incl. round trip)", queries[:100], knn)
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--riders', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--radius', type=float, default=2.0)
+    parser.add_argument('--cell', type=float, default=0.01)
+    parser.add_argument('--sql', action='store_true')
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    points = [(i, LAT0 + rnd.random() * SPAN, LNG0 + rnd.random() * SPAN) for i in range(args.riders)]
+    queries = [(LAT0 + rnd.random() * SPAN, LNG0 + rnd.random() * SPAN) for _ in range(args.queries)]
+
+    index = GridIndex(cell_deg=args.cell)
+    started = time.perf_counter()
+    index.rebuild(points)
+    print(f"built grid of {len(index)} riders in {(time.perf_counter() - started) * 1000:.1f} ms ({index.stats()['cells']} cells)")
+
+    def brute_knn(lat, lng):
+        heapq.nsmallest(args.k, ((haversine_km(lat, lng, plat, plng), uid) for uid, plat, plng in points))
+
+    def brute_within(lat, lng):
+        [uid for uid, plat, plng in points if haversine_km(lat, lng, plat, plng) <= args.radius]
+
+    timed(f"grid knn k={args.k}", queries, lambda lat, lng: index.nearest(lat, lng, args.k, max_radius_km=args.radius))
+    timed(f"grid within {args.radius} km", queries, lambda lat, lng: index.within(lat, lng, args.radius))
+    timed(f"brute-force knn k={args.k}", queries[:50], brute_knn)
+    timed(f"brute-force within {args.radius} km", queries[:50], brute_within)
+
+    update_started = time.perf_counter()
+    for uid, plat, plng in points[:10000]:
+        index.update(uid, plat + 0.0005, plng + 0.0005)
+    print(f"{'grid incremental update':<34} {(time.perf_counter() - update_started) / 10000 * 1e6:10.2f} us/update")
+
+    if args.sql:
+        run_sql(points, queries, args.k, args.radius)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Outbound socket messages per location fix: broadcast vs viewport rooms.
+
+Registers D dashboards in a python-socketio room manager, each subscribed
+to a random viewport (neighbourhood to city zoom), then sends F fixes from
+R riders spread over the metro area and counts deliveries. Bytes are
+estimated from the JSON payload size of the two legacy events.
+
+Usage: python benchmarks/bench_viewport_fanout.py [--riders 5000] [--dashboards 200] [--fixes 20000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import socketio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from viewport_rooms import ViewportRooms, FLEET_ROOM  # noqa: E402
+
+LAT0, LNG0, SPAN = 12.75, 77.40, 0.4
+NAMESPACE = '/'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--riders', type=int, default=5000)
+    parser.add_argument('--dashboards', type=int, default=200)
+    parser.add_argument('--fixes', type=int, default=20000)
+    parser.add_argument('--cell', type=float, default=0.05)
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    viewports = ViewportRooms(cell_deg=args.cell)
+    manager = socketio.Server().manager
+
+    area = 0.0
+    for n in range(args.dashboards):
+        sid = f'dash{n}'
+        manager.basic_enter_room(sid, NAMESPACE, None, eio_sid=sid)
+        manager.basic_enter_room(sid, NAMESPACE, FLEET_ROOM, eio_sid=sid)
+        # Viewport sides between ~1 km and the whole city
+        side = rnd.choice([0.01, 0.02, 0.05, 0.1, 0.2, 0.4])
+        lat = LAT0 + rnd.random() * (SPAN - side)
+        lng = LNG0 + rnd.random() * (SPAN - side)
+        area += side * side
+        joined, left = viewports.subscribe(sid, lat, lng, lat + side, lng + side)
+        for room in joined:
+            manager.basic_enter_room(sid, NAMESPACE, room, eio_sid=sid)
+        for room in left:
+            manager.basic_leave_room(sid, NAMESPACE, room)
+
+    riders = [(LAT0 + rnd.random() * SPAN, LNG0 + rnd.random() * SPAN) for _ in range(args.riders)]
+    payload = {'user_id': 12345, 'rider_id': 12345, 'latitude': 12.971598, 'longitude': 77.594566,
+               'timestamp': '2026-10-18T09:15:27.123456'}
+    bytes_per_message = 2 * len(json.dumps(payload))  # two events per fix
+
+    broadcast_deliveries = args.fixes * args.dashboards
+    room_deliveries = 0
+    started = time.perf_counter()
+    for _ in range(args.fixes):
+        lat, lng = rnd.choice(riders)
+        room_deliveries += sum(1 for _ in manager.get_participants(NAMESPACE, viewports.location_rooms(lat, lng)))
+    elapsed = time.perf_counter() - started
+
+    print(f"riders={args.riders} dashboards={args.dashboards} fixes={args.fixes} cell={args.cell} deg")
+    print(f"mean visible area:          {area / args.dashboards / SPAN ** 2 * 100:6.2f}% of the metro box")
+    print(f"broadcast deliveries/fix:   {broadcast_deliveries / args.fixes:8.2f}  "
+          f"({broadcast_deliveries * bytes_per_message / 1e6:,.1f} MB)")
+    print(f"viewport deliveries/fix:    {room_deliveries / args.fixes:8.2f}  "
+          f"({room_deliveries * bytes_per_message / 1e6:,.1f} MB)")
+    print(f"reduction:                  {broadcast_deliveries / max(room_deliveries, 1):8.1f}x")
+    print(f"room resolution cost:       {elapsed / args.fixes * 1e6:8.2f} us/fix")
+
+
+if __name__ == '__main__':
+    main()
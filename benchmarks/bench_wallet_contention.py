@@ -0,0 +1,143 @@
+"""Throughput of concurrent deductions that all credit the same admin wallet.
+
+Runs --workers greenlets, each deducting from its own rider and crediting
+one shared admin, for --seconds per scheme:
+
+    direct     UPDATE wallets for the admin in every deduction (row lock)
+    journaled  admin credit appended to wallet_credit_journal, folded later
+
+--hold-ms keeps each transaction open a little longer before COMMIT, the
+way network latency to the app server would. After each run the journal
+is folded and the ledger invariant (balance == credits - debits) is
+checked for every wallet the run touched.
+
+Creates users bench_admin and bench_rider_<n> if missing; point it at a
+scratch database. Runs rider_backend's schema setup first.
+
+Usage: python benchmarks/bench_wallet_contention.py [--workers 32] [--seconds 10] [--hold-ms 0]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import queries  # noqa: E402
+from db_pool import ConnectionPool, configure_green_mode  # noqa: E402
+from wallet_journal import CreditJournal  # noqa: E402
+
+SCHEMES = {'direct': 'wallet_deduct', 'journaled': 'wallet_deduct_journaled'}
+
+
+def ensure_user(cursor, username, role):
+    cursor.execute("SELECT user_id FROM users WHERE username = %s", (username,))
+    row = cursor.fetchone()
+    if row:
+        return row['user_id']
+    cursor.execute("INSERT INTO users (username, password, role) VALUES (%s, 'bench', %s) RETURNING user_id",
+                   (username, role))
+    return cursor.fetchone()['user_id']
+
+
+def setup(pool, workers):
+    queries.ensure_schema(pool)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        admin_id = ensure_user(cursor, 'bench_admin', 'admin')
+        rider_ids = [ensure_user(cursor, f'bench_rider_{n}', 'rider') for n in range(workers)]
+        for user_id in [admin_id] + rider_ids:
+            queries.execute(cursor, 'create_wallet', (user_id,))
+        connection.commit()
+    return admin_id, rider_ids
+
+
+def check_ledger(pool, user_ids):
+    """Wallets whose balance (plus pending journal credits) differs from the ledger"""
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT w.user_id, w.balance
+                   + COALESCE((SELECT SUM(amount) FROM wallet_credit_journal j WHERE j.wallet_id = w.wallet_id), 0)
+                   AS balance,
+                   COALESCE((SELECT SUM(CASE WHEN transaction_type = 'CREDIT' THEN amount ELSE -amount END)
+                             FROM wallet_transactions t WHERE t.wallet_id = w.wallet_id), 0) AS ledger
+            FROM wallets w
+            WHERE w.user_id = ANY(%s)
+        """, (list(user_ids),))
+        return [row for row in cursor.fetchall() if row['balance'] != row['ledger']]
+
+
+def run(scheme, pool, admin_id, rider_ids, seconds, hold_ms):
+    statement = SCHEMES[scheme]
+    latencies = []
+    stop_at = time.monotonic() + seconds
+
+    def worker(rider_id):
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            with pool.connection() as connection:
+                cursor = connection.cursor()
+                queries.execute(cursor, statement, (
+                    rider_id, admin_id, Decimal('1.00'), 'BENCH', 'contention benchmark', f'From Rider {rider_id}'
+                )).fetchone()
+                if hold_ms:
+                    cursor.execute("SELECT pg_sleep(%s)", (hold_ms / 1000,))
+                connection.commit()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.monotonic()
+    threads = [eventlet.spawn(worker, rider_id) for rider_id in rider_ids]
+    for t in threads:
+        t.wait()
+    elapsed = time.monotonic() - started
+
+    journal = CreditJournal(batch_size=100000)
+    with pool.connection() as connection:
+        while journal.fold(connection):
+            pass
+    mismatched = check_ledger(pool, [admin_id] + rider_ids)
+
+    latencies.sort()
+    count = len(latencies)
+    p50 = latencies[count // 2] if count else 0
+    p99 = latencies[min(count - 1, int(count * 0.99))] if count else 0
+    print(f"{scheme:>10}: {count:>7} deductions in {elapsed:.2f}s ({count / elapsed:,.0f}/s) "
+          f"p50 {p50:.1f} ms  p99 {p99:.1f} ms  ledger {'OK' if not mismatched else f'MISMATCH {mismatched}'}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--hold-ms', type=float, default=0.0)
+    parser.add_argument('--schemes', default='direct,journaled')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_config = {
+        'host': os.environ.get('DB_HOST'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD')
+    }
+    pool = ConnectionPool(db_config, minconn=args.workers + 1, maxconn=args.workers + 1,
+                          sslmode=os.environ.get('DB_SSLMODE', 'require'),
+                          cursor_factory=configure_green_mode('wait_callback'))
+    pool.prefill()
+    admin_id, rider_ids = setup(pool, args.workers)
+    for scheme in args.schemes.split(','):
+        run(scheme, pool, admin_id, rider_ids, args.seconds, args.hold_ms)
+    pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Latency of deep wallet-history pages: keyset cursor vs OFFSET.
+
+Fills the wallet of user bench_history with --rows transactions (once;
+reruns reuse them), creates the keyset index and then times fetching page
+N for several N both ways. Keyset should stay flat; OFFSET grows with N.
+
+Creates user bench_history if missing; point it at a scratch database.
+
+Usage: python benchmarks/bench_wallet_pagination.py [--rows 1000000] [--limit 20] [--pages 1,10,100,1000,10000,49999]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import queries  # noqa: E402
+import wallet_history  # noqa: E402
+from db_pool import ConnectionPool  # noqa: E402
+
+OFFSET_PAGE = """
+    SELECT t.transaction_id, t.amount, t.transaction_type, t.category, t.description, t.created_at
+    FROM wallet_transactions t
+    WHERE t.wallet_id = (SELECT wallet_id FROM wallets WHERE user_id = %s)
+    ORDER BY t.created_at DESC, t.transaction_id DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def setup(pool, rows):
+    queries.ensure_schema(pool, queries.SCHEMA_STATEMENTS + wallet_history.SCHEMA_STATEMENTS)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT user_id FROM users WHERE username = 'bench_history'")
+        row = cursor.fetchone()
+        if row:
+            user_id = row['user_id']
+        else:
+            cursor.execute("INSERT INTO users (username, password, role) VALUES ('bench_history', 'bench', 'rider') "
+                           "RETURNING user_id")
+            user_id = cursor.fetchone()['user_id']
+        queries.execute(cursor, 'create_wallet', (user_id,))
+        cursor.execute("SELECT wallet_id FROM wallets WHERE user_id = %s", (user_id,))
+        wallet_id = cursor.fetchone()['wallet_id']
+        cursor.execute("SELECT COUNT(*) AS n FROM wallet_transactions WHERE wallet_id = %s", (wallet_id,))
+        missing = rows - cursor.fetchone()['n']
+        if missing > 0:
+            print(f"inserting {missing:,} transactions...")
+            cursor.execute("""
+                INSERT INTO wallet_transactions
+                (wallet_id, amount, transaction_type, category, description, performed_by, created_at)
+                SELECT %s, (g %% 500) + 1,
+                       CASE WHEN g %% 3 = 0 THEN 'CREDIT' ELSE 'DEBIT' END,
+                       (ARRAY['FEE', 'FUEL', 'RECHARGE', 'PENALTY'])[1 + g %% 4],
+                       'bench row ' || g, %s,
+                       NOW() - make_interval(secs => g * 7)
+                FROM generate_series(1, %s) AS g
+            """, (wallet_id, user_id, missing))
+        connection.commit()
+        cursor.execute("ANALYZE wallet_transactions")
+        connection.commit()
+    return user_id
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--pages', default='1,10,100,1000,10000,49999')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_config = {
+        'host': os.environ.get('DB_HOST'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD')
+    }
+    pool = ConnectionPool(db_config, minconn=1, maxconn=2,
+                          sslmode=os.environ.get('DB_SSLMODE', 'require'), cursor_factory=RealDictCursor)
+    user_id = setup(pool, args.rows)
+
+    print(f"{'page':>8} {'keyset ms':>10} {'offset ms':>10}")
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        for page in (int(p) for p in args.pages.split(',')):
+            offset = (page - 1) * args.limit
+            after = None
+            if offset:
+                # Cursor of the last row of the previous page (setup, not timed)
+                cursor.execute(OFFSET_PAGE, (user_id, 1, offset - 1))
+                last = cursor.fetchone()
+                if last is None:
+                    print(f"{page:>8} beyond the end of the history")
+                    continue
+                after = wallet_history.encode_cursor(last['created_at'], last['transaction_id'])
+
+            keyset_ms = timed(lambda: wallet_history.transactions_page(cursor, user_id, args.limit, after), args.repeat)
+
+            def offset_page():
+                cursor.execute(OFFSET_PAGE, (user_id, args.limit, offset))
+                cursor.fetchall()
+            offset_ms = timed(offset_page, args.repeat)
+            connection.rollback()
+            print(f"{page:>8} {keyset_ms:>10.2f} {offset_ms:>10.2f}")
+    pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Riders watching their balance: polling /api/wallet/details vs 'wallet_updated' push.
+
+Runs rider_backend in-process (Flask and Socket.IO test clients). For
+--seconds, an admin recharges random riders at --changes per second while
+--riders riders follow their balance either by
+
+    polling   GET /api/wallet/details/<id> every --poll seconds
+    push      one authenticated socket each, listening for 'wallet_updated'
+
+and reports requests, DB round trips, bytes to the riders and how long a
+change took to reach the rider's screen.
+
+Creates users bench_admin and bench_push_<n> if missing; point it at a
+scratch database.
+
+Usage: python benchmarks/bench_wallet_push.py [--riders 200] [--seconds 20] [--changes 5] [--poll 5]
+Reads the same DB_* variables as rider_backend.py.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import rider_backend  # noqa: E402
+
+
+def ensure_user(cursor, username, role):
+    cursor.execute("SELECT user_id FROM users WHERE username = %s", (username,))
+    row = cursor.fetchone()
+    if row:
+        return row['user_id']
+    cursor.execute("INSERT INTO users (username, password, role) VALUES (%s, 'bench', %s) RETURNING user_id",
+                   (username, role))
+    return cursor.fetchone()['user_id']
+
+
+def setup(riders):
+    with rider_backend.db_pool.connection() as connection:
+        cursor = connection.cursor()
+        admin_id = ensure_user(cursor, 'bench_admin', 'admin')
+        rider_ids = [ensure_user(cursor, f'bench_push_{n}', 'rider') for n in range(riders)]
+        connection.commit()
+    return admin_id, rider_ids
+
+
+def admin_loop(http, admin_token, rider_ids, changes, deadline, changed_at):
+    """Recharge random riders; changed_at[rider] = time the change committed"""
+    rnd = random.Random(11)
+    headers = {'Authorization': f'Bearer {admin_token}'}
+    while time.time() < deadline:
+        rider_id = rnd.choice(rider_ids)
+        response = http.post('/api/wallet/recharge', headers=headers,
+                             json={'rider_id': rider_id, 'amount': '1.00', 'description': 'bench'})
+        if response.status_code == 200:
+            changed_at.setdefault(rider_id, []).append((time.time(), response.get_json()['new_balance']))
+        eventlet.sleep(1.0 / changes)
+
+
+def seen(changed_at, rider_id, balance, now, latencies):
+    # Every change up to this balance is now visible to the rider
+    pending = changed_at.get(rider_id, [])
+    while pending and pending[0][1] <= balance:
+        latencies.append(now - pending.pop(0)[0])
+
+
+def run_polling(rider_ids, admin_token, args):
+    app = rider_backend.app
+    changed_at, latencies, stats = {}, [], {'requests': 0, 'bytes': 0}
+    deadline = time.time() + args.seconds
+
+    def rider(rider_id):
+        http = app.test_client()
+        eventlet.sleep(random.random() * args.poll)
+        while time.time() < deadline:
+            response = http.get(f'/api/wallet/details/{rider_id}')
+            stats['requests'] += 1
+            stats['bytes'] += len(response.data)
+            seen(changed_at, rider_id, response.get_json()['balance'], time.time(), latencies)
+            eventlet.sleep(args.poll)
+
+    pool = eventlet.GreenPool(len(rider_ids) + 1)
+    for rider_id in rider_ids:
+        pool.spawn(rider, rider_id)
+    pool.spawn(admin_loop, app.test_client(), admin_token, rider_ids, args.changes, deadline, changed_at)
+    pool.waitall()
+    return stats, latencies
+
+
+def run_push(rider_ids, admin_token, args):
+    app, socketio = rider_backend.app, rider_backend.socketio
+    changed_at, latencies, stats = {}, [], {'requests': 0, 'bytes': 0}
+    clients = {rider_id: socketio.test_client(app, auth={'token': rider_backend.session_tokens.issue(rider_id, 'rider')})
+               for rider_id in rider_ids}
+    for client in clients.values():
+        client.get_received()
+    deadline = time.time() + args.seconds
+
+    def drain():
+        # Test clients buffer events; collect them as a phone would receive them
+        while time.time() < deadline + 1:
+            now = time.time()
+            for rider_id, client in clients.items():
+                for event in client.get_received():
+                    if event['name'] != 'wallet_updated':
+                        continue
+                    stats['bytes'] += len(json.dumps(event['args'][0]))
+                    stats['requests'] += 1
+                    seen(changed_at, rider_id, event['args'][0]['balance'], now, latencies)
+            eventlet.sleep(0.01)
+
+    pool = eventlet.GreenPool(2)
+    pool.spawn(drain)
+    pool.spawn(admin_loop, app.test_client(), admin_token, rider_ids, args.changes, deadline, changed_at)
+    pool.waitall()
+    for client in clients.values():
+        client.disconnect()
+    return stats, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--changes', type=float, default=5, help='balance changes per second, all riders')
+    parser.add_argument('--poll', type=float, default=5, help='polling interval per rider, seconds')
+    args = parser.parse_args()
+
+    admin_id, rider_ids = setup(args.riders)
+    admin_token = rider_backend.session_tokens.issue(admin_id, 'admin')
+
+    print(f"{'mode':<8} {'msgs':>8} {'KB':>10} {'details rt':>11} {'p50 ms':>9} {'p95 ms':>9}")
+    for mode, run in (('polling', run_polling), ('push', run_push)):
+        before = rider_backend.round_trips.stats().get('get_wallet_details', {}).get('round_trips', 0)
+        stats, latencies = run(rider_ids, admin_token, args)
+        after = rider_backend.round_trips.stats().get('get_wallet_details', {}).get('round_trips', 0)
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000 if latencies else float('nan')
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float('nan')
+        print(f"{mode:<8} {stats['requests']:>8,} {stats['bytes'] / 1024:>10.1f} {after - before:>11,} "
+              f"{p50:>9.1f} {p95:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+GREEN_MODES = ('wait_callback', 'tpool', 'off')
+
+
+def eventlet_wait_callback(connection, timeout=-1):
+    """psycopg2 wait callback that parks the greenlet on the socket.
+
+    With this installed libpq runs in non-blocking mode and every network
+    wait goes through the eventlet hub, so a slow query only suspends the
+    greenlet that issued it.
+    """
+    from eventlet.hubs import trampoline
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            trampoline(connection.fileno(), read=True)
+        elif state == extensions.POLL_WRITE:
+            trampoline(connection.fileno(), write=True)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+
+class TpoolCursor(RealDictCursor):
+    """Cursor that runs blocking calls on eventlet's native thread pool.
+
+    The pool is bounded by EVENTLET_THREADPOOL_SIZE (default 20).
+    """
+
+    def execute(self, query, vars=None):
+        from eventlet import tpool
+        return tpool.execute(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        from eventlet import tpool
+        return tpool.execute(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        from eventlet import tpool
+        return tpool.execute(super().copy_expert, sql, file, size)
+
+
+def configure_green_mode(mode):
+    """Select how psycopg2 waits cooperate with eventlet.
+
+    'wait_callback' makes libpq non-blocking and yields to the hub (note:
+    COPY is not available in this mode), 'tpool' offloads execute() to
+    native threads, 'off' keeps plain blocking calls. Returns the cursor
+    factory pooled connections should use.
+    """
+    if mode not in GREEN_MODES:
+        raise ValueError(f"Unknown DB green mode '{mode}', expected one of {GREEN_MODES}")
+
+    extensions.set_wait_callback(eventlet_wait_callback if mode == 'wait_callback' else None)
+    logger.info(f"Database green mode: {mode}")
+    return TpoolCursor if mode == 'tpool' else RealDictCursor
+
+
+class RoundTripStats:
+    """Counts statements (and commits/rollbacks) sent to Postgres per endpoint.
+
+    hit() is called by pooled cursors and connections; begin()/end() bracket
+    one request. threading.local is greenlet-local under eventlet.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._by_endpoint = {}  # endpoint -> [requests, round_trips, max]
+
+    def begin(self):
+        self._local.count = 0
+
+    def hit(self):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def end(self, endpoint):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        with self._lock:
+            entry = self._by_endpoint.setdefault(endpoint, [0, 0, 0])
+            entry[0] += 1
+            entry[1] += count
+            entry[2] = max(entry[2], count)
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': requests,
+                    'round_trips': trips,
+                    'avg_per_request': round(trips / requests, 2) if requests else 0,
+                    'max_per_request': most
+                }
+                for endpoint, (requests, trips, most) in sorted(self._by_endpoint.items())
+            }
+
+
+def counting_cursor(cursor_factory, round_trips):
+    """Subclass cursor_factory so every execute is reported to round_trips"""
+    class CountingCursor(cursor_factory):
+        def execute(self, query, vars=None):
+            round_trips.hit()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            round_trips.hit()
+            return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            round_trips.hit()
+            return super().copy_expert(sql, file, size)
+
+    CountingCursor.__name__ = f'Counting{cursor_factory.__name__}'
+    return CountingCursor
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection that remembers its server-side prepared statements"""
+
+    round_trips = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+    def _count_end_of_transaction(self):
+        if self.round_trips is not None and self.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            self.round_trips.hit()
+
+    def commit(self):
+        self._count_end_of_transaction()
+        super().commit()
+
+    def rollback(self):
+        self._count_end_of_transaction()
+        super().rollback()
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be acquired within the timeout"""
+
+
+class ConnectionPool:
+    """Bounded PostgreSQL connection pool shared by all request handlers.
+
+    Uses threading primitives, so after eventlet.monkey_patch() waiting for a
+    connection parks the greenlet instead of blocking the hub.
+    """
+
+    def __init__(self, db_config, minconn=1, maxconn=10, acquire_timeout=5.0,
+                 max_uses=1000, idle_check_after=30.0, sslmode='require',
+                 cursor_factory=RealDictCursor, round_trips=None):
+        self.db_config = db_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_uses = max_uses
+        self.idle_check_after = idle_check_after
+        self.sslmode = sslmode
+        self.round_trips = round_trips
+        self.cursor_factory = counting_cursor(cursor_factory, round_trips) if round_trips else cursor_factory
+        self._connection_factory = type('PooledConnection', (PooledConnection,), {'round_trips': round_trips})
+
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, returned_at)
+        self._uses = {}  # id(connection) -> checkouts served
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._acquired = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        connection = psycopg2.connect(**self.db_config, connection_factory=self._connection_factory,
+                                      cursor_factory=self.cursor_factory, sslmode=self.sslmode)
+        self._uses[id(connection)] = 0
+        logger.info("Database connection established (pool)")
+        return connection
+
+    def _drop(self, connection):
+        """Close a connection and forget it. Caller holds the lock."""
+        self._uses.pop(id(connection), None)
+        self._size -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_reusable(connection):
+        """Local checks only; no round trip"""
+        return not connection.closed and connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+
+    @staticmethod
+    def _ping(connection):
+        """Round trip on a connection idle for a while: the server or a load balancer may have dropped it"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def prefill(self):
+        """Open minconn connections up front (best effort)"""
+        with self._cond:
+            while self._size < self.minconn:
+                self._size += 1
+                try:
+                    self._idle.append((self._connect(), time.monotonic()))
+                except Exception as e:
+                    self._size -= 1
+                    logger.error(f"Pool prefill failed: {e}")
+                    break
+
+    def getconn(self):
+        """Check out a healthy connection, waiting up to acquire_timeout"""
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                while self._idle:
+                    connection, returned_at = self._idle.pop()
+                    if self._is_reusable(connection):
+                        if time.monotonic() - returned_at < self.idle_check_after:
+                            break
+                        # The connection is ours now; ping it outside the lock, like _connect,
+                        # so other greenlets are not held up by the round trip (or a dead peer)
+                        self._cond.release()
+                        try:
+                            healthy = self._ping(connection)
+                        finally:
+                            self._cond.acquire()
+                        if healthy:
+                            break
+                    self._discarded += 1
+                    self._drop(connection)
+                else:
+                    connection = None
+
+                if connection is None and self._size < self.maxconn:
+                    # Reserve the slot, connect outside the lock
+                    self._size += 1
+                    self._cond.release()
+                    try:
+                        connection = self._connect()
+                    except Exception:
+                        self._cond.acquire()
+                        self._size -= 1
+                        self._cond.notify()
+                        raise
+                    self._cond.acquire()
+
+                if connection is not None:
+                    waited = time.monotonic() - started
+                    self._in_use += 1
+                    self._acquired += 1
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+                    self._uses[id(connection)] = self._uses.get(id(connection), 0) + 1
+                    return connection
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"Timed out after {self.acquire_timeout}s waiting for a database connection")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def putconn(self, connection, discard=False):
+        """Return a connection to the pool, recycling it if needed"""
+        if not discard and not connection.closed:
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or connection.closed or self._closed:
+                self._discarded += 1
+                self._drop(connection)
+            elif self._uses.get(id(connection), 0) >= self.max_uses:
+                self._recycled += 1
+                self._drop(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager handing out a pooled connection.
+
+        Uncommitted work is rolled back on exit; a connection that failed at
+        the connection level is discarded instead of returned.
+        """
+        connection = self.getconn()
+        discard = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(connection, discard=discard)
+
+    def stats(self):
+        """Snapshot of pool saturation and wait times"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'saturation': round(self._in_use / self.maxconn, 3) if self.maxconn else 0,
+                'acquired_total': self._acquired,
+                'timeouts_total': self._timeouts,
+                'recycled_total': self._recycled,
+                'discarded_total': self._discarded,
+                'wait_avg_ms': round(self._wait_total / self._acquired * 1000, 3) if self._acquired else 0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._drop(connection)
+            self._idle = []
+            self._cond.notify_all()
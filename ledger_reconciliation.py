@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_LOCK_KEY = 'wallet_reconciliation'
+
+SCHEMA_STATEMENTS = [
+    # Per wallet: ledger sum up to last_transaction_id, and the outcome of the last check
+    """
+    CREATE TABLE IF NOT EXISTS wallet_reconciliation (
+        wallet_id INTEGER PRIMARY KEY REFERENCES wallets(wallet_id),
+        last_transaction_id INTEGER NOT NULL,
+        ledger_sum DECIMAL(14, 2) NOT NULL,
+        balance DECIMAL(14, 2) NOT NULL,
+        drift DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        status VARCHAR(10) NOT NULL,
+        checked_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS wallet_reconciliation_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        watermark INTEGER NOT NULL,
+        last_run_started TIMESTAMP
+    )
+    """,
+    # Lets "transactions of this wallet after its checkpoint" read only the new rows
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wallet_transactions_wallet_id_seq
+    ON wallet_transactions (wallet_id, transaction_id)
+    INCLUDE (amount, transaction_type)
+    """,
+]
+
+# Wallets worth checking this run: new ledger rows, balance writes since the
+# last run (with the same settle margin) and wallets already flagged
+CANDIDATES = """
+    SELECT wallet_id FROM wallet_transactions WHERE transaction_id > %(watermark)s
+    UNION
+    SELECT wallet_id FROM wallets
+    WHERE %(since)s IS NULL OR last_updated IS NULL OR last_updated >= %(since)s
+    UNION
+    SELECT wallet_id FROM wallet_reconciliation WHERE status = 'drift'
+"""
+
+# Highest id old enough that no transaction allocating a lower id should still be open
+SETTLED_UPTO = """
+    SELECT COALESCE(MAX(transaction_id), %(watermark)s) AS settled
+    FROM wallet_transactions
+    WHERE transaction_id > %(watermark)s
+      AND (created_at IS NULL OR created_at < NOW() - make_interval(secs => %(settle)s))
+"""
+
+# Balance and ledger in one statement, so both come from the same snapshot.
+# delta_all covers every visible row after the checkpoint; the checkpoint only
+# advances over settled rows (delta_settled / settled_last).
+CHECK_BATCH = """
+    WITH k AS (
+        SELECT c.wallet_id, COALESCE(r.last_transaction_id, 0) AS last_id,
+               COALESCE(r.ledger_sum, 0) AS ledger_sum
+        FROM unnest(%(wallet_ids)s::integer[]) AS c (wallet_id)
+        LEFT JOIN wallet_reconciliation r ON r.wallet_id = c.wallet_id
+    ), n AS (
+        SELECT k.wallet_id,
+               COALESCE(SUM(CASE WHEN t.transaction_type = 'CREDIT' THEN t.amount ELSE -t.amount END), 0)
+                   AS delta_all,
+               COALESCE(SUM(CASE WHEN t.transaction_type = 'CREDIT' THEN t.amount ELSE -t.amount END)
+                        FILTER (WHERE t.transaction_id <= %(settled)s), 0) AS delta_settled,
+               MAX(t.transaction_id) FILTER (WHERE t.transaction_id <= %(settled)s) AS settled_last,
+               COUNT(t.transaction_id) AS scanned
+        FROM k
+        LEFT JOIN wallet_transactions t ON t.wallet_id = k.wallet_id AND t.transaction_id > k.last_id
+        GROUP BY k.wallet_id
+    )
+    SELECT k.wallet_id, k.last_id, k.ledger_sum, n.delta_all, n.delta_settled, n.settled_last, n.scanned,
+           w.balance + COALESCE((
+               SELECT SUM(j.amount) FROM wallet_credit_journal j WHERE j.wallet_id = k.wallet_id
+           ), 0) AS balance
+    FROM k
+    JOIN n ON n.wallet_id = k.wallet_id
+    JOIN wallets w ON w.wallet_id = k.wallet_id
+"""
+
+# Slow path for a wallet that looks off: recompute its whole ledger
+FULL_CHECK = """
+    SELECT COALESCE(SUM(CASE WHEN t.transaction_type = 'CREDIT' THEN t.amount ELSE -t.amount END), 0) AS ledger_all,
+           COALESCE(SUM(CASE WHEN t.transaction_type = 'CREDIT' THEN t.amount ELSE -t.amount END)
+                    FILTER (WHERE t.transaction_id <= %(settled)s), 0) AS ledger_settled,
+           MAX(t.transaction_id) FILTER (WHERE t.transaction_id <= %(settled)s) AS settled_last,
+           COUNT(t.transaction_id) AS scanned,
+           (SELECT w.balance + COALESCE((
+                SELECT SUM(j.amount) FROM wallet_credit_journal j WHERE j.wallet_id = w.wallet_id
+            ), 0) FROM wallets w WHERE w.wallet_id = %(wallet_id)s) AS balance
+    FROM wallet_transactions t
+    WHERE t.wallet_id = %(wallet_id)s
+"""
+
+SAVE_CHECKPOINTS = """
+    INSERT INTO wallet_reconciliation
+    (wallet_id, last_transaction_id, ledger_sum, balance, drift, status, checked_at)
+    VALUES %s
+    ON CONFLICT (wallet_id) DO UPDATE SET
+        last_transaction_id = EXCLUDED.last_transaction_id,
+        ledger_sum = EXCLUDED.ledger_sum,
+        balance = EXCLUDED.balance,
+        drift = EXCLUDED.drift,
+        status = EXCLUDED.status,
+        checked_at = EXCLUDED.checked_at
+"""
+
+
+class LedgerReconciler:
+    """Checks wallets.balance against the sum of wallet_transactions, incrementally.
+
+    Each wallet keeps a checkpoint (last transaction_id and the ledger sum up
+    to it), so a run only reads ledger rows added since, and only for wallets
+    that changed. Checks run in short batches of plain reads; nothing is
+    locked beyond the checkpoint rows being written.
+
+    Ids are allocated before commit, so a slow transaction can commit a lower
+    id after a higher one was checked. Checkpoints therefore only advance over
+    rows older than settle_seconds, and a wallet that looks off is recomputed
+    from its full ledger before it is flagged as drifting.
+    """
+
+    def __init__(self, interval=300.0, batch_size=500, settle_seconds=300):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self._lock = threading.Lock()
+        self._last_run = {}
+        self._counters = {
+            'runs': 0,
+            'run_failures': 0,
+            'skipped_locked': 0,
+            'full_rechecks': 0
+        }
+
+    def reconcile(self, connection):
+        """One incremental pass; returns a timing/outcome report"""
+        started = time.perf_counter()
+        report = {'wallets_checked': 0, 'transactions_scanned': 0, 'full_rechecks': 0,
+                  'drifting': 0, 'batches': 0}
+        cursor = connection.cursor()
+
+        # Session lock (not xact): a run spans many short transactions
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s)) AS locked", (RECONCILE_LOCK_KEY,))
+        if not cursor.fetchone()['locked']:
+            connection.rollback()
+            with self._lock:
+                self._counters['skipped_locked'] += 1
+            return None
+        try:
+            cursor.execute("SELECT watermark, last_run_started FROM wallet_reconciliation_state WHERE id = 1")
+            state = cursor.fetchone() or {'watermark': 0, 'last_run_started': None}
+            cursor.execute("SELECT NOW()::timestamp AS now")
+            run_started = cursor.fetchone()['now']
+            since = None
+            if state['last_run_started']:
+                since = state['last_run_started'] - timedelta(seconds=self.settle_seconds)
+            params = {'watermark': state['watermark'], 'since': since, 'settle': self.settle_seconds}
+
+            t0 = time.perf_counter()
+            cursor.execute(SETTLED_UPTO, params)
+            settled = cursor.fetchone()['settled']
+            cursor.execute(CANDIDATES, params)
+            wallet_ids = sorted(row['wallet_id'] for row in cursor.fetchall())
+            connection.commit()
+            report['candidates_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+
+            t0 = time.perf_counter()
+            for i in range(0, len(wallet_ids), self.batch_size):
+                self._check_batch(connection, wallet_ids[i:i + self.batch_size], settled, report)
+            report['check_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+
+            cursor.execute("""
+                INSERT INTO wallet_reconciliation_state (id, watermark, last_run_started) VALUES (1, %s, %s)
+                ON CONFLICT (id) DO UPDATE SET watermark = EXCLUDED.watermark,
+                                               last_run_started = EXCLUDED.last_run_started
+            """, (settled, run_started))
+            connection.commit()
+        finally:
+            connection.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (RECONCILE_LOCK_KEY,))
+            connection.commit()
+
+        report['watermark'] = settled
+        report['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        report['finished_at'] = time.time()
+        with self._lock:
+            self._counters['runs'] += 1
+            self._counters['full_rechecks'] += report['full_rechecks']
+            self._last_run = report
+        if report['drifting']:
+            logger.warning(f"Ledger reconciliation: {report['drifting']} wallet(s) drift from their ledger")
+        return report
+
+    def _check_batch(self, connection, wallet_ids, settled, report):
+        cursor = connection.cursor()
+        cursor.execute(CHECK_BATCH, {'wallet_ids': wallet_ids, 'settled': settled})
+        rows = cursor.fetchall()
+        checkpoints = []
+        for row in rows:
+            report['transactions_scanned'] += row['scanned']
+            balance = row['balance']
+            ledger_sum = row['ledger_sum'] + row['delta_settled']
+            last_id = row['settled_last'] or row['last_id']
+            drift = balance - (row['ledger_sum'] + row['delta_all'])
+            if drift:
+                # Possibly a late commit below the checkpoint; recompute from scratch
+                report['full_rechecks'] += 1
+                cursor.execute(FULL_CHECK, {'wallet_id': row['wallet_id'], 'settled': settled})
+                full = cursor.fetchone()
+                report['transactions_scanned'] += full['scanned']
+                balance = full['balance']
+                ledger_sum = full['ledger_settled']
+                last_id = full['settled_last'] or 0
+                drift = balance - full['ledger_all']
+            if drift:
+                report['drifting'] += 1
+            checkpoints.append((row['wallet_id'], last_id, ledger_sum, balance, drift,
+                                'drift' if drift else 'ok'))
+        if checkpoints:
+            execute_values(cursor, SAVE_CHECKPOINTS, checkpoints,
+                           template='(%s, %s, %s, %s, %s, %s, NOW())',
+                           page_size=len(checkpoints))
+        connection.commit()
+        report['wallets_checked'] += len(rows)
+        report['batches'] += 1
+
+    def drifting(self, cursor, limit=100):
+        cursor.execute("""
+            SELECT r.wallet_id, w.user_id, r.balance, r.ledger_sum, r.drift, r.checked_at
+            FROM wallet_reconciliation r
+            JOIN wallets w ON w.wallet_id = r.wallet_id
+            WHERE r.status = 'drift'
+            ORDER BY ABS(r.drift) DESC
+            LIMIT %s
+        """, (limit,))
+        return cursor.fetchall()
+
+    def run(self, pool):
+        while True:
+            try:
+                with pool.connection() as connection:
+                    self.reconcile(connection)
+            except Exception as e:
+                with self._lock:
+                    self._counters['run_failures'] += 1
+                logger.error(f"Ledger reconciliation error: {e}")
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['last_run'] = dict(self._last_run)
+        c['interval'] = self.interval
+        c['settle_seconds'] = self.settle_seconds
+        return c
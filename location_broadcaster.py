@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+
+from location_codec import FORMAT_PACKED, encode_packed
+from spatial_index import haversine_km
+from viewport_rooms import format_room
+
+logger = logging.getLogger(__name__)
+
+BATCH_EVENT = 'rider_locations_batch'
+PACKED_BATCH_EVENT = 'rider_locations_packed'
+LEGACY_EVENTS = ('rider_location_updated', 'update_location_realtime')
+
+
+class LocationBroadcaster:
+    """Coalesces location fixes and fans them out once per tick.
+
+    publish() only records the newest fix per rider. Every tick seconds the
+    pending fixes are grouped by destination room and each room gets a
+    single 'rider_locations_batch' event. A rider whose last emitted fix is
+    younger than min_interval is held back until a later tick (the newest
+    position still goes out); a fix that moved less than min_distance_m
+    from the last emitted one is suppressed. With legacy_events on, the old
+    per-rider events are also sent for the fixes that make it through.
+
+    Clients that negotiated the packed format get the same batch as one
+    binary 'rider_locations_packed' event (see location_codec).
+    """
+
+    def __init__(self, socketio, viewport_rooms, tick=0.25, min_interval=1.0,
+                 min_distance_m=5.0, legacy_events=True):
+        self.socketio = socketio
+        self.viewport_rooms = viewport_rooms
+        self.tick = tick
+        self.min_interval = min_interval
+        self.min_distance_m = min_distance_m
+        self.legacy_events = legacy_events
+
+        self._lock = threading.Lock()
+        self._pending = {}    # user_id -> fix dict
+        self._last_sent = {}  # user_id -> (monotonic, lat, lng)
+        self._running = False
+
+        self._counters = {
+            'published': 0,
+            'coalesced': 0,
+            'deferred': 0,
+            'suppressed': 0,
+            'ticks': 0,
+            'batch_events': 0,
+            'legacy_events': 0,
+            'fixes_emitted': 0,
+            'emit_errors': 0
+        }
+
+    def publish(self, user_id, latitude, longitude, location_time):
+        """Queue a fix for the next tick; newer fixes replace older ones"""
+        fix = {'user_id': user_id, 'latitude': latitude, 'longitude': longitude, 'location_time': location_time}
+        with self._lock:
+            self._counters['published'] += 1
+            if user_id in self._pending:
+                self._counters['coalesced'] += 1
+            self._pending[user_id] = fix
+
+    def forget(self, user_id):
+        """Drop throttle state for a rider that went offline"""
+        with self._lock:
+            self._last_sent.pop(user_id, None)
+
+    def _select(self, now):
+        """Take the pending fixes that may be emitted this tick"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            ready = []
+            for user_id, fix in pending.items():
+                last = self._last_sent.get(user_id)
+                if last is not None:
+                    sent_at, lat, lng = last
+                    if now - sent_at < self.min_interval:
+                        # Keep it for a later tick unless something newer arrived meanwhile
+                        self._pending.setdefault(user_id, fix)
+                        self._counters['deferred'] += 1
+                        continue
+                    if haversine_km(lat, lng, fix['latitude'], fix['longitude']) * 1000 < self.min_distance_m:
+                        self._counters['suppressed'] += 1
+                        continue
+                self._last_sent[user_id] = (now, fix['latitude'], fix['longitude'])
+                ready.append(fix)
+            return ready
+
+    def flush(self):
+        """Emit one tick's worth of fixes; returns how many were sent"""
+        ready = self._select(time.monotonic())
+        if not ready:
+            return 0
+
+        by_room = {}
+        routed = []
+        for fix in ready:
+            rooms = self.viewport_rooms.location_rooms(fix['latitude'], fix['longitude'])
+            routed.append((fix, rooms))
+            for room in rooms:
+                by_room.setdefault(room, []).append(fix)
+
+        json_fixes = {id(fix): self._json_fix(fix) for fix in ready}
+        send_packed = self.viewport_rooms.uses_format(FORMAT_PACKED)
+        errors = 0
+        # _select already marked these fixes as sent: one failing room must not cost the others theirs
+        for room, fixes in by_room.items():
+            try:
+                riders = [json_fixes[id(fix)] for fix in fixes]
+                self.socketio.emit(BATCH_EVENT, {'count': len(riders), 'riders': riders}, to=room)
+                if send_packed:
+                    packed = encode_packed([
+                        (f['user_id'], f['latitude'], f['longitude'], int(f['location_time'].timestamp() * 1000))
+                        for f in fixes
+                    ])
+                    self.socketio.emit(PACKED_BATCH_EVENT, packed, to=format_room(room, FORMAT_PACKED))
+            except Exception as e:
+                errors += 1
+                logger.error(f"Location broadcast to {room} failed: {e}")
+
+        legacy_sent = 0
+        if self.legacy_events:
+            for fix, rooms in routed:
+                payload = dict(json_fixes[id(fix)], rider_id=fix['user_id'])  # Backward compatibility alias
+                for event in LEGACY_EVENTS:
+                    try:
+                        self.socketio.emit(event, payload, to=rooms)
+                        legacy_sent += 1
+                    except Exception as e:
+                        errors += 1
+                        logger.error(f"Legacy location event for rider {fix['user_id']} failed: {e}")
+
+        with self._lock:
+            c = self._counters
+            c['ticks'] += 1
+            c['batch_events'] += len(by_room)
+            c['legacy_events'] += legacy_sent
+            c['fixes_emitted'] += len(ready)
+            c['emit_errors'] += errors
+        return len(ready)
+
+    @staticmethod
+    def _json_fix(fix):
+        return {
+            'user_id': fix['user_id'],
+            'latitude': fix['latitude'],
+            'longitude': fix['longitude'],
+            'timestamp': fix['location_time'].isoformat()
+        }
+
+    def run(self):
+        self._running = True
+        while self._running:
+            time.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Location broadcast error: {e}")
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['pending'] = len(self._pending)
+        c['tick'] = self.tick
+        c['min_interval'] = self.min_interval
+        c['min_distance_m'] = self.min_distance_m
+        c['legacy_events_enabled'] = self.legacy_events
+        return c
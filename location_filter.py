@@ -0,0 +1,167 @@
+import threading
+import time
+
+from spatial_index import haversine_km
+
+# Reasons a fix is dropped, in the order they are checked
+FUTURE = 'future'
+STALE = 'stale'
+DUPLICATE = 'duplicate'
+OUT_OF_ORDER = 'out_of_order'
+TOO_FREQUENT = 'too_frequent'
+IMPOSSIBLE_JUMP = 'impossible_jump'
+STATIONARY = 'stationary'
+REASONS = (FUTURE, STALE, DUPLICATE, OUT_OF_ORDER, TOO_FREQUENT, IMPOSSIBLE_JUMP, STATIONARY)
+
+
+class LocationFilter:
+    """Per-rider filter that drops GPS fixes not worth a write and a broadcast.
+
+    Each fix is compared with the last one accepted for the same rider, by
+    device timestamp:
+
+      future           more than max_future seconds ahead of the server clock
+                       (it would make every later fix look out of order)
+      stale            the rider's first fix, more than max_past seconds old
+      duplicate        same timestamp as the last accepted fix
+      out_of_order     older than the last accepted fix
+      too_frequent     less than min_interval seconds after it
+      impossible_jump  implies a speed above max_speed_mps
+      stationary       moved less than min_distance_m, unless keepalive
+                       seconds passed, so a parked rider still writes a
+                       sparse trail and a fresh latest position
+
+    The last accepted fix may itself be a glitch (the first fix after a
+    reconnect is never jump-checked). So jump_reset consecutive rejected
+    fixes that are consistent with each other replace it: the last of them
+    is accepted. The jump check applies however old the reference is; a
+    rider who really moved is let through by that streak.
+
+    check() does not record an accepted fix: the caller calls remember()
+    once the fix was really queued, so a fix refused downstream (QueueFull)
+    is not mistaken for a duplicate when the app resends it. Timestamps may
+    be naive (server local time, like datetime.now()) or aware.
+    """
+
+    def __init__(self, min_distance_m=5.0, min_interval=0.5, keepalive=60.0, max_speed_mps=70.0,
+                 max_future=300.0, max_past=3600.0, jump_reset=3):
+        self.min_distance_m = min_distance_m
+        self.min_interval = min_interval
+        self.keepalive = keepalive
+        self.max_speed_mps = max_speed_mps
+        self.max_future = max_future
+        self.max_past = max_past
+        self.jump_reset = jump_reset
+
+        self._lock = threading.Lock()
+        # user_id -> (epoch seconds, lat, lng) of the last accepted fix
+        self._last = {}
+        # user_id -> (epoch seconds, lat, lng, count) of consecutive rejected jumps that agree
+        self._jumps = {}
+        self._counters = {'checked': 0, 'accepted': 0, 'jump_resets': 0, 'upload_points': 0,
+                          'upload_dropped': 0}
+        self._counters.update({reason: 0 for reason in REASONS})
+
+    def _reason(self, last, t, lat, lng):
+        """Why the fix (epoch seconds t) is dropped after last, or None to keep it"""
+        if last is None:
+            return None
+        last_t, last_lat, last_lng = last
+        if t == last_t:
+            return DUPLICATE
+        if t < last_t:
+            return OUT_OF_ORDER
+        dt = t - last_t
+        if dt < self.min_interval:
+            return TOO_FREQUENT
+        distance_m = haversine_km(last_lat, last_lng, lat, lng) * 1000
+        if distance_m > self.max_speed_mps * dt:
+            return IMPOSSIBLE_JUMP
+        if distance_m < self.min_distance_m and dt < self.keepalive:
+            return STATIONARY
+        return None
+
+    def _follow_jump(self, streak, t, lat, lng):
+        """Extend or restart a streak of rejected jumps with this fix; returns (new streak, reset)"""
+        if streak is not None and t <= streak[0]:
+            return streak, False
+        agrees = streak is not None and (
+            haversine_km(streak[1], streak[2], lat, lng) * 1000 <= self.max_speed_mps * (t - streak[0]))
+        count = streak[3] + 1 if agrees else 1
+        if count >= self.jump_reset:
+            return None, True
+        return (t, lat, lng, count), False
+
+    def check(self, user_id, lat, lng, location_time):
+        """None when the fix should be stored and broadcast, otherwise the reason it is dropped"""
+        t = location_time.timestamp()
+        now = time.time()
+        reset = False
+        with self._lock:
+            last = self._last.get(user_id)
+            if t - now > self.max_future:
+                reason = FUTURE
+            elif last is None and now - t > self.max_past:
+                reason = STALE
+            else:
+                reason = self._reason(last, t, lat, lng)
+            if reason == IMPOSSIBLE_JUMP:
+                streak, reset = self._follow_jump(self._jumps.get(user_id), t, lat, lng)
+                if reset:
+                    reason = None
+                    self._jumps.pop(user_id, None)
+                else:
+                    self._jumps[user_id] = streak
+            self._counters['checked'] += 1
+            self._counters['jump_resets'] += reset
+            if reason:
+                self._counters[reason] += 1
+        return reason
+
+    def remember(self, user_id, lat, lng, location_time):
+        """Record an accepted fix; an older one than already recorded is ignored"""
+        t = location_time.timestamp()
+        with self._lock:
+            last = self._last.get(user_id)
+            if last is None or t > last[0]:
+                self._last[user_id] = (t, lat, lng)
+                self._jumps.pop(user_id, None)
+            self._counters['accepted'] += 1
+
+    def thin(self, rows):
+        """Drop jitter from an uploaded buffer of (location_time, lat, lng) rows, sorted and
+        deduped by time. Fixes are compared with each other, not with the live position the
+        buffer usually predates. The final row is always kept: it carries the latest position.
+        """
+        kept = []
+        last = streak = None
+        for i, row in enumerate(rows):
+            location_time, lat, lng = row
+            t = location_time.timestamp()
+            reason = self._reason(last, t, lat, lng)
+            if reason == IMPOSSIBLE_JUMP:
+                streak, reset = self._follow_jump(streak, t, lat, lng)
+                if reset:
+                    reason = None
+            if reason and i < len(rows) - 1:
+                continue
+            kept.append(row)
+            last, streak = (t, lat, lng), None
+        with self._lock:
+            self._counters['upload_points'] += len(rows)
+            self._counters['upload_dropped'] += len(rows) - len(kept)
+        return kept
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['tracked_riders'] = len(self._last)
+        dropped = sum(c[reason] for reason in REASONS)
+        c['dropped'] = dropped
+        c['drop_ratio'] = round(dropped / c['checked'], 4) if c['checked'] else 0.0
+        c['min_distance_m'] = self.min_distance_m
+        c['min_interval'] = self.min_interval
+        c['keepalive'] = self.keepalive
+        c['max_speed_mps'] = self.max_speed_mps
+        c['jump_reset'] = self.jump_reset
+        return c
@@ -0,0 +1,233 @@
+import csv
+import io
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TABLE = 'rider_location_history'
+PARTITION_PREFIX = f'{HISTORY_TABLE}_p'
+
+SCHEMA_STATEMENTS = [
+    # One row per rider, replaces the LATERAL "ORDER BY location_time DESC LIMIT 1" lookups
+    """
+    CREATE TABLE IF NOT EXISTS rider_latest_location (
+        user_id INTEGER PRIMARY KEY REFERENCES users(user_id),
+        latitude DOUBLE PRECISION NOT NULL,
+        longitude DOUBLE PRECISION NOT NULL,
+        location_time TIMESTAMPTZ NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    # Append-only, one partition per UTC day so retention is a DROP TABLE
+    f"""
+    CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+        user_id INTEGER NOT NULL,
+        latitude DOUBLE PRECISION NOT NULL,
+        longitude DOUBLE PRECISION NOT NULL,
+        location_time TIMESTAMPTZ NOT NULL,
+        received_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    ) PARTITION BY RANGE (location_time)
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS idx_{HISTORY_TABLE}_user_time
+    ON {HISTORY_TABLE} (user_id, location_time)
+    """,
+    # Carry over positions from the legacy single-row-per-rider table
+    """
+    INSERT INTO rider_latest_location (user_id, latitude, longitude, location_time)
+    SELECT DISTINCT ON (user_id) user_id, latitude, longitude, location_time
+    FROM rider_location
+    ORDER BY user_id, location_time DESC
+    ON CONFLICT (user_id) DO NOTHING
+    """
+]
+
+# Both writers only move the latest position forward: a live fix still queued in
+# the write-behind pipeline must not overwrite a newer one stored by an upload
+LATEST_IS_OLDER = "WHERE rider_latest_location.location_time <= EXCLUDED.location_time"
+
+UPSERT_LATEST = f"""
+    INSERT INTO rider_latest_location (user_id, latitude, longitude, location_time, updated_at)
+    SELECT f.user_id, f.latitude, f.longitude, f.location_time, NOW()
+    FROM (VALUES %s) AS f (user_id, latitude, longitude, location_time)
+    JOIN users u ON u.user_id = f.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET latitude = EXCLUDED.latitude,
+        longitude = EXCLUDED.longitude,
+        location_time = EXCLUDED.location_time,
+        updated_at = EXCLUDED.updated_at
+    {LATEST_IS_OLDER}
+"""
+
+# Rows outside the window covered by partitions would fail the whole batch
+APPEND_HISTORY = f"""
+    INSERT INTO {HISTORY_TABLE} (user_id, latitude, longitude, location_time)
+    SELECT f.user_id, f.latitude, f.longitude, f.location_time
+    FROM (VALUES %s) AS f (user_id, latitude, longitude, location_time)
+    WHERE f.location_time >= (date_trunc('day', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') - INTERVAL '{{past}} days'
+      AND f.location_time < (date_trunc('day', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') + INTERVAL '{{ahead}} days'
+"""
+
+UPSERT_LATEST_IF_NEWER = f"""
+    INSERT INTO rider_latest_location (user_id, latitude, longitude, location_time, updated_at)
+    SELECT u.user_id, %s, %s, %s, NOW() FROM users u WHERE u.user_id = %s
+    ON CONFLICT (user_id) DO UPDATE
+    SET latitude = EXCLUDED.latitude,
+        longitude = EXCLUDED.longitude,
+        location_time = EXCLUDED.location_time,
+        updated_at = EXCLUDED.updated_at
+    {LATEST_IS_OLDER}
+    RETURNING user_id
+"""
+
+STORED_TIMES = f"""
+    SELECT location_time FROM {HISTORY_TABLE}
+    WHERE user_id = %s AND location_time >= %s AND location_time <= %s
+"""
+
+COPY_HISTORY = f"COPY {HISTORY_TABLE} (user_id, latitude, longitude, location_time) FROM STDIN WITH (FORMAT csv)"
+
+INSERT_HISTORY = f"INSERT INTO {HISTORY_TABLE} (user_id, latitude, longitude, location_time) VALUES %s"
+
+TRACK_QUERY = f"""
+    SELECT latitude, longitude, location_time
+    FROM {HISTORY_TABLE}
+    WHERE user_id = %s AND location_time >= %s AND location_time < %s
+    ORDER BY location_time
+"""
+
+
+class LocationHistory:
+    """Latest-position table plus day-partitioned, append-only history"""
+
+    def __init__(self, retention_days=30, days_ahead=2, accept_past_days=2):
+        self.retention_days = retention_days
+        self.days_ahead = days_ahead
+        # History older than this is only applied to the latest position
+        self.accept_past_days = min(accept_past_days, retention_days)
+        self._append_sql = APPEND_HISTORY.format(past=int(self.accept_past_days), ahead=int(self.days_ahead))
+
+    def history_window(self, now=None):
+        """[start, end) of location times that have a partition, as APPEND_HISTORY filters them"""
+        now = now or datetime.now(timezone.utc)
+        day = now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        return day - timedelta(days=self.accept_past_days), day + timedelta(days=self.days_ahead)
+
+    @staticmethod
+    def partition_name(day):
+        return f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+    def ensure_schema(self, connection):
+        with connection.cursor() as cursor:
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+        connection.commit()
+
+    def ensure_partitions(self, connection, today=None):
+        """Create daily partitions covering the accepted write window"""
+        today = today or datetime.now(timezone.utc).date()
+        created = 0
+        with connection.cursor() as cursor:
+            for offset in range(-self.accept_past_days, self.days_ahead + 1):
+                day = today + timedelta(days=offset)
+                cursor.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {self.partition_name(day)}
+                    PARTITION OF {HISTORY_TABLE}
+                    FOR VALUES FROM (%s) TO (%s)
+                    """,
+                    (f'{day.isoformat()} 00:00:00+00', f'{(day + timedelta(days=1)).isoformat()} 00:00:00+00')
+                )
+                created += 1
+        connection.commit()
+        return created
+
+    def drop_expired_partitions(self, connection, today=None):
+        """Drop whole partitions past retention; much cheaper than DELETE"""
+        today = today or datetime.now(timezone.utc).date()
+        cutoff = today - timedelta(days=self.retention_days)
+        dropped = []
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = %s
+            """, (HISTORY_TABLE,))
+            for row in cursor.fetchall():
+                name = row['relname']
+                try:
+                    day = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+                except ValueError:
+                    continue
+                if day < cutoff:
+                    cursor.execute(f"DROP TABLE IF EXISTS {name}")
+                    dropped.append(name)
+        connection.commit()
+        if dropped:
+            logger.info(f"Dropped expired location history partitions: {', '.join(dropped)}")
+        return dropped
+
+    def run_maintenance(self, pool, interval=3600):
+        """Create the schema, then keep partitions and retention up to date"""
+        schema_ready = False
+        while True:
+            try:
+                with pool.connection() as connection:
+                    if not schema_ready:
+                        self.ensure_schema(connection)
+                        schema_ready = True
+                    self.ensure_partitions(connection)
+                    self.drop_expired_partitions(connection)
+            except Exception as e:
+                logger.error(f"Location history maintenance error: {e}")
+            time.sleep(interval)
+
+    def write_batch(self, cursor, latest_rows, history_rows):
+        """Upsert the latest positions and append history in the caller's transaction"""
+        if history_rows:
+            execute_values(cursor, self._append_sql, history_rows, page_size=len(history_rows))
+        if latest_rows:
+            execute_values(cursor, UPSERT_LATEST, latest_rows, page_size=len(latest_rows))
+
+    def stored_times(self, cursor, user_id, start, end):
+        """History timestamps a rider already has in [start, end]; one index range scan"""
+        cursor.execute(STORED_TIMES, (user_id, start, end))
+        return {row['location_time'] for row in cursor.fetchall()}
+
+    def append_history(self, cursor, user_id, points, use_copy=True):
+        """Append (location_time, latitude, longitude) points of one rider, all inside history_window().
+
+        COPY streams them in one command; without it (psycopg2's wait_callback
+        green mode cannot COPY) one multi-row INSERT is sent instead.
+        """
+        if not points:
+            return
+        if not use_copy:
+            rows = [(user_id, lat, lng, t) for t, lat, lng in points]
+            execute_values(cursor, INSERT_HISTORY, rows, page_size=len(rows))
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for t, lat, lng in points:
+            writer.writerow((user_id, repr(lat), repr(lng), t.isoformat()))
+        buffer.seek(0)
+        cursor.copy_expert(COPY_HISTORY, buffer)
+
+    def update_latest(self, cursor, user_id, latitude, longitude, location_time):
+        """Set the latest position unless a newer one is stored; True when it moved"""
+        cursor.execute(UPSERT_LATEST_IF_NEWER, (latitude, longitude, location_time, user_id))
+        return cursor.fetchone() is not None
+
+    def stream_track(self, connection, user_id, start, end, fetch_size=2000):
+        """Yield history rows through a server-side cursor, fetch_size at a time"""
+        with connection.cursor(name=f'track_{user_id}_{int(time.time() * 1000)}') as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(TRACK_QUERY, (user_id, start, end))
+            for row in cursor:
+                yield row
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_POLICIES = ('reject', 'drop_oldest')
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the pipeline is saturated and policy is 'reject'"""
+
+
+class LocationWriter:
+    """Write-behind pipeline for GPS fixes.
+
+    Fixes are accepted into two bounded in-memory buffers: every fix goes to
+    the history buffer, while the latest-position buffer is keyed by rider so
+    several fixes inside a flush window collapse into the newest one. A
+    background loop hands both to the storage layer in one transaction every
+    flush_interval seconds, or earlier once max_batch riders are pending.
+    """
+
+    def __init__(self, storage, flush_interval=0.5, max_batch=500, max_pending=20000,
+                 max_history_pending=100000, overload='reject'):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy '{overload}', expected one of {OVERLOAD_POLICIES}")
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_history_pending = max_history_pending
+        self.overload = overload
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}  # user_id -> (user_id, lat, lng, location_time); dicts keep arrival order
+        self._history = deque()
+        self._running = False
+
+        self._counters = {
+            'submitted': 0,
+            'coalesced': 0,
+            'rejected': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'flush_failures': 0,
+            'rows_written': 0,
+            'history_rows_written': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def submit(self, user_id, latitude, longitude, location_time):
+        """Queue a fix; returns immediately without touching the database"""
+        with self._lock:
+            self._counters['submitted'] += 1
+            history_full = len(self._history) >= self.max_history_pending
+            if history_full and self.overload == 'reject':
+                self._counters['rejected'] += 1
+                raise QueueFull("Location pipeline is saturated, retry later")
+            if user_id in self._pending:
+                self._counters['coalesced'] += 1
+                # Re-insert so the rider moves to the back of the arrival order
+                del self._pending[user_id]
+            elif len(self._pending) >= self.max_pending:
+                if self.overload == 'reject':
+                    self._counters['rejected'] += 1
+                    raise QueueFull("Location pipeline is saturated, retry later")
+                self._pending.pop(next(iter(self._pending)))
+                self._counters['dropped'] += 1
+            fix = (user_id, latitude, longitude, location_time)
+            self._pending[user_id] = fix
+            if history_full:
+                self._history.popleft()
+                self._counters['dropped'] += 1
+            self._history.append(fix)
+            pending = len(self._pending)
+
+        if pending >= self.max_batch:
+            self._wakeup.set()
+
+    def _take_batch(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            history, self._history = self._history, deque()
+        return batch, history
+
+    def _requeue(self, batch, history):
+        """Put back a failed batch without overwriting newer fixes"""
+        with self._lock:
+            for user_id, fix in batch.items():
+                if user_id not in self._pending and len(self._pending) < self.max_pending:
+                    self._pending[user_id] = fix
+            room = self.max_history_pending - len(self._history)
+            if room > 0:
+                # Older fixes go back in front of anything that arrived meanwhile
+                self._history.extendleft(reversed(list(history)[-room:]))
+
+    def flush(self, pool):
+        """Write everything pending in one statement; returns rows written"""
+        with self._flush_lock:
+            batch, history = self._take_batch()
+            if not batch and not history:
+                return 0
+
+            started = time.monotonic()
+            try:
+                with pool.connection() as connection:
+                    with connection.cursor() as cursor:
+                        self.storage.write_batch(cursor, list(batch.values()), list(history))
+                    connection.commit()
+            except Exception as e:
+                self._requeue(batch, history)
+                with self._lock:
+                    self._counters['flush_failures'] += 1
+                logger.error(f"Location flush error ({len(batch)} riders re-queued): {e}")
+                return 0
+
+            elapsed_ms = (time.monotonic() - started) * 1000
+            with self._lock:
+                c = self._counters
+                c['flushes'] += 1
+                c['rows_written'] += len(batch)
+                c['history_rows_written'] += len(history)
+                c['last_batch_size'] = len(batch)
+                c['max_batch_size'] = max(c['max_batch_size'], len(batch))
+                c['last_flush_ms'] = round(elapsed_ms, 3)
+                c['max_flush_ms'] = round(max(c['max_flush_ms'], elapsed_ms), 3)
+                c['total_flush_ms'] += elapsed_ms
+            return len(batch)
+
+    def run(self, pool):
+        """Background loop: flush on the timer or when max_batch is reached"""
+        self._running = True
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush(pool)
+
+    def close(self, pool):
+        """Shutdown hook: stop the loop and flush whatever is still pending"""
+        self._running = False
+        self._wakeup.set()
+        written = self.flush(pool)
+        if written:
+            logger.info(f"Location pipeline flushed {written} pending fixes on shutdown")
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['pending'] = len(self._pending)
+            c['history_pending'] = len(self._history)
+        total_flush_ms = c.pop('total_flush_ms')
+        c['avg_batch_size'] = round(c['rows_written'] / c['flushes'], 2) if c['flushes'] else 0
+        c['avg_flush_ms'] = round(total_flush_ms / c['flushes'], 3) if c['flushes'] else 0
+        c['flush_interval'] = self.flush_interval
+        c['max_pending'] = self.max_pending
+        c['overload'] = self.overload
+        return c
@@ -0,0 +1,191 @@
+"""Batch upload of a rider's offline location buffer.
+
+After a gap in coverage the app sends everything it buffered in one request,
+instead of replaying each fix through /api/update_location:
+
+    POST /api/locations/batch   (Content-Encoding: gzip allowed)
+    {"points": [{"latitude": .., "longitude": .., "timestamp": ISO 8601 or epoch ms}, ...]}
+
+The buffer is validated in plain Python (a pass over each column, then one
+over the points; there is no numpy here), sorted and deduplicated by device
+timestamp, then written in one transaction: points history already has (a
+retried upload) are skipped, the rest are appended to history, and the
+latest position is updated once, only if the final point is newer than
+what is stored. Only that final point is broadcast.
+
+History is appended with COPY only when DB_GREEN_MODE is tpool or off:
+psycopg2's wait_callback mode, the default, cannot COPY, so there the
+points go in as one multi-row INSERT. Operators who want COPY for large
+uploads must switch the green mode.
+"""
+import json
+import logging
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def decode_body(raw, content_encoding=None, max_bytes=5 * 1024 * 1024):
+    """JSON document from a request body, gunzipped when sent with Content-Encoding: gzip.
+
+    Raises ValueError for bad encodings, bodies over max_bytes (also after
+    decompression, so a small gzip bomb is refused) and invalid JSON.
+    """
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding == 'gzip':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(raw, max_bytes + 1)
+        except zlib.error as e:
+            raise ValueError(f'Invalid gzip body: {e}')
+        if inflater.unconsumed_tail:
+            raise ValueError(f'Body is larger than {max_bytes} bytes uncompressed')
+    elif encoding == 'identity':
+        body = raw
+    else:
+        raise ValueError(f"Unsupported Content-Encoding '{content_encoding}'")
+
+    if len(body) > max_bytes:
+        raise ValueError(f'Body is larger than {max_bytes} bytes')
+    try:
+        return json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Body is not valid JSON')
+
+
+def _to_utc(value):
+    """Device timestamp (ISO 8601 string or epoch milliseconds) as an aware UTC datetime, or None"""
+    try:
+        if isinstance(value, str):
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            # Naive device times are server-local, as Postgres reads them for the REST path
+            return parsed.astimezone(timezone.utc)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return datetime.fromtimestamp(value / 1000.0, timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def prepare(points, window):
+    """Validate, sort and dedupe an uploaded buffer.
+
+    window is the [start, end) of location times history accepts. Returns
+    (rows, rejected, duplicates): rows are (location_time, lat, lng) sorted
+    by time with one point per device timestamp (the last one sent wins),
+    rejected is a list of {'index', 'message'} for invalid points.
+    """
+    if not isinstance(points, list):
+        raise ValueError('points must be a list')
+
+    # Conversions column by column, then one pass over the points for range checks
+    records = [p if isinstance(p, dict) else {} for p in points]
+    lats = [_to_float(p.get('latitude')) for p in records]
+    lngs = [_to_float(p.get('longitude')) for p in records]
+    times = [_to_utc(p.get('timestamp')) for p in records]
+    start, end = window
+
+    rejected = []
+    by_time = {}
+    for i, (lat, lng, t) in enumerate(zip(lats, lngs, times)):
+        if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            rejected.append({'index': i, 'message': 'Invalid coordinates'})
+        elif t is None:
+            rejected.append({'index': i, 'message': 'Invalid or missing timestamp'})
+        elif not start <= t < end:
+            rejected.append({'index': i, 'message': 'Timestamp outside the accepted window'})
+        else:
+            by_time[t] = (t, lat, lng)
+
+    valid = len(points) - len(rejected)
+    rows = sorted(by_time.values(), key=lambda row: row[0])
+    return rows, rejected, valid - len(rows)
+
+
+class LocationUploader:
+    """Writes prepared buffers through LocationHistory and keeps upload counters"""
+
+    def __init__(self, history, use_copy=True, max_points=10000, max_bytes=5 * 1024 * 1024):
+        self.history = history
+        # psycopg2's wait_callback green mode cannot run COPY
+        self.use_copy = use_copy
+        self.max_points = max_points
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {
+            'uploads': 0,
+            'points_received': 0,
+            'points_written': 0,
+            'rejected': 0,
+            'duplicates': 0,
+            'already_stored': 0,
+            'latest_updated': 0,
+            'failures': 0,
+            'last_upload_ms': 0.0,
+            'max_upload_ms': 0.0
+        }
+
+    def prepare(self, data):
+        """(rows, rejected, duplicates) for a decoded request body"""
+        points = data.get('points') if isinstance(data, dict) else None
+        if not isinstance(points, list) or not points:
+            raise ValueError('points must be a non-empty list')
+        if len(points) > self.max_points:
+            raise ValueError(f'At most {self.max_points} points per upload')
+        rows, rejected, duplicates = prepare(points, self.history.history_window())
+        with self._lock:
+            c = self._counters
+            c['uploads'] += 1
+            c['points_received'] += len(points)
+            c['rejected'] += len(rejected)
+            c['duplicates'] += duplicates
+        return rows, rejected, duplicates
+
+    def write(self, connection, user_id, rows):
+        """Append new rows and move the latest position in one transaction.
+
+        Returns (points written, already stored, whether the latest position moved).
+        """
+        started = time.monotonic()
+        try:
+            with connection.cursor() as cursor:
+                # Retried uploads must not duplicate history, which has no unique key
+                stored = self.history.stored_times(cursor, user_id, rows[0][0], rows[-1][0])
+                new_rows = [row for row in rows if row[0] not in stored]
+                self.history.append_history(cursor, user_id, new_rows, use_copy=self.use_copy)
+                t, lat, lng = rows[-1]
+                moved = self.history.update_latest(cursor, user_id, lat, lng, t)
+            connection.commit()
+        except Exception:
+            with self._lock:
+                self._counters['failures'] += 1
+            raise
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            c = self._counters
+            c['points_written'] += len(new_rows)
+            c['already_stored'] += len(rows) - len(new_rows)
+            c['latest_updated'] += moved
+            c['last_upload_ms'] = round(elapsed_ms, 3)
+            c['max_upload_ms'] = round(max(c['max_upload_ms'], elapsed_ms), 3)
+        return len(new_rows), len(rows) - len(new_rows), moved
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c['use_copy'] = self.use_copy
+        c['max_points'] = self.max_points
+        return c
@@ -0,0 +1,394 @@
+"""Cross-worker message bus for Socket.IO emits and presence.
+
+Every transport has the same small interface: subscribe(channel, callback)
+before start(spawn), then publish(channel, message) with JSON-serialisable
+dicts; bytes values (packed location batches) are carried as base64 and
+come out as bytes again. Delivery is at most once and reaches every worker, the publisher
+included (receivers skip their own messages where that matters).
+
+    PostgresBus  LISTEN/NOTIFY on the database we already have. Messages
+                 published within flush_interval are packed into as few
+                 NOTIFY payloads as fit under Postgres' 8000-byte limit and
+                 sent with one statement; a message that is larger on its
+                 own goes through message_bus_overflow and only its id is
+                 notified.
+    KombuBus     any broker kombu supports (redis://, amqp://, ...) via a
+                 fanout exchange, over one connection kept open per worker.
+                 kombu is only imported when used.
+
+BusManager plugs a bus into python-socketio as its client manager, so
+socketio.emit() from any worker reaches sockets connected to all of them.
+"""
+import base64
+import collections
+import json
+import logging
+import queue
+import select
+import threading
+import time
+import uuid
+
+import psycopg2
+from psycopg2 import sql
+from socketio import PubSubManager
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must stay under 8000 bytes
+MAX_PAYLOAD = 7900
+
+OVERFLOW_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS message_bus_overflow (
+        id BIGSERIAL PRIMARY KEY,
+        payload TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+
+# JSON has no bytes type: {"__bytes__": "<base64>"} stands in for them on the wire
+BYTES_KEY = '__bytes__'
+
+
+def _encode_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {BYTES_KEY: base64.b64encode(bytes(value)).decode()}
+    return str(value)
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and BYTES_KEY in obj:
+        return base64.b64decode(obj[BYTES_KEY])
+    return obj
+
+
+def _dumps(message):
+    return json.dumps(message, separators=(',', ':'), default=_encode_default)
+
+
+def _loads(payload):
+    return json.loads(payload, object_hook=_decode_object)
+
+
+def pack_payloads(messages, max_payload=MAX_PAYLOAD):
+    """Group encoded messages into JSON-array payloads of at most max_payload bytes.
+
+    Returns (payloads, oversized): oversized messages do not fit even alone.
+    """
+    payloads, oversized = [], []
+    current, size = [], 2
+    for encoded in messages:
+        length = len(encoded.encode())
+        if length + 2 > max_payload:
+            oversized.append(encoded)
+            continue
+        if current and size + length + 1 > max_payload:
+            payloads.append('[' + ','.join(current) + ']')
+            current, size = [], 2
+        current.append(encoded)
+        size += length + (1 if len(current) > 1 else 0)
+    if current:
+        payloads.append('[' + ','.join(current) + ']')
+    return payloads, oversized
+
+
+class PostgresBus:
+    """Message bus over Postgres LISTEN/NOTIFY.
+
+    publish() only queues; a publisher task drains the queue every
+    flush_interval and sends all of it with a single pg_notify statement.
+    A listener task holds one dedicated connection that LISTENs on every
+    subscribed channel. Neither uses the request pool.
+    """
+
+    def __init__(self, db_config, sslmode='require', prefix='rider_bus', flush_interval=0.005,
+                 overflow_ttl=300, max_queued=50000):
+        self.db_config = db_config
+        self.sslmode = sslmode
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.overflow_ttl = overflow_ttl
+        self.worker_id = uuid.uuid4().hex
+        # While the database is unreachable the oldest messages are dropped first
+        self._outbox = collections.deque(maxlen=max_queued)
+        self._wake = threading.Event()
+        self._subscribers = {}  # channel -> [callback]
+        self._started = False
+        self._lock = threading.Lock()
+        self._counters = {
+            'published': 0,
+            'notifies': 0,
+            'flushes': 0,
+            'overflow': 0,
+            'received': 0,
+            'publish_failures': 0,
+            'listen_failures': 0
+        }
+
+    def _pg_channel(self, channel):
+        return f'{self.prefix}_{channel}'
+
+    def _connect(self):
+        connection = psycopg2.connect(**self.db_config, sslmode=self.sslmode)
+        connection.autocommit = True
+        return connection
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def publish(self, channel, message):
+        self._outbox.append((channel, _dumps(message)))
+        self._wake.set()
+
+    def start(self, spawn):
+        """Start the publisher and listener with spawn (e.g. socketio.start_background_task); idempotent"""
+        if self._started:
+            return
+        self._started = True
+        spawn(self._publisher)
+        spawn(self._listener)
+
+    # Publishing
+
+    def flush(self, connection):
+        """Send everything queued so far; returns the number of messages"""
+        taken = []
+        while self._outbox:
+            taken.append(self._outbox.popleft())
+        if not taken:
+            return 0
+
+        by_channel = {}
+        for channel, encoded in taken:
+            by_channel.setdefault(channel, []).append(encoded)
+
+        channels, payloads = [], []
+        with connection.cursor() as cursor:
+            for channel, messages in by_channel.items():
+                packed, oversized = pack_payloads(messages)
+                for encoded in oversized:
+                    cursor.execute("INSERT INTO message_bus_overflow (payload) VALUES (%s) RETURNING id",
+                                   ('[' + encoded + ']',))
+                    packed.append(_dumps({'ref': cursor.fetchone()[0]}))
+                channels += [self._pg_channel(channel)] * len(packed)
+                payloads += packed
+                with self._lock:
+                    self._counters['overflow'] += len(oversized)
+            # Every payload in one round trip
+            cursor.execute("SELECT pg_notify(c, p) FROM unnest(%s::text[], %s::text[]) AS n (c, p)",
+                           (channels, payloads))
+
+        with self._lock:
+            c = self._counters
+            c['published'] += len(taken)
+            c['notifies'] += len(payloads)
+            c['flushes'] += 1
+        return len(taken)
+
+    def _publisher(self):
+        connection = None
+        last_cleanup = time.monotonic()
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Let a burst accumulate into fewer, fuller payloads
+            time.sleep(self.flush_interval)
+            try:
+                if connection is None or connection.closed:
+                    connection = self._connect()
+                    with connection.cursor() as cursor:
+                        cursor.execute(OVERFLOW_SCHEMA)
+                self.flush(connection)
+                if time.monotonic() - last_cleanup > 60:
+                    last_cleanup = time.monotonic()
+                    with connection.cursor() as cursor:
+                        cursor.execute("DELETE FROM message_bus_overflow "
+                                       "WHERE created_at < NOW() - make_interval(secs => %s)",
+                                       (self.overflow_ttl,))
+            except Exception as e:
+                with self._lock:
+                    self._counters['publish_failures'] += 1
+                logger.error(f"Message bus publish error: {e}")
+                if connection is not None:
+                    connection.close()
+                connection = None
+                # Retry what is still queued
+                time.sleep(1)
+                self._wake.set()
+
+    # Receiving
+
+    def _deliver(self, channel, payload, cursor):
+        data = _loads(payload)
+        if isinstance(data, dict) and 'ref' in data:
+            cursor.execute("SELECT payload FROM message_bus_overflow WHERE id = %s", (data['ref'],))
+            row = cursor.fetchone()
+            if row is None:
+                return
+            data = _loads(row[0])
+        with self._lock:
+            self._counters['received'] += len(data)
+        for message in data:
+            for callback in self._subscribers.get(channel, ()):
+                try:
+                    callback(message)
+                except Exception as e:
+                    logger.error(f"Message bus subscriber error on '{channel}': {e}")
+
+    def _listener(self):
+        channels = {self._pg_channel(c): c for c in self._subscribers}
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                cursor = connection.cursor()
+                for pg_channel in channels:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(pg_channel)))
+                while True:
+                    select.select([connection], [], [], 5.0)
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        if notify.channel in channels:
+                            self._deliver(channels[notify.channel], notify.payload, cursor)
+            except Exception as e:
+                with self._lock:
+                    self._counters['listen_failures'] += 1
+                logger.error(f"Message bus listen error: {e}")
+                if connection is not None:
+                    connection.close()
+                time.sleep(1)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c['transport'] = 'postgres'
+        c['queued'] = len(self._outbox)
+        c['flush_interval'] = self.flush_interval
+        return c
+
+
+class KombuBus:
+    """Message bus over a kombu broker: one fanout exchange, one exclusive queue per worker.
+
+    Publishing reuses one connection and producer; after an error they are
+    dropped and the message is retried once on a fresh connection.
+    """
+
+    def __init__(self, url, exchange='rider_bus'):
+        import kombu  # optional dependency, like python-socketio's KombuManager
+
+        self._kombu = kombu
+        self.url = url
+        self.worker_id = uuid.uuid4().hex
+        self._exchange = kombu.Exchange(exchange, type='fanout', durable=False)
+        self._subscribers = {}
+        self._started = False
+        self._lock = threading.Lock()
+        # Serialises publishers on the shared connection
+        self._publish_lock = threading.Lock()
+        self._connection = None
+        self._producer = None
+        self._counters = {'published': 0, 'received': 0, 'publish_failures': 0, 'listen_failures': 0,
+                          'connects': 0}
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def _get_producer(self):
+        if self._producer is None:
+            self._connection = self._kombu.Connection(self.url)
+            self._producer = self._connection.Producer()
+            with self._lock:
+                self._counters['connects'] += 1
+        return self._producer
+
+    def _drop_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.release()
+            except Exception:
+                pass
+        self._connection = self._producer = None
+
+    def publish(self, channel, message):
+        body = _dumps({'channel': channel, 'message': message})
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    # Sent as-is: kombu's serializer would not round-trip bytes
+                    self._get_producer().publish(body, exchange=self._exchange, declare=[self._exchange],
+                                                 content_type='application/json', content_encoding='utf-8',
+                                                 retry=False)
+                    break
+                except Exception as e:
+                    self._drop_connection()
+                    if attempt:
+                        with self._lock:
+                            self._counters['publish_failures'] += 1
+                        logger.error(f"Message bus publish error: {e}")
+                        return
+        with self._lock:
+            self._counters['published'] += 1
+
+    def start(self, spawn):
+        if self._started:
+            return
+        self._started = True
+        spawn(self._listener)
+
+    def _listener(self):
+        while True:
+            try:
+                with self._kombu.Connection(self.url) as connection:
+                    worker_queue = self._kombu.Queue(f'rider_bus_{self.worker_id}', self._exchange,
+                                                     exclusive=True, auto_delete=True, durable=False)
+                    with connection.SimpleQueue(worker_queue) as simple_queue:
+                        while True:
+                            envelope = simple_queue.get(block=True)
+                            envelope.ack()
+                            body = _loads(envelope.body)
+                            with self._lock:
+                                self._counters['received'] += 1
+                            for callback in self._subscribers.get(body['channel'], ()):
+                                callback(body['message'])
+            except Exception as e:
+                with self._lock:
+                    self._counters['listen_failures'] += 1
+                logger.error(f"Message bus listen error: {e}")
+                time.sleep(1)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c['transport'] = 'kombu'
+        return c
+
+
+def create_bus(setting, db_config, sslmode='require', flush_interval=0.005):
+    """MESSAGE_BUS setting to a bus: '' (single process, None), 'postgres', or a broker URL"""
+    if not setting:
+        return None
+    if setting == 'postgres':
+        return PostgresBus(db_config, sslmode=sslmode, flush_interval=flush_interval)
+    return KombuBus(setting)
+
+
+class BusManager(PubSubManager):
+    """python-socketio client manager carried by a PostgresBus or KombuBus"""
+
+    name = 'bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self._inbox = queue.Queue()
+        bus.subscribe(channel, self._inbox.put)
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
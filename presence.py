@@ -0,0 +1,275 @@
+import heapq
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MARK_OFFLINE = """
+    UPDATE rider_status SET is_online = FALSE, last_updated = NOW()
+    WHERE user_id = ANY(%s) AND is_online
+    RETURNING user_id
+"""
+
+
+class PresenceRegistry:
+    """Which riders are alive, and which sockets belong to whom.
+
+    user -> sids and sid -> user maps make connect, disconnect and lookups
+    O(1), and a user may have several devices connected. A rider set online
+    (update_status) must keep sending heartbeats (socket 'heartbeat', any
+    location fix); once ttl seconds pass without one, or disconnect_grace
+    seconds after their last socket closed, they are marked offline.
+
+    Deadlines live in a min-heap, normally one entry per tracked rider: a
+    heartbeat only moves the deadline in a dict, and a popped entry whose
+    deadline moved is pushed back. run() expires riders in one UPDATE per
+    batch and hands the ones that really went offline to on_offline.
+
+    With a message bus (attach_bus) every worker keeps the same deadlines:
+    online/offline changes and per-user device counts are published as
+    they happen, heartbeats once per tick as one batch. All workers then
+    expire the same riders, and the `AND is_online` in MARK_OFFLINE lets
+    only one of them report each rider.
+    """
+
+    def __init__(self, ttl=90.0, disconnect_grace=30.0, tick=1.0, batch_size=500, on_offline=None):
+        self.ttl = ttl
+        self.disconnect_grace = disconnect_grace
+        self.tick = tick
+        self.batch_size = batch_size
+        self.on_offline = on_offline
+        self._lock = threading.Lock()
+        self._user_sids = {}   # user_id -> set of sids
+        self._sid_user = {}    # sid -> user_id
+        self._deadlines = {}   # user_id -> monotonic deadline, riders being tracked
+        self._heap = []        # (deadline, user_id); a later duplicate only after a disconnect
+        self._queued = set()   # user_ids with a heap entry
+        self.bus = None
+        self.worker_id = uuid.uuid4().hex
+        self._remote_devices = {}  # user_id -> {worker_id: sockets on that worker}
+        self._beats = set()        # heartbeats to publish on the next tick
+        self._counters = {
+            'heartbeats': 0,
+            'expired': 0,
+            'marked_offline': 0,
+            'offline_batches': 0,
+            'sweep_failures': 0,
+            'bus_messages': 0
+        }
+
+    def _schedule(self, user_id, deadline):
+        self._deadlines[user_id] = deadline
+        if user_id not in self._queued:
+            self._queued.add(user_id)
+            heapq.heappush(self._heap, (deadline, user_id))
+
+    # Sockets
+
+    def add_sid(self, sid, user_id):
+        """Register an authenticated socket; returns True if it is the user's first device anywhere"""
+        with self._lock:
+            self._sid_user[sid] = user_id
+            sids = self._user_sids.setdefault(user_id, set())
+            sids.add(sid)
+            if user_id in self._deadlines:
+                self._schedule(user_id, time.monotonic() + self.ttl)
+            count = len(sids)
+        self._publish('devices', [user_id], count=count)
+        return count == 1 and not self._remote_devices.get(user_id)
+
+    def remove_sid(self, sid):
+        """Forget a socket; returns (user_id or None, True if it was the user's last device)"""
+        with self._lock:
+            user_id = self._sid_user.pop(sid, None)
+            if user_id is None:
+                return None, False
+            sids = self._user_sids.get(user_id)
+            sids.discard(sid)
+            count = len(sids)
+            if not sids:
+                del self._user_sids[user_id]
+        self._publish('devices', [user_id], count=count)
+        if count or self._remote_devices.get(user_id):
+            return user_id, False
+        with self._lock:
+            self._devices_gone(user_id)
+        return user_id, True
+
+    def _devices_gone(self, user_id):
+        # No device left on any worker: expire soon unless one reconnects
+        deadline = time.monotonic() + self.disconnect_grace
+        if deadline < self._deadlines.get(user_id, deadline):
+            # Earlier than the queued entry, so it needs one of its own
+            self._deadlines[user_id] = deadline
+            self._queued.add(user_id)
+            heapq.heappush(self._heap, (deadline, user_id))
+
+    def user_of(self, sid):
+        return self._sid_user.get(sid)
+
+    def sids_of(self, user_id):
+        return set(self._user_sids.get(user_id, ()))
+
+    # Online state
+
+    def set_online(self, user_id, publish=True):
+        with self._lock:
+            self._schedule(user_id, time.monotonic() + self.ttl)
+        if publish:
+            self._publish('online', [user_id])
+
+    def set_offline(self, user_id, publish=True):
+        """Explicit offline (update_status); its heap entry is dropped when popped"""
+        with self._lock:
+            self._deadlines.pop(user_id, None)
+        if publish:
+            self._publish('offline', [user_id])
+
+    def heartbeat(self, user_id):
+        """Extend a tracked rider's TTL; False if they are not online (the app should go online again)"""
+        with self._lock:
+            self._counters['heartbeats'] += 1
+            if user_id not in self._deadlines:
+                return False
+            self._schedule(user_id, time.monotonic() + self.ttl)
+            if self.bus is not None:
+                self._beats.add(user_id)
+            return True
+
+    # Sharing across workers
+
+    def attach_bus(self, bus, channel='presence'):
+        """Share presence with the other workers on bus (before the bus is started)"""
+        self.bus = bus
+        self._channel = channel
+        bus.subscribe(channel, self.apply_remote)
+
+    def _publish(self, op, user_ids, **extra):
+        if self.bus is None:
+            return
+        self.bus.publish(self._channel, dict(extra, op=op, users=user_ids, worker=self.worker_id))
+        with self._lock:
+            self._counters['bus_messages'] += 1
+
+    def publish_heartbeats(self):
+        with self._lock:
+            beats, self._beats = list(self._beats), set()
+        if beats:
+            self._publish('beat', beats)
+
+    def apply_remote(self, message):
+        """Apply another worker's presence change"""
+        if message.get('worker') == self.worker_id:
+            return
+        op, user_ids = message['op'], message['users']
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                if op == 'online' or (op == 'beat' and user_id in self._deadlines):
+                    self._schedule(user_id, now + self.ttl)
+                elif op == 'offline':
+                    self._deadlines.pop(user_id, None)
+                elif op == 'devices':
+                    devices = self._remote_devices.setdefault(user_id, {})
+                    if message['count']:
+                        devices[message['worker']] = message['count']
+                        continue
+                    devices.pop(message['worker'], None)
+                    if not devices:
+                        del self._remote_devices[user_id]
+                        if user_id not in self._user_sids:
+                            self._devices_gone(user_id)
+
+    def is_online(self, user_id):
+        return user_id in self._deadlines
+
+    def online_count(self):
+        return len(self._deadlines)
+
+    def expire(self, now=None):
+        """Stop tracking riders whose deadline passed; returns their ids"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, user_id = heapq.heappop(self._heap)
+                current = self._deadlines.get(user_id)
+                if current is None:
+                    self._queued.discard(user_id)
+                elif current > now:
+                    # A heartbeat moved it; requeue at the new deadline
+                    heapq.heappush(self._heap, (current, user_id))
+                else:
+                    del self._deadlines[user_id]
+                    self._queued.discard(user_id)
+                    expired.append(user_id)
+            self._counters['expired'] += len(expired)
+        return expired
+
+    # Background
+
+    def seed(self, connection):
+        """Track riders the DB says are online, e.g. after a restart: they get one TTL to check in"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM rider_status WHERE is_online")
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+        connection.rollback()
+        for user_id in user_ids:
+            # Every worker seeds itself; nothing to publish
+            self.set_online(user_id, publish=False)
+        return len(user_ids)
+
+    def mark_offline(self, connection, user_ids):
+        """One UPDATE per batch; returns the riders that were still online in the DB"""
+        offline = []
+        with connection.cursor() as cursor:
+            for i in range(0, len(user_ids), self.batch_size):
+                cursor.execute(MARK_OFFLINE, (user_ids[i:i + self.batch_size],))
+                offline += [row['user_id'] for row in cursor.fetchall()]
+                connection.commit()
+                with self._lock:
+                    self._counters['offline_batches'] += 1
+        with self._lock:
+            self._counters['marked_offline'] += len(offline)
+        return offline
+
+    def run(self, pool):
+        seeded = False
+        pending = []
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.publish_heartbeats()
+                pending += self.expire()
+                if seeded and not pending:
+                    continue
+                with pool.connection() as connection:
+                    if not seeded:
+                        count = self.seed(connection)
+                        seeded = True
+                        logger.info(f"Presence: tracking {count} rider(s) online at startup")
+                    # A rider who came back meanwhile is online again; leave them alone
+                    user_ids = [u for u in pending if not self.is_online(u)]
+                    offline = self.mark_offline(connection, user_ids) if user_ids else []
+                    pending = []
+                if offline and self.on_offline:
+                    self.on_offline(offline)
+            except Exception as e:
+                # Expired riders stay in pending and are retried next tick
+                with self._lock:
+                    self._counters['sweep_failures'] += 1
+                logger.error(f"Presence sweep error: {e}")
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['online'] = len(self._deadlines)
+            c['connected_users'] = len(self._user_sids)
+            c['sockets'] = len(self._sid_user)
+            c['heap_size'] = len(self._heap)
+            c['remote_users'] = len(self._remote_devices)
+        c['ttl'] = self.ttl
+        c['disconnect_grace'] = self.disconnect_grace
+        return c
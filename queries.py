@@ -0,0 +1,245 @@
+"""Hot-path SQL as server-side prepared statements.
+
+Each operation is a single statement: upserts use ON CONFLICT, the wallet
+flows chain their writes in data-modifying CTEs and RETURNING hands back
+what the response needs. A statement is PREPAREd the first time a pooled
+connection runs it and EXECUTEd by name afterwards, so Postgres parses and
+plans it once per connection instead of once per request.
+"""
+import logging
+import re
+
+from psycopg2 import errors
+
+logger = logging.getLogger(__name__)
+
+# Upserts need a unique key on user_id; withdrawal_requests used to be
+# created inline by the withdraw endpoint
+SCHEMA_STATEMENTS = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS rider_status_user_id_key ON rider_status (user_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS wallets_user_id_key ON wallets (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS withdrawal_requests (
+        request_id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(user_id),
+        amount DECIMAL(10, 2) NOT NULL,
+        method VARCHAR(50) NOT NULL,
+        account_details VARCHAR(255) NOT NULL,
+        notes TEXT,
+        status VARCHAR(20) DEFAULT 'PENDING',
+        transaction_id INTEGER REFERENCES wallet_transactions(transaction_id),
+        created_at TIMESTAMP DEFAULT NOW(),
+        processed_at TIMESTAMP
+    )
+    """,
+    # Deferred credits to hot wallets, folded into wallets.balance by wallet_journal
+    """
+    CREATE TABLE IF NOT EXISTS wallet_credit_journal (
+        journal_id BIGSERIAL PRIMARY KEY,
+        wallet_id INTEGER NOT NULL REFERENCES wallets(wallet_id),
+        amount DECIMAL(10, 2) NOT NULL,
+        transaction_id INTEGER REFERENCES wallet_transactions(transaction_id),
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_wallet_credit_journal_wallet ON wallet_credit_journal (wallet_id)",
+]
+
+# name -> (parameter types, statement using $n placeholders)
+STATEMENTS = {
+    'login_user': ('text', """
+        SELECT u.user_id, u.username, u.password, u.role,
+               COALESCE(rs.is_online, FALSE) AS is_online
+        FROM users u
+        LEFT JOIN rider_status rs ON rs.user_id = u.user_id
+        WHERE u.username = $1
+    """),
+
+    # No row back means the user does not exist
+    'set_rider_status': ('integer, boolean', """
+        WITH u AS (
+            SELECT user_id, username, role FROM users WHERE user_id = $1
+        ), s AS (
+            INSERT INTO rider_status (user_id, is_online, last_updated)
+            SELECT user_id, $2, NOW() FROM u
+            ON CONFLICT (user_id) DO UPDATE
+                SET is_online = EXCLUDED.is_online, last_updated = EXCLUDED.last_updated
+            RETURNING last_updated
+        )
+        SELECT u.user_id, u.username, u.role, s.last_updated FROM u CROSS JOIN s
+    """),
+
+    # $1 user, $2 number of transactions. One row per recent transaction (or one row
+    # of NULLs); balance is NULL without a wallet. Pending journal credits are part of
+    # the balance. Ordered like wallet_history so the last row can seed a page cursor.
+    'wallet_details': ('integer, integer', """
+        SELECT w.balance + COALESCE((
+                   SELECT SUM(amount) FROM wallet_credit_journal WHERE wallet_id = w.wallet_id
+               ), 0) AS balance,
+               t.transaction_id, t.amount, t.transaction_type, t.category, t.description, t.created_at
+        FROM (SELECT $1::integer AS user_id) q
+        LEFT JOIN wallets w ON w.user_id = q.user_id
+        LEFT JOIN LATERAL (
+            SELECT transaction_id, amount, transaction_type, category, description, created_at
+            FROM wallet_transactions
+            WHERE wallet_id = w.wallet_id AND created_at IS NOT NULL
+            ORDER BY created_at DESC, transaction_id DESC LIMIT $2
+        ) t ON TRUE
+        ORDER BY t.created_at DESC, t.transaction_id DESC
+    """),
+
+    # $1 rider, $2 amount, $3 description, $4 admin
+    'wallet_recharge': ('integer, numeric, text, integer', """
+        WITH w AS (
+            INSERT INTO wallets (user_id, balance, last_updated)
+            VALUES ($1, $2, NOW())
+            ON CONFLICT (user_id) DO UPDATE
+                SET balance = wallets.balance + EXCLUDED.balance, last_updated = NOW()
+            RETURNING wallet_id, balance
+        ), t AS (
+            INSERT INTO wallet_transactions
+            (wallet_id, amount, transaction_type, category, description, performed_by)
+            SELECT wallet_id, $2, 'CREDIT', 'RECHARGE', $3, $4 FROM w
+            RETURNING transaction_id, amount, transaction_type, category, description, created_at
+        )
+        SELECT w.balance, t.* FROM w CROSS JOIN t
+    """),
+
+    # $1 rider, $2 admin, $3 amount, $4 category, $5 description, $6 admin description.
+    # Rider and admin must differ: one statement cannot update the same row twice.
+    'wallet_deduct': ('integer, integer, numeric, text, text, text', """
+        WITH r AS (
+            INSERT INTO wallets (user_id, balance, last_updated)
+            VALUES ($1, -$3, NOW())
+            ON CONFLICT (user_id) DO UPDATE
+                SET balance = wallets.balance + EXCLUDED.balance, last_updated = NOW()
+            RETURNING wallet_id, balance
+        ), a AS (
+            INSERT INTO wallets (user_id, balance, last_updated)
+            VALUES ($2, $3, NOW())
+            ON CONFLICT (user_id) DO UPDATE
+                SET balance = wallets.balance + EXCLUDED.balance, last_updated = NOW()
+            RETURNING wallet_id
+        ), t AS (
+            INSERT INTO wallet_transactions
+            (wallet_id, amount, transaction_type, category, description, performed_by)
+            SELECT wallet_id, $3, 'DEBIT', $4, $5, $2 FROM r
+            UNION ALL
+            SELECT wallet_id, $3, 'CREDIT', 'EARNING', $6, $2 FROM a
+            RETURNING transaction_id, amount, transaction_type, category, description, created_at
+        )
+        SELECT r.balance, (SELECT COUNT(*) FROM t) AS transactions, d.*
+        FROM r LEFT JOIN (SELECT * FROM t WHERE transaction_type = 'DEBIT') d ON TRUE
+    """),
+
+    # Same as wallet_deduct, but the admin credit goes to wallet_credit_journal instead
+    # of UPDATE wallets, so concurrent deductions do not queue on the admin's row lock.
+    # The admin wallet row is only read (FK inserts take a KEY SHARE lock, which does
+    # not conflict with other deductions). transactions < 2 means the admin has no
+    # wallet yet; the caller rolls back, creates it and retries.
+    'wallet_deduct_journaled': ('integer, integer, numeric, text, text, text', """
+        WITH r AS (
+            INSERT INTO wallets (user_id, balance, last_updated)
+            VALUES ($1, -$3, NOW())
+            ON CONFLICT (user_id) DO UPDATE
+                SET balance = wallets.balance + EXCLUDED.balance, last_updated = NOW()
+            RETURNING wallet_id, balance
+        ), a AS (
+            SELECT wallet_id FROM wallets WHERE user_id = $2
+        ), t AS (
+            INSERT INTO wallet_transactions
+            (wallet_id, amount, transaction_type, category, description, performed_by)
+            SELECT wallet_id, $3, 'DEBIT', $4, $5, $2 FROM r
+            UNION ALL
+            SELECT wallet_id, $3, 'CREDIT', 'EARNING', $6, $2 FROM a
+            RETURNING transaction_id, wallet_id, amount, transaction_type, category, description, created_at
+        ), j AS (
+            INSERT INTO wallet_credit_journal (wallet_id, amount, transaction_id)
+            SELECT wallet_id, $3, transaction_id FROM t WHERE transaction_type = 'CREDIT'
+        )
+        SELECT r.balance, (SELECT COUNT(*) FROM t) AS transactions,
+               d.transaction_id, d.amount, d.transaction_type, d.category, d.description, d.created_at
+        FROM r LEFT JOIN (SELECT * FROM t WHERE transaction_type = 'DEBIT') d ON TRUE
+    """),
+
+    # $1 admin, $2 amount, $3 method, $4 account details, $5 notes, $6 description.
+    # No row back means insufficient balance (or no wallet at all). Fold the admin's
+    # pending journal credits first (CreditJournal.fold_user) in the same transaction.
+    'admin_withdraw': ('integer, numeric, text, text, text, text', """
+        WITH w AS (
+            UPDATE wallets
+            SET balance = balance - $2, last_updated = NOW()
+            WHERE user_id = $1 AND balance >= $2
+            RETURNING wallet_id, balance
+        ), t AS (
+            INSERT INTO wallet_transactions
+            (wallet_id, amount, transaction_type, category, description, performed_by)
+            SELECT wallet_id, $2, 'DEBIT', 'WITHDRAWAL', $6, $1 FROM w
+            RETURNING transaction_id, amount, transaction_type, category, description, created_at
+        ), r AS (
+            INSERT INTO withdrawal_requests
+            (user_id, amount, method, account_details, notes, status, transaction_id)
+            SELECT $1, $2, $3, $4, $5, 'COMPLETED', transaction_id FROM t
+            RETURNING request_id
+        )
+        SELECT w.balance, t.*, r.request_id FROM w CROSS JOIN t CROSS JOIN r
+    """),
+
+    'create_wallet': ('integer', """
+        INSERT INTO wallets (user_id, balance, last_updated)
+        VALUES ($1, 0.00, NOW())
+        ON CONFLICT (user_id) DO NOTHING
+    """),
+}
+
+
+def typed_statement(name):
+    """A statement with its parameter types as casts, for drivers that prepare
+    without PREPARE's type list (asyncpg); $n already cast are left alone"""
+    types, sql = STATEMENTS[name]
+    types = [t.strip() for t in types.split(',')]
+    return re.sub(r'\$(\d+)(?![\d:])', lambda m: f'${m.group(1)}::{types[int(m.group(1)) - 1]}', sql)
+
+
+def execute(cursor, name, params=()):
+    """Run a named statement, preparing it on first use on this connection.
+
+    The cursor must come from a db_pool.PooledConnection, which tracks the
+    names already prepared on its session.
+    """
+    connection = cursor.connection
+    if name not in connection.prepared_statements:
+        types, sql = STATEMENTS[name]
+        # PREPARE is not transactional, it survives a later rollback
+        cursor.execute(f"PREPARE {name} ({types}) AS {sql}")
+        connection.prepared_statements.add(name)
+    placeholders = ', '.join(['%s'] * len(params))
+    try:
+        cursor.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+    except errors.InvalidSqlStatementName:
+        # Session was reset behind our back (e.g. DISCARD ALL); prepare again next time
+        connection.prepared_statements.discard(name)
+        raise
+    return cursor
+
+
+def ensure_schema(pool, statements=SCHEMA_STATEMENTS):
+    """Create the keys and tables the statements rely on; returns True when all succeeded.
+
+    Runs in autocommit so CREATE INDEX CONCURRENTLY is allowed and one
+    failing statement does not undo the others.
+    """
+    ok = True
+    with pool.connection() as connection:
+        connection.autocommit = True
+        try:
+            cursor = connection.cursor()
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except Exception as e:
+                    ok = False
+                    logger.error(f"Schema statement failed: {e}")
+        finally:
+            connection.autocommit = False
+    return ok
@@ -0,0 +1,394 @@
+"""asyncio entry point: the rider-facing API and Socket.IO on an ASGI server.
+
+    uvicorn rider_asgi:app --host 0.0.0.0 --port 5000
+
+Serves the routes and Socket.IO events riders and dashboards hit all the
+time, with the same request parsing, responses and events as rider_backend:
+both call rider_service for everything but I/O. Here requests run as
+coroutines on one event loop, queries go through an asyncpg pool (the
+queries.STATEMENTS text with its types as casts; asyncpg prepares and caches
+it per connection) and sockets are a socketio.AsyncServer.
+
+The shared background loops (location writer, broadcaster, presence, rider
+state reconciler) are the same blocking code as under eventlet; they run
+in native threads with a small psycopg2 pool, and their emits are handed
+to the event loop by AsyncEmitter.
+
+Wallet writes, bulk ledger operations, reports, exports and admin routes
+stay on rider_backend, as do offline-buffer uploads: put both behind one
+proxy and route /api/wallet/ (except /api/wallet/details/), /api/admin/,
+/api/auth/ and /api/locations/ there. Each process verifies the other's
+session tokens, so both need the same SECRET_KEY (this one refuses to
+start without it), and the same MESSAGE_BUS so a logout or revoked session
+on either holds on both. Here the bus carries only those revocations:
+Socket.IO emits and presence are not shared, so running several of these
+processes still needs sticky sessions.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import asyncpg
+import socketio
+from dotenv import load_dotenv
+
+import queries
+import rider_service
+from auth_tokens import TokenError
+from db_pool import ConnectionPool
+from message_bus import create_bus
+from rider_service import RiderService, RequestError, WALLET_DETAILS_TRANSACTIONS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST'),
+    'port': int(os.environ.get('DB_PORT', 5432)),
+    'database': os.environ.get('DB_NAME'),
+    'user': os.environ.get('DB_USER'),
+    'password': os.environ.get('DB_PASSWORD')
+}
+DB_SSLMODE = os.environ.get('DB_SSLMODE', 'require')
+
+# Shares session revocations with rider_backend; see the module docstring
+MESSAGE_BUS = os.environ.get('MESSAGE_BUS', '')
+message_bus = create_bus(MESSAGE_BUS, DB_CONFIG, sslmode=DB_SSLMODE,
+                         flush_interval=float(os.environ.get('MESSAGE_BUS_FLUSH_INTERVAL', 0.005)))
+if not message_bus:
+    logger.warning("MESSAGE_BUS is not set; logouts here and on rider_backend are not shared")
+
+
+class AsyncEmitter:
+    """emit(event, data, to=None) for the shared subsystems, callable from any thread.
+
+    On the event loop the emit becomes a task; from a background thread it is
+    scheduled on the loop with run_coroutine_threadsafe. Either way the
+    caller does not wait for delivery, as with Flask-SocketIO.
+    """
+
+    def __init__(self, sio):
+        self.sio = sio
+        self.loop = None
+        self._tasks = set()
+
+    def emit(self, event, data, to=None):
+        if self.loop is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            task = self.loop.create_task(self.sio.emit(event, data, to=to))
+            # The loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self.sio.emit(event, data, to=to), self.loop)
+
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+emitter = AsyncEmitter(sio)
+service = RiderService.from_env(emitter, rider_service.secret_key(shared=True))
+if message_bus:
+    service.session_tokens.attach_bus(message_bus)
+
+# Request-path connections; asyncpg keeps each connection's prepared statements
+db = None
+STATEMENTS = {name: queries.typed_statement(name) for name in queries.STATEMENTS}
+
+# Blocking pool for the background loops, which run in native threads
+job_pool = ConnectionPool(
+    DB_CONFIG,
+    minconn=1,
+    maxconn=int(os.environ.get('ASGI_JOB_POOL_MAX', 5)),
+    acquire_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    sslmode=DB_SSLMODE
+)
+
+
+async def fetch(name, *args):
+    """Rows of a queries.STATEMENTS statement"""
+    return await db.fetch(STATEMENTS[name], *args)
+
+
+async def fetchrow(name, *args):
+    return await db.fetchrow(STATEMENTS[name], *args)
+
+
+# ------------------- Lifecycle ------------------- #
+
+async def startup():
+    global db
+    emitter.loop = asyncio.get_running_loop()
+    db = await asyncpg.create_pool(
+        **DB_CONFIG,
+        ssl=DB_SSLMODE,
+        min_size=int(os.environ.get('DB_POOL_MIN', 2)),
+        max_size=int(os.environ.get('DB_POOL_MAX', 20)),
+        max_inactive_connection_lifetime=float(os.environ.get('ASGI_DB_IDLE_SECONDS', 300))
+    )
+    if message_bus:
+        message_bus.start(lambda fn: threading.Thread(target=fn, daemon=True, name=fn.__qualname__).start())
+    for job, args in service.background_jobs(job_pool):
+        threading.Thread(target=job, args=args, daemon=True, name=job.__qualname__).start()
+    logger.info("asyncio API server started")
+
+
+async def shutdown():
+    await asyncio.get_running_loop().run_in_executor(None, service.location_writer.close, job_pool)
+    if db is not None:
+        await db.close()
+
+
+# ------------------- HTTP ------------------- #
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Authorization, Content-Type'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS')
+]
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers = {k.decode().lower(): v.decode() for k, v in scope.get('headers', [])}
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            raise RequestError('Invalid JSON body')
+
+    def bearer_token(self):
+        header = self.headers.get('authorization', '')
+        if header.startswith('Bearer '):
+            return header[len('Bearer '):].strip()
+        return None
+
+
+async def send_json(send, body, status=200):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(payload)).encode())] + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def index(request):
+    return {
+        'status': 'running',
+        'message': 'Rider API Server is running (Schema Updated)',
+        'active_users': service.presence.online_count(),
+        'version': '2.0'
+    }, 200
+
+
+async def health_check(request):
+    try:
+        await db.fetchval("SELECT 1")
+        db_status = 'connected'
+    except Exception as e:
+        db_status = f'error: {str(e)}'
+
+    return {
+        'status': 'healthy',
+        'server': 'asyncio',
+        'database': db_status,
+        'db_pool': {
+            'size': db.get_size(),
+            'idle': db.get_idle_size(),
+            'max_size': db.get_max_size()
+        },
+        'job_pool': job_pool.stats(),
+        'message_bus': message_bus.stats() if message_bus else 'disabled',
+        **service.stats(),
+        'timestamp': datetime.now().isoformat()
+    }, 200
+
+
+async def login(request):
+    username, password = rider_service.parse_login(request.json())
+    # User and online status in one round trip
+    user = await fetchrow('login_user', username)
+    return service.login_response(user, password), 200
+
+
+async def logout(request):
+    """Revoke the caller's session token"""
+    try:
+        claims = service.session_tokens.verify(request.bearer_token())
+    except TokenError as e:
+        raise RequestError(str(e), 401)
+    # Publishing to a broker is blocking I/O
+    await asyncio.get_running_loop().run_in_executor(None, service.session_tokens.revoke, claims)
+    return {'success': True, 'message': 'Logged out'}, 200
+
+
+async def update_status(request):
+    user_id, is_online = rider_service.parse_status_update(request.json())
+    # Verify the user and upsert the status in one statement (autocommit)
+    user = await fetchrow('set_rider_status', user_id, is_online)
+    return service.status_changed(user_id, is_online, user), 200
+
+
+async def update_location(request):
+    user_id, lat, lng, location_time = rider_service.parse_location(request.json())
+    return service.accept_location(user_id, lat, lng, location_time), 200
+
+
+async def get_online_users(request):
+    if service.serving_state:
+        return rider_service.riders_response(service.rider_state.online()), 200
+    return rider_service.riders_response(await db.fetch(rider_service.ONLINE_RIDERS_QUERY)), 200
+
+
+async def get_all_riders(request):
+    if service.serving_state:
+        return rider_service.riders_response(service.rider_state.all()), 200
+    return rider_service.riders_response(await db.fetch(rider_service.ALL_RIDERS_QUERY)), 200
+
+
+async def get_nearby_riders(request):
+    return service.nearby_response(request.args), 200
+
+
+async def get_wallet_details(request, user_id):
+    rows = await fetch('wallet_details', user_id, WALLET_DETAILS_TRANSACTIONS + 1)
+    return rider_service.wallet_details_response(rows), 200
+
+
+ROUTES = [
+    ('GET', re.compile(r'/'), index),
+    ('GET', re.compile(r'/health'), health_check),
+    ('POST', re.compile(r'/api/login'), login),
+    ('POST', re.compile(r'/api/logout'), logout),
+    ('POST', re.compile(r'/api/update_status'), update_status),
+    ('POST', re.compile(r'/api/update_location'), update_location),
+    ('GET', re.compile(r'/api/riders/online'), get_online_users),
+    ('GET', re.compile(r'/api/riders/all'), get_all_riders),
+    ('GET', re.compile(r'/api/riders/nearby'), get_nearby_riders),
+    ('GET', re.compile(r'/api/wallet/details/(\d+)'), get_wallet_details),
+]
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def http_app(scope, receive, send):
+    """Plain ASGI router for the REST routes; Socket.IO traffic never reaches it"""
+    if scope['type'] != 'http':
+        return
+    if scope['method'] == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 204, 'headers': CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    request = Request(scope, await read_body(receive))
+    for method, pattern, view in ROUTES:
+        match = pattern.fullmatch(request.path)
+        if match and method == request.method:
+            break
+    else:
+        await send_json(send, {'success': False, 'message': f'Not found: {request.method} {request.path}'}, 404)
+        return
+
+    try:
+        body, status = await view(request, *(int(g) for g in match.groups()))
+    except RequestError as e:
+        body, status = e.response(), e.status
+    except Exception as e:
+        logger.error(f"{view.__name__} error: {e}")
+        body, status = {'success': False, 'message': f'Server error: {str(e)}'}, 500
+    await send_json(send, body, status)
+
+
+# ------------------- Socket.IO Events ------------------- #
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    """Same handshake as rider_backend: token in the auth payload or ?token="""
+    query_token = parse_qs(environ.get('QUERY_STRING', '')).get('token', [None])[-1]
+    claims, rooms = service.socket_connected(sid, rider_service.socket_token(auth, query_token))
+    for room in rooms:
+        await sio.enter_room(sid, room)
+    await sio.emit('connection_response', service.connection_response(sid, claims), to=sid)
+
+
+@sio.event
+async def disconnect(sid, reason=None):
+    service.socket_disconnected(sid)
+
+
+@sio.on('heartbeat')
+async def handle_heartbeat(sid, data=None):
+    return service.socket_heartbeat(sid)
+
+
+@sio.on('location_update')
+async def handle_location_ingest(sid, data):
+    return service.socket_locations(sid, data)
+
+
+@sio.on('update_location_realtime')
+async def handle_location_update(sid, data):
+    service.realtime_location(sid, data)
+
+
+async def _move_rooms(sid, result):
+    ack, joined, left = result
+    for room in joined:
+        await sio.enter_room(sid, room)
+    for room in left:
+        await sio.leave_room(sid, room)
+    return ack
+
+
+@sio.on('subscribe_viewport')
+async def handle_subscribe_viewport(sid, data):
+    return await _move_rooms(sid, service.subscribe_viewport(sid, data))
+
+
+@sio.on('set_location_format')
+async def handle_set_location_format(sid, data):
+    return await _move_rooms(sid, service.set_location_format(sid, data))
+
+
+@sio.on('unsubscribe_viewport')
+async def handle_unsubscribe_viewport(sid, data=None):
+    return await _move_rooms(sid, service.unsubscribe_viewport(sid))
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=startup, on_shutdown=shutdown)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -3,17 +3,34 @@ import eventlet
 
 eventlet.monkey_patch()
 
-from flask import Flask, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, request, jsonify, g, Response, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 import logging
 import sys
+import atexit
+import json
+import time
 from decimal import Decimal
+from db_pool import ConnectionPool, RoundTripStats, configure_green_mode
+import queries
+import wallet_journal
+from wallet_journal import CreditJournal
+import wallet_bulk
+import wallet_history
+import ledger_export
+import location_upload
+from location_upload import LocationUploader
+import ledger_reconciliation
+from ledger_reconciliation import LedgerReconciler
+from wallet_rollups import WalletRollups, PERIODS as ROLLUP_PERIODS, GROUPINGS as ROLLUP_GROUPINGS
+from auth_tokens import require_auth
+from message_bus import BusManager, create_bus
+import rider_service
+from rider_service import RiderService, RequestError, transaction_to_json, WALLET_DETAILS_TRANSACTIONS
 
 # Configure logging
 logging.basicConfig(
@@ -30,7 +47,6 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
 load_dotenv()
 
@@ -42,324 +58,286 @@ DB_CONFIG = {
     'password': os.environ.get('DB_PASSWORD')
 }
 
-# Active users dictionary to track Socket.IO connections
-active_users = {}
+# Cross-worker delivery of Socket.IO emits and presence, so several gunicorn workers can
+# run: '' (single process), 'postgres' (LISTEN/NOTIFY) or a broker URL (redis://, amqp://)
+MESSAGE_BUS = os.environ.get('MESSAGE_BUS', '')
+message_bus = create_bus(MESSAGE_BUS, DB_CONFIG, sslmode=os.environ.get('DB_SSLMODE', 'require'),
+                         flush_interval=float(os.environ.get('MESSAGE_BUS_FLUSH_INTERVAL', 0.005)))
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
+                    **({'client_manager': BusManager(message_bus)} if message_bus else {}))
+
+# Signs session tokens and Flask sessions
+SECRET_KEY = rider_service.secret_key()
+app.config['SECRET_KEY'] = SECRET_KEY
+
+# Rider state, presence, the location pipeline and session tokens; shared with rider_asgi
+service = RiderService.from_env(socketio, SECRET_KEY)
+session_tokens = service.session_tokens
+rider_state = service.rider_state
+location_history = service.location_history
+location_writer = service.location_writer
+location_broadcaster = service.location_broadcaster
+presence = service.presence
+location_filter = service.location_filter
+if message_bus:
+    presence.attach_bus(message_bus)
+    session_tokens.attach_bus(message_bus)
+
+# psycopg2 is a C extension: without this a running query blocks the whole hub
+DB_GREEN_MODE = os.environ.get('DB_GREEN_MODE', 'wait_callback')
+
+# Statements, commits and rollbacks sent per request, by endpoint (see /health)
+round_trips = RoundTripStats()
+
+# Shared connection pool: avoids a TCP + TLS + auth handshake per request
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    minconn=int(os.environ.get('DB_POOL_MIN', 2)),
+    maxconn=int(os.environ.get('DB_POOL_MAX', 20)),
+    acquire_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    max_uses=int(os.environ.get('DB_POOL_MAX_USES', 1000)),
+    sslmode=os.environ.get('DB_SSLMODE', 'require'),
+    cursor_factory=configure_green_mode(DB_GREEN_MODE),
+    round_trips=round_trips
+)
+
+
+def db_connection():
+    """Context manager yielding a pooled PostgreSQL connection"""
+    return db_pool.connection()
+
+
+# Rows per server-side cursor round trip in /api/riders/<id>/track
+LOCATION_TRACK_FETCH_SIZE = int(os.environ.get('LOCATION_TRACK_FETCH_SIZE', 2000))
+
+# Offline buffers posted to /api/locations/batch. History is COPYed only with
+# DB_GREEN_MODE=tpool or off; the default wait_callback cannot COPY and sends
+# one multi-row INSERT instead
+location_uploader = LocationUploader(
+    location_history,
+    use_copy=DB_GREEN_MODE != 'wait_callback',
+    max_points=int(os.environ.get('LOCATION_UPLOAD_MAX_POINTS', 10000)),
+    max_bytes=int(os.environ.get('LOCATION_UPLOAD_MAX_BYTES', 5 * 1024 * 1024))
+)
+
+# Admin earnings from deductions go through an append-only journal folded in the
+# background, instead of every deduction locking the admin's wallet row
+WALLET_CREDIT_JOURNAL = os.environ.get('WALLET_CREDIT_JOURNAL', '1') == '1'
+credit_journal = CreditJournal(
+    interval=float(os.environ.get('WALLET_JOURNAL_FOLD_INTERVAL', 1.0)),
+    batch_size=int(os.environ.get('WALLET_JOURNAL_FOLD_BATCH', 5000))
+)
+
+# Daily/monthly totals per rider and category, folded from the ledger in the background
+wallet_rollups = WalletRollups(
+    interval=float(os.environ.get('WALLET_ROLLUP_INTERVAL', 2.0)),
+    batch_size=int(os.environ.get('WALLET_ROLLUP_BATCH', 5000))
+)
+
+# Balance-vs-ledger check; each run only reads ledger rows added since the wallet's checkpoint
+ledger_reconciler = LedgerReconciler(
+    interval=float(os.environ.get('LEDGER_RECONCILE_INTERVAL', 300)),
+    batch_size=int(os.environ.get('LEDGER_RECONCILE_BATCH', 500)),
+    settle_seconds=int(os.environ.get('LEDGER_RECONCILE_SETTLE_SECONDS', 300))
+)
+
+# Rows per server-side cursor round trip in /api/admin/export
+LEDGER_EXPORT_FETCH_SIZE = int(os.environ.get('LEDGER_EXPORT_FETCH_SIZE', 5000))
+
+# Upper bound on operations per /api/wallet/bulk request (explicit list or expanded rule)
+BULK_LEDGER_MAX_ROWS = int(os.environ.get('BULK_LEDGER_MAX_ROWS', 10000))
+
+_background_started = False
+
+
+def ensure_query_schema():
+    """Create the keys the prepared statements rely on, retrying until the DB is reachable"""
+    while True:
+        try:
+            queries.ensure_schema(db_pool, queries.SCHEMA_STATEMENTS + wallet_history.SCHEMA_STATEMENTS +
+                                  ledger_reconciliation.SCHEMA_STATEMENTS + ledger_export.SCHEMA_STATEMENTS)
+            return
+        except Exception as e:
+            logger.error(f"Query schema setup error: {e}")
+            time.sleep(30)
+
+
+def start_background_jobs():
+    """Start periodic jobs once per process"""
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    if message_bus:
+        message_bus.start(socketio.start_background_task)
+    socketio.start_background_task(ensure_query_schema)
+    for job, args in service.background_jobs(db_pool):
+        socketio.start_background_task(job, *args)
+    # Always folds, so entries left from a run with the journal enabled still get applied
+    socketio.start_background_task(credit_journal.run, db_pool)
+    socketio.start_background_task(wallet_rollups.run, db_pool)
+    socketio.start_background_task(ledger_reconciler.run, db_pool)
+    atexit.register(location_writer.close, db_pool)
+
+
+@app.before_request
+def _ensure_background_jobs():
+    start_background_jobs()
+    round_trips.begin()
+
+
+@app.after_request
+def _record_round_trips(response):
+    # Streamed bodies run after this, so their queries are not included
+    round_trips.end(request.endpoint or 'unmatched')
+    return response
+
+
+push_wallet_update = service.push_wallet_update
 
 
-def get_db_connection():
-    """Create and return a PostgreSQL database connection"""
-    try:
-        connection = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor, sslmode='require')
-        logger.info("Database connection established")
-        return connection
-    except Exception as e:
-        logger.error(f"Error connecting to PostgreSQL: {e}")
-        return None
-
-
-def close_db_connection(connection, cursor=None):
-    """Close database connection and cursor"""
-    if cursor:
-        cursor.close()
-    if connection:
-        connection.close()
-
-def get_or_create_wallet(cursor, user_id):
-    """Ensure a wallet exists for the user"""
-    cursor.execute("SELECT wallet_id, balance FROM wallets WHERE user_id = %s", (user_id,))
-    wallet = cursor.fetchone()
-    if not wallet:
-        cursor.execute(
-            "INSERT INTO wallets (user_id, balance) VALUES (%s, 0.00) RETURNING wallet_id, balance",
-            (user_id,)
-        )
-        wallet = cursor.fetchone()
-    return wallet
 # ------------------- REST API Endpoints ------------------- #
 
 @app.route('/api/login', methods=['POST'])
 def login():
     """Login endpoint for user authentication"""
-    connection = None
-    cursor = None
     try:
-        data = request.get_json()
-        username = data.get('username')  # Changed from rider_name
-        password = data.get('password')
-
-        if not username or not password:
-            return jsonify({'success': False, 'message': 'Username and password are required'}), 400
-
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # Updated Query for 'users' table
-        cursor.execute("SELECT user_id, username, password, role FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-
-        if user and user['password'] == password:
-            # Get online status
-            cursor.execute("SELECT is_online FROM rider_status WHERE user_id = %s", (user['user_id'],))
-            status = cursor.fetchone()
-
-            response = {
-                'success': True,
-                'user_id': user['user_id'],
-                'username': user['username'],
-                'role': user['role'],  # Return the role
-                'is_online': status['is_online'] if status else False,
-                'message': 'Login successful'
-            }
-            close_db_connection(connection, cursor)
-            return jsonify(response), 200
-        else:
-            close_db_connection(connection, cursor)
-            return jsonify({'success': False, 'message': 'Invalid username or password'}), 401
+        username, password = rider_service.parse_login(request.get_json())
 
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # User and online status in one round trip
+            user = queries.execute(cursor, 'login_user', (username,)).fetchone()
+
+        return jsonify(service.login_response(user, password)), 200
+
+    except RequestError as e:
+        return jsonify(e.response()), e.status
     except Exception as e:
         logger.error(f"Login error: {e}")
-        if connection:
-            close_db_connection(connection, cursor)
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
 
+@app.route('/api/logout', methods=['POST'])
+@require_auth(session_tokens)
+def logout():
+    """Revoke the caller's session token"""
+    session_tokens.revoke(g.auth)
+    return jsonify({'success': True, 'message': 'Logged out'}), 200
+
+
+@app.route('/api/auth/revoke/<int:user_id>', methods=['POST'])
+@require_auth(session_tokens, role='admin')
+def revoke_user_sessions(user_id):
+    """Invalidate all of a user's sessions, e.g. after changing their role"""
+    session_tokens.revoke_user(user_id)
+    logger.info(f"Admin {g.auth['user_id']} revoked sessions of user {user_id}")
+    return jsonify({'success': True, 'message': f'Sessions of user {user_id} revoked'}), 200
+
+
 @app.route('/api/update_status', methods=['POST'])
 def update_status():
     """Update user online/offline status"""
-    connection = None
-    cursor = None
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')  # Changed from rider_id
-        is_online = data.get('is_online')
-
-        if user_id is None:
-            return jsonify({'success': False, 'message': 'User ID is required'}), 400
-
-        if is_online is None:
-            return jsonify({'success': False, 'message': 'Status is required'}), 400
-
-        # Handle boolean conversion
-        if isinstance(is_online, int):
-            is_online = bool(is_online)
-        elif isinstance(is_online, str):
-            is_online = is_online.lower() == 'true'
-
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # Verify user exists
-        cursor.execute("SELECT user_id FROM users WHERE user_id = %s", (user_id,))
-        user_exists = cursor.fetchone()
-
-        if not user_exists:
-            close_db_connection(connection, cursor)
-            return jsonify({'success': False, 'message': 'User not found'}), 404
-
-        # Check status existence
-        cursor.execute("SELECT status_id FROM rider_status WHERE user_id = %s", (user_id,))
-        status_exists = cursor.fetchone()
-
-        if status_exists:
-            cursor.execute("""
-                UPDATE rider_status
-                SET is_online = %s, last_updated = NOW()
-                WHERE user_id = %s
-            """, (is_online, user_id))
-        else:
-            cursor.execute("""
-                INSERT INTO rider_status (user_id, is_online, last_updated)
-                VALUES (%s, %s, NOW())
-            """, (user_id, is_online))
-
-        connection.commit()
-
-        logger.info(f"✓ Status updated for user {user_id}: is_online={is_online}")
-
-        # Emit status change with new key names
-        socketio.emit('rider_status_changed', {
-            'user_id': user_id,
-            'rider_id': user_id,  # Keep for backward compatibility if needed temporarily
-            'is_online': is_online,
-            'timestamp': datetime.now().isoformat()
-        })
+        user_id, is_online = rider_service.parse_status_update(request.get_json())
 
-        close_db_connection(connection, cursor)
-        return jsonify({
-            'success': True,
-            'message': 'Status updated successfully',
-            'user_id': user_id,
-            'is_online': is_online
-        }), 200
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # Verify the user and upsert the status in one statement
+            user_exists = queries.execute(cursor, 'set_rider_status', (user_id, is_online)).fetchone()
+            if user_exists:
+                connection.commit()
 
+        return jsonify(service.status_changed(user_id, is_online, user_exists)), 200
+
+    except RequestError as e:
+        return jsonify(e.response()), e.status
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"Status update error: {e}")
-        if connection:
-            close_db_connection(connection, cursor)
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
 
 @app.route('/api/update_location', methods=['POST'])
 def update_location():
     """Update user location"""
-    connection = None
-    cursor = None
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')  # Changed from rider_id
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        device_timestamp = data.get('timestamp')
+        user_id, lat, lng, location_time = rider_service.parse_location(request.get_json())
+        return jsonify(service.accept_location(user_id, lat, lng, location_time)), 200
 
-        if user_id is None or latitude is None or longitude is None:
-            return jsonify({'success': False, 'message': 'User ID, latitude, and longitude are required'}), 400
+    except RequestError as e:
+        return jsonify(e.response()), e.status
+    except Exception as e:
+        logger.error(f"Update location error: {e}")
+        return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
+
+
+@app.route('/api/locations/batch', methods=['POST'])
+@require_auth(session_tokens)
+def upload_locations():
+    """Replay a rider's offline buffer in one request (see location_upload).
+    Riders upload their own fixes; admins may name the rider with user_id."""
+    try:
+        data = location_upload.decode_body(request.get_data(), request.headers.get('Content-Encoding'),
+                                           location_uploader.max_bytes)
+        user_id = g.auth['user_id']
+        if g.auth['role'] == 'admin' and isinstance(data, dict) and data.get('user_id') is not None:
+            user_id = int(data['user_id'])
+        rows, rejected, duplicates = location_uploader.prepare(data)
+        # Parked stretches of the buffer collapse to a sparse trail, like live fixes
+        received = len(rows)
+        rows = location_filter.thin(rows)
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    try:
+        written = already_stored = 0
+        moved = False
+        if rows:
+            with db_connection() as connection:
+                written, already_stored, moved = location_uploader.write(connection, user_id, rows)
+
+        # Only the final position is broadcast, and only if it is the newest one stored
+        if moved:
+            location_time, lat, lng = rows[-1]
+            service.location_uploaded(user_id, lat, lng, location_time)
 
-        # Validate lat/lng
-        try:
-            lat = float(latitude)
-            lng = float(longitude)
-        except (ValueError, TypeError):
-            return jsonify({'success': False, 'message': 'Invalid coordinates'}), 400
-
-        # Parse timestamp
-        location_time = datetime.now()
-        if device_timestamp:
-            try:
-                location_time = datetime.fromisoformat(device_timestamp.replace('Z', '+00:00'))
-            except:
-                pass
-
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # Check if location record exists
-        cursor.execute("""
-            SELECT location_id FROM rider_location 
-            WHERE user_id = %s 
-            ORDER BY location_time DESC 
-            LIMIT 1
-        """, (user_id,))
-
-        existing_location = cursor.fetchone()
-
-        if existing_location:
-            cursor.execute("""
-                UPDATE rider_location 
-                SET latitude = %s, longitude = %s, location_time = %s
-                WHERE location_id = %s
-            """, (lat, lng, location_time, existing_location['location_id']))
-        else:
-            cursor.execute("""
-                INSERT INTO rider_location (user_id, latitude, longitude, location_time)
-                VALUES (%s, %s, %s, %s)
-            """, (user_id, lat, lng, location_time))
-
-        connection.commit()
-
-        # Emit Socket event - IMPORTANT: Sending 'update_location_realtime' as requested by client mismatch check
-        # But wait, the client LISTENS to 'update_location_realtime' from the server?
-        # Usually client EMITS 'update_location_realtime' and server EMITS 'rider_location_updated'.
-        # I will emit BOTH to be safe based on your previous debugging.
-
-        payload = {
-            'user_id': user_id,
-            'rider_id': user_id,  # Backward compatibility
-            'latitude': lat,
-            'longitude': lng,
-            'timestamp': location_time.isoformat()
-        }
-
-        # Standard event
-        socketio.emit('rider_location_updated', payload)
-        # The one you fixed in the Flutter Admin Dashboard
-        socketio.emit('update_location_realtime', payload)
-
-        close_db_connection(connection, cursor)
         return jsonify({
             'success': True,
-            'message': 'Location updated successfully',
-            'timestamp': location_time.isoformat()
+            'user_id': user_id,
+            'written': written,
+            'already_stored': already_stored,
+            'duplicates': duplicates,
+            'filtered': received - len(rows),
+            'rejected': rejected,
+            'latest_updated': moved,
+            'last_timestamp': rows[-1][0].isoformat() if rows else None
         }), 200
 
     except Exception as e:
-        logger.error(f"Update location error: {e}")
-        if connection:
-            close_db_connection(connection, cursor)
+        logger.error(f"Location upload error: {e}")
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
 
 @app.route('/api/riders/online', methods=['GET'])
 def get_online_users():
     """Get all online USERS (riders)"""
-    connection = None
-    cursor = None
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # Updated query to use 'users' table and 'user_id'
-        # Added filter WHERE role = 'rider' so admins don't show up on the map
-        cursor.execute("""
-            SELECT
-                u.user_id,
-                u.username,
-                u.role,
-                COALESCE(rs.is_online, FALSE) as is_online,
-                rs.last_updated,
-                rl_latest.latitude,
-                rl_latest.longitude,
-                rl_latest.location_time as last_location_time
-            FROM users u
-            LEFT JOIN rider_status rs ON u.user_id = rs.user_id
-            LEFT JOIN LATERAL (
-                SELECT latitude, longitude, location_time
-                FROM rider_location
-                WHERE user_id = u.user_id
-                ORDER BY location_time DESC
-                LIMIT 1
-            ) rl_latest ON TRUE
-            WHERE rs.is_online = TRUE AND u.role = 'rider'
-        """)
-        users = cursor.fetchall()
-        close_db_connection(connection, cursor)
-
-        riders_list = []
-        for user in users:
-            u_dict = dict(user)
-            # Map new DB columns to expected Frontend JSON keys if needed
-            u_dict['rider_id'] = u_dict['user_id']  # Add alias for compatibility
-            u_dict['rider_name'] = u_dict['username']  # Add alias for compatibility
-
-            if u_dict['latitude'] is not None:
-                u_dict['latitude'] = float(u_dict['latitude'])
-            if u_dict['longitude'] is not None:
-                u_dict['longitude'] = float(u_dict['longitude'])
-            if u_dict['last_updated']:
-                u_dict['last_updated'] = u_dict['last_updated'].isoformat()
-            if u_dict['last_location_time']:
-                u_dict['last_location_time'] = u_dict['last_location_time'].isoformat()
-            riders_list.append(u_dict)
-
-        return jsonify({'success': True, 'count': len(riders_list), 'riders': riders_list}), 200
+        if service.serving_state:
+            return jsonify(rider_service.riders_response(rider_state.online())), 200
+
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # Added filter WHERE role = 'rider' so admins don't show up on the map
+            cursor.execute(rider_service.ONLINE_RIDERS_QUERY)
+            users = cursor.fetchall()
+
+        return jsonify(rider_service.riders_response(users)), 200
 
     except Exception as e:
         logger.error(f"Get online users error: {e}")
-        if connection:
-            close_db_connection(connection, cursor)
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
 
@@ -369,132 +347,144 @@ def get_online_users():
 @app.route('/api/riders/all', methods=['GET'])
 def get_all_riders():
     """Get all riders (both online and offline) with their wallet balances"""
-    connection = None
-    cursor = None
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # Get all riders with their status, location, and wallet balance
-        cursor.execute("""
-            SELECT
-                u.user_id,
-                u.username,
-                u.role,
-                COALESCE(rs.is_online, FALSE) as is_online,
-                rs.last_updated,
-                rl_latest.latitude,
-                rl_latest.longitude,
-                rl_latest.location_time as last_location_time,
-                COALESCE(w.balance, 0.00) as balance
-            FROM users u
-            LEFT JOIN rider_status rs ON u.user_id = rs.user_id
-            LEFT JOIN LATERAL (
-                SELECT latitude, longitude, location_time
-                FROM rider_location
-                WHERE user_id = u.user_id
-                ORDER BY location_time DESC
-                LIMIT 1
-            ) rl_latest ON TRUE
-            LEFT JOIN wallets w ON u.user_id = w.user_id
-            WHERE u.role = 'rider'
-            ORDER BY rs.is_online DESC, u.username ASC
-        """)
-
-        riders = cursor.fetchall()
-        close_db_connection(connection, cursor)
-
-        riders_list = []
-        for rider in riders:
-            r_dict = dict(rider)
-            # Map new DB columns to expected Frontend JSON keys
-            r_dict['rider_id'] = r_dict['user_id']
-            r_dict['rider_name'] = r_dict['username']
-
-            # Convert Decimal/float values
-            if r_dict['latitude'] is not None:
-                r_dict['latitude'] = float(r_dict['latitude'])
-            if r_dict['longitude'] is not None:
-                r_dict['longitude'] = float(r_dict['longitude'])
-            if r_dict['balance'] is not None:
-                r_dict['balance'] = float(r_dict['balance'])
-
-            # Convert datetime to ISO string
-            if r_dict['last_updated']:
-                r_dict['last_updated'] = r_dict['last_updated'].isoformat()
-            if r_dict['last_location_time']:
-                r_dict['last_location_time'] = r_dict['last_location_time'].isoformat()
-
-            riders_list.append(r_dict)
+        if service.serving_state:
+            return jsonify(rider_service.riders_response(rider_state.all())), 200
 
-        return jsonify({
-            'success': True,
-            'count': len(riders_list),
-            'riders': riders_list
-        }), 200
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # Get all riders with their status, location, and wallet balance
+            cursor.execute(rider_service.ALL_RIDERS_QUERY)
+
+            riders = cursor.fetchall()
+
+        return jsonify(rider_service.riders_response(riders)), 200
 
     except Exception as e:
         logger.error(f"Get all riders error: {e}")
-        if connection:
-            close_db_connection(connection, cursor)
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
+@app.route('/api/riders/nearby', methods=['GET'])
+def get_nearby_riders():
+    """Online riders closest to ?lat=&lng=, either the k nearest (?k=) or all within ?radius_km="""
+    try:
+        return jsonify(service.nearby_response(request.args)), 200
+    except RequestError as e:
+        return jsonify(e.response()), e.status
+
+
+@app.route('/api/riders/<int:user_id>/track', methods=['GET'])
+@require_auth(session_tokens)
+def get_rider_track(user_id):
+    """Stream a rider's location history between ?from= and ?to= (ISO 8601).
+    Admins may read any rider's track, riders only their own."""
+    if g.auth['role'] != 'admin' and g.auth['user_id'] != user_id:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    try:
+        start = datetime.fromisoformat(request.args['from'].replace('Z', '+00:00')) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to'].replace('Z', '+00:00')) if request.args.get('to') \
+            else datetime.now(start.tzinfo if start else None)
+        start = start or end - timedelta(days=1)
+        if start >= end:
+            return jsonify({'success': False, 'message': "'from' must be before 'to'"}), 400
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid from/to timestamp'}), 400
+
+    def generate():
+        # Rows come from a server-side cursor, so long ranges never load fully into memory
+        yield json.dumps({'success': True, 'user_id': user_id, 'from': start.isoformat(), 'to': end.isoformat()})[:-1]
+        yield ', "points": ['
+        try:
+            with db_connection() as connection:
+                first = True
+                for row in location_history.stream_track(connection, user_id, start, end, LOCATION_TRACK_FETCH_SIZE):
+                    point = {
+                        'latitude': row['latitude'],
+                        'longitude': row['longitude'],
+                        'timestamp': row['location_time'].isoformat()
+                    }
+                    yield ('' if first else ',') + json.dumps(point)
+                    first = False
+        except Exception as e:
+            # Headers are already sent; end the document with an error marker
+            logger.error(f"Track stream error: {e}")
+            yield '], "error": ' + json.dumps(str(e)) + '}'
+            return
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 # ------------------- Wallet Transaction End point ------------------- #
 
 @app.route('/api/wallet/details/<int:user_id>', methods=['GET'])
 def get_wallet_details(user_id):
-    connection = get_db_connection()
-    if not connection:
-        return jsonify({'success': False, 'message': 'Database error'}), 500
+    try:
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # Balance and recent transactions together; a missing wallet reads as 0.00
+            # (it is created by the first recharge or deduction, not by this GET).
+            # One extra row tells whether /api/wallet/transactions has more.
+            rows = queries.execute(cursor, 'wallet_details', (user_id, WALLET_DETAILS_TRANSACTIONS + 1)).fetchall()
+
+        return jsonify(rider_service.wallet_details_response(rows))
 
+    except Exception as e:
+        logger.error(f"Wallet fetch error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/wallet/transactions/<int:user_id>', methods=['GET'])
+def get_wallet_transactions(user_id):
+    """Page through a wallet's transactions, newest first.
+
+    ?limit= (max 100), ?cursor= (next_cursor of the previous page), and the
+    optional filters ?category=, ?type=CREDIT|DEBIT, ?from= and ?to= (ISO 8601).
+    """
     try:
-        cursor = connection.cursor()
-
-        # Get Wallet Balance
-        wallet = get_or_create_wallet(cursor, user_id)
-
-        # Get Recent Transactions
-        cursor.execute("""
-            SELECT amount, transaction_type, category, description, created_at 
-            FROM wallet_transactions 
-            WHERE wallet_id = %s 
-            ORDER BY created_at DESC LIMIT 20
-        """, (wallet['wallet_id'],))
-        transactions = cursor.fetchall()
-
-        # Convert datetime objects to string
-        tx_list = []
-        for tx in transactions:
-            t = dict(tx)
-            t['created_at'] = t['created_at'].isoformat()
-            t['amount'] = float(t['amount'])  # Convert Decimal to float for JSON
-            tx_list.append(t)
+        limit = wallet_history.page_size(request.args.get('limit'))
+        start = datetime.fromisoformat(request.args['from'].replace('Z', '+00:00')) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to'].replace('Z', '+00:00')) if request.args.get('to') else None
+        tx_type = request.args.get('type', '').upper() or None
+        if tx_type and tx_type not in wallet_history.TRANSACTION_TYPES:
+            raise ValueError(f"type must be one of {wallet_history.TRANSACTION_TYPES}")
+        after = request.args.get('cursor')
+        if after:
+            wallet_history.decode_cursor(after)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    try:
+        with db_connection() as connection:
+            cursor = connection.cursor()
+            transactions, next_cursor = wallet_history.transactions_page(
+                cursor, user_id, limit=limit, after=after, category=request.args.get('category'),
+                tx_type=tx_type, start=start, end=end
+            )
 
         return jsonify({
             'success': True,
-            'balance': float(wallet['balance']),
-            'transactions': tx_list
-        })
+            'count': len(transactions),
+            'transactions': [transaction_to_json(tx) for tx in transactions],
+            'next_cursor': next_cursor
+        }), 200
 
     except Exception as e:
-        logger.error(f"Wallet fetch error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        close_db_connection(connection)
+        logger.error(f"Wallet transactions error: {e}")
+        return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
 
 @app.route('/api/wallet/recharge', methods=['POST'])
+@require_auth(session_tokens, role='admin')
 def recharge_wallet():
     data = request.get_json()
-    admin_id = data.get('admin_id')
+    admin_id = g.auth['user_id']
     rider_id = data.get('rider_id')
     amount_raw = data.get('amount')
     description = data.get('description', 'Wallet Recharge')
 
-    if not all([admin_id, rider_id, amount_raw]):
+    if not all([rider_id, amount_raw]):
         return jsonify({'success': False, 'message': 'Invalid data'}), 400
 
     try:
@@ -505,40 +495,19 @@ def recharge_wallet():
     except:
         return jsonify({'success': False, 'message': 'Invalid amount format'}), 400
 
-    connection = get_db_connection()
     try:
-        cursor = connection.cursor()
-
-        # --- SECURITY CHECK START ---
-        # Verify that the user performing the action is actually an Admin
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (admin_id,))
-        performer = cursor.fetchone()
-
-        if not performer or performer['role'] != 'admin':
-            return jsonify({'success': False, 'message': 'Unauthorized: Only admins can perform this action'}), 403
-        # --- SECURITY CHECK END ---
-
-        # 1. Ensure Wallet Exists
-        wallet = get_or_create_wallet(cursor, rider_id)
-
-        # 2. Update Balance in SQL (Atomic Update)
-        cursor.execute("""
-                UPDATE wallets 
-                SET balance = balance + %s, last_updated = NOW() 
-                WHERE wallet_id = %s 
-                RETURNING balance
-            """, (amount, wallet['wallet_id']))
+        with db_connection() as connection:
+            cursor = connection.cursor()
 
-        new_balance = cursor.fetchone()['balance']
+            # Create-or-credit the wallet and log the transaction in one statement
+            result = queries.execute(cursor, 'wallet_recharge', (rider_id, amount, description, admin_id)).fetchone()
+            new_balance = result['balance']
 
-        # 3. Log Transaction
-        cursor.execute("""
-                INSERT INTO wallet_transactions 
-                (wallet_id, amount, transaction_type, category, description, performed_by)
-                VALUES (%s, %s, 'CREDIT', 'RECHARGE', %s, %s)
-            """, (wallet['wallet_id'], amount, description, admin_id))
+            connection.commit()
 
-        connection.commit()
+        rider_state.set_balance(rider_id, new_balance)
+        wallet_rollups.wake()
+        push_wallet_update(rider_id, new_balance, result)
 
         return jsonify({
             'success': True,
@@ -547,24 +516,22 @@ def recharge_wallet():
         })
 
     except Exception as e:
-        connection.rollback()
         logger.error(f"Recharge error: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        close_db_connection(connection)
 
 
 @app.route('/api/wallet/deduct', methods=['POST'])
+@require_auth(session_tokens, role='admin')
 def deduct_wallet():
     data = request.get_json()
-    admin_id = data.get('admin_id')
+    admin_id = g.auth['user_id']
     rider_id = data.get('rider_id')
     category = data.get('category')
     description = data.get('description')
     amount_raw = data.get('amount')
 
     # 1. Validate inputs
-    if not all([admin_id, rider_id, category, amount_raw]):
+    if not all([rider_id, category, amount_raw]):
         return jsonify({'success': False, 'message': 'Invalid data: Missing required fields'}), 400
 
     # 2. Validate Amount Format
@@ -575,90 +542,132 @@ def deduct_wallet():
     except:
         return jsonify({'success': False, 'message': 'Invalid amount format'}), 400
 
-    connection = None
-    cursor = None
+    try:
+        rider_id = int(rider_id)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid rider ID'}), 400
+
+    if rider_id == admin_id:
+        return jsonify({'success': False, 'message': 'Cannot deduct from your own wallet'}), 400
 
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # 3. Security Check (Is user an Admin?)
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (admin_id,))
-        performer = cursor.fetchone()
-
-        if not performer or performer['role'] != 'admin':
-            return jsonify({'success': False, 'message': 'Unauthorized: Only admins can perform this action'}), 403
-
-        # 4. Get Wallets (Create if they don't exist)
-        rider_wallet = get_or_create_wallet(cursor, rider_id)
-        admin_wallet = get_or_create_wallet(cursor, admin_id)
-
-        # Check if rider has enough balance (Optional - remove if negative balance is allowed)
-        # if rider_wallet['balance'] < amount:
-        #    return jsonify({'success': False, 'message': 'Insufficient rider balance'}), 400
-
-        # 5. DEDUCT from Rider
-        cursor.execute("""
-            UPDATE wallets 
-            SET balance = balance - %s, last_updated = NOW()
-            WHERE wallet_id = %s
-        """, (amount, rider_wallet['wallet_id']))
-
-        # Log Rider Transaction (DEBIT)
-        cursor.execute("""
-            INSERT INTO wallet_transactions (wallet_id, amount, transaction_type, category, description, performed_by)
-            VALUES (%s, %s, 'DEBIT', %s, %s, %s)
-        """, (rider_wallet['wallet_id'], amount, category, description, admin_id))
-
-        # 6. CREDIT to Admin
-        cursor.execute("""
-            UPDATE wallets 
-            SET balance = balance + %s, last_updated = NOW()
-            WHERE wallet_id = %s
-        """, (amount, admin_wallet['wallet_id']))
-
-        # Log Admin Transaction (CREDIT)
-        cursor.execute("""
-            INSERT INTO wallet_transactions (wallet_id, amount, transaction_type, category, description, performed_by)
-            VALUES (%s, %s, 'CREDIT', 'EARNING', %s, %s)
-        """, (admin_wallet['wallet_id'], amount, f"From Rider {rider_id}: {category}", admin_id))
-
-        connection.commit()
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # 3. Admin role was verified from the session token
+
+            # 4. Debit the rider, credit the admin and log both sides in one statement
+            # (wallets are created on first use; negative rider balances are allowed)
+            result = wallet_journal.deduct(connection, cursor, rider_id, admin_id, amount, category, description,
+                                           WALLET_CREDIT_JOURNAL)
+            rider_balance = result['balance']
+
+            connection.commit()
+
+        rider_state.set_balance(rider_id, rider_balance)
+        wallet_rollups.wake()
+        push_wallet_update(rider_id, rider_balance, result)
         return jsonify({'success': True, 'message': 'Deduction processed successfully'})
 
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"Deduction error: {e}")
         # Return JSON error instead of HTML
         return jsonify({'success': False, 'message': f"Server Error: {str(e)}"}), 500
 
-    finally:
-        # Always close connection
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+
+@app.route('/api/wallet/bulk', methods=['POST'])
+@require_auth(session_tokens, role='admin')
+def bulk_wallet_operations():
+    """Apply many recharges/deductions in one transaction.
+
+    Body is either {"operations": [{"rider_id", "amount", "type": "DEBIT"|"CREDIT",
+    "category", "description"}, ...]} or {"rule": {"target": "online_riders"|"all_riders",
+    "amount", "type", "category", "description"}}. Invalid rows are reported and
+    skipped; the valid ones are applied together or not at all.
+    """
+    data = request.get_json() or {}
+    admin_id = g.auth['user_id']
+    items = data.get('operations')
+    rule = data.get('rule')
+
+    if (items is None) == (rule is None) or (items is not None and not isinstance(items, list)) \
+            or (rule is not None and not isinstance(rule, dict)):
+        return jsonify({'success': False, 'message': "Provide either an 'operations' list or a 'rule' object"}), 400
+
+    try:
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            if rule is not None:
+                try:
+                    items = wallet_bulk.rule_operations(cursor, rule)
+                except ValueError as e:
+                    return jsonify({'success': False, 'message': str(e)}), 400
+
+            if len(items) > BULK_LEDGER_MAX_ROWS:
+                return jsonify({'success': False,
+                                'message': f'Too many operations ({len(items)}), limit is {BULK_LEDGER_MAX_ROWS}'}), 400
+
+            operations, results = wallet_bulk.parse_operations(items, admin_id)
+            applied, transactions = wallet_bulk.apply_operations(cursor, admin_id, operations, WALLET_CREDIT_JOURNAL)
+            connection.commit()
+
+        wallet_rollups.wake()
+        by_index = {op[0]: op for op in operations}
+        total_credited = Decimal('0.00')
+        total_debited = Decimal('0.00')
+        for row in applied:
+            op = by_index[row['idx']]
+            if row['balance'] is None:
+                results.append({'index': row['idx'], 'rider_id': row['user_id'], 'status': 'rejected',
+                                'message': 'Rider not found'})
+                continue
+            if op[3] == 'CREDIT':
+                total_credited += op[2]
+            else:
+                total_debited += op[2]
+            results.append({'index': row['idx'], 'rider_id': row['user_id'], 'status': 'applied',
+                            'type': op[3], 'amount': float(op[2]), 'new_balance': float(row['balance'])})
+            rider_state.set_balance(row['user_id'], row['balance'])
+        for user_id, balance in {row['user_id']: row['balance'] for row in applied
+                                 if row['balance'] is not None}.items():
+            push_wallet_update(user_id, balance)
+        results.sort(key=lambda r: r['index'])
+
+        applied_count = sum(1 for r in results if r['status'] == 'applied')
+        logger.info(f"Admin {admin_id} bulk ledger: {applied_count} applied, "
+                    f"{len(results) - applied_count} rejected, {transactions} ledger rows")
+
+        return jsonify({
+            'success': True,
+            'applied': applied_count,
+            'rejected': len(results) - applied_count,
+            'total_credited': float(total_credited),
+            'total_debited': float(total_debited),
+            'results': results
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Bulk ledger error: {e}")
+        return jsonify({'success': False, 'message': f"Server Error: {str(e)}"}), 500
 
 
 # Add this endpoint to your rider_backend.py file
 # Place it after the wallet deduction endpoint
 
 @app.route('/api/wallet/admin/withdraw', methods=['POST'])
+@require_auth(session_tokens, role='admin')
 def admin_withdraw():
     """Process admin withdrawal request"""
     data = request.get_json()
-    admin_id = data.get('admin_id')
+    admin_id = g.auth['user_id']
     amount_raw = data.get('amount')
     method = data.get('method')
     account_details = data.get('account_details')
     notes = data.get('notes', '')
 
     # 1. Validate inputs
-    if not all([admin_id, amount_raw, method, account_details]):
+    if not all([amount_raw, method, account_details]):
         return jsonify({'success': False, 'message': 'Missing required fields'}), 400
 
     # 2. Validate Amount Format
@@ -669,79 +678,34 @@ def admin_withdraw():
     except:
         return jsonify({'success': False, 'message': 'Invalid amount format'}), 400
 
-    connection = None
-    cursor = None
-
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # 3. Security Check (Is user an Admin?)
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (admin_id,))
-        performer = cursor.fetchone()
-
-        if not performer or performer['role'] != 'admin':
-            return jsonify({'success': False, 'message': 'Unauthorized: Only admins can perform this action'}), 403
-
-        # 4. Get Admin Wallet
-        admin_wallet = get_or_create_wallet(cursor, admin_id)
-
-        # 5. Check Sufficient Balance
-        if admin_wallet['balance'] < amount:
-            return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
-
-        # 6. Deduct from Admin Wallet
-        cursor.execute("""
-            UPDATE wallets 
-            SET balance = balance - %s, last_updated = NOW()
-            WHERE wallet_id = %s
-            RETURNING balance
-        """, (amount, admin_wallet['wallet_id']))
-
-        new_balance = cursor.fetchone()['balance']
-
-        # 7. Log Withdrawal Transaction
-        withdrawal_description = f"Withdrawal via {method} to {account_details}"
-        if notes:
-            withdrawal_description += f" - {notes}"
-
-        cursor.execute("""
-            INSERT INTO wallet_transactions 
-            (wallet_id, amount, transaction_type, category, description, performed_by)
-            VALUES (%s, %s, 'DEBIT', 'WITHDRAWAL', %s, %s)
-            RETURNING transaction_id
-        """, (admin_wallet['wallet_id'], amount, withdrawal_description, admin_id))
-
-        transaction_id = cursor.fetchone()['transaction_id']
-
-        # 8. Optional: Create withdrawal request record for tracking/approval
-        # You can add a separate 'withdrawal_requests' table if needed
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS withdrawal_requests (
-                request_id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(user_id),
-                amount DECIMAL(10, 2) NOT NULL,
-                method VARCHAR(50) NOT NULL,
-                account_details VARCHAR(255) NOT NULL,
-                notes TEXT,
-                status VARCHAR(20) DEFAULT 'PENDING',
-                transaction_id INTEGER REFERENCES wallet_transactions(transaction_id),
-                created_at TIMESTAMP DEFAULT NOW(),
-                processed_at TIMESTAMP
-            )
-        """)
+        with db_connection() as connection:
+            cursor = connection.cursor()
 
-        cursor.execute("""
-            INSERT INTO withdrawal_requests 
-            (user_id, amount, method, account_details, notes, status, transaction_id)
-            VALUES (%s, %s, %s, %s, %s, 'COMPLETED', %s)
-        """, (admin_id, amount, method, account_details, notes, transaction_id))
+            # 3. Admin role was verified from the session token
 
-        connection.commit()
+            withdrawal_description = f"Withdrawal via {method} to {account_details}"
+            if notes:
+                withdrawal_description += f" - {notes}"
 
+            # 4. Apply pending journal credits so the balance check sees them
+            credit_journal.fold_user(cursor, admin_id)
+
+            # 5. Balance check, debit, transaction log and withdrawal record in one statement
+            result = queries.execute(cursor, 'admin_withdraw', (
+                admin_id, amount, method, account_details, notes, withdrawal_description
+            )).fetchone()
+
+            if not result:
+                return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
+
+            new_balance = result['balance']
+            transaction_id = result['transaction_id']
+
+            connection.commit()
+
+        wallet_rollups.wake()
+        push_wallet_update(admin_id, new_balance, result)
         logger.info(f"✅ Admin {admin_id} withdrawal successful: {amount} via {method}")
 
         return jsonify({
@@ -752,58 +716,32 @@ def admin_withdraw():
         }), 200
 
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"Admin withdrawal error: {e}")
         return jsonify({'success': False, 'message': f"Server Error: {str(e)}"}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-
 
 # Optional: Add endpoint to get withdrawal history
 @app.route('/api/wallet/admin/withdrawals/<int:admin_id>', methods=['GET'])
+@require_auth(session_tokens, role='admin')
 def get_admin_withdrawals(admin_id):
-    """Get admin withdrawal history"""
-    connection = None
-    cursor = None
+    """Get admin withdrawal history, newest first; ?limit= (default 50) and ?cursor= page further"""
+    if admin_id != g.auth['user_id']:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
 
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
-
-        cursor = connection.cursor()
-
-        # Security check
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (admin_id,))
-        user = cursor.fetchone()
-
-        if not user or user['role'] != 'admin':
-            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-
-        # Get withdrawal requests
-        cursor.execute("""
-            SELECT 
-                request_id,
-                amount,
-                method,
-                account_details,
-                notes,
-                status,
-                created_at,
-                processed_at
-            FROM withdrawal_requests
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            LIMIT 50
-        """, (admin_id,))
-
-        withdrawals = cursor.fetchall()
-        close_db_connection(connection, cursor)
+        limit = wallet_history.page_size(request.args.get('limit'), default=50)
+        after = request.args.get('cursor')
+        if after:
+            wallet_history.decode_cursor(after)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    try:
+        with db_connection() as connection:
+            cursor = connection.cursor()
+
+            # Get withdrawal requests
+            withdrawals, next_cursor = wallet_history.withdrawals_page(cursor, admin_id, limit=limit, after=after)
 
         withdrawal_list = []
         for w in withdrawals:
@@ -817,62 +755,198 @@ def get_admin_withdrawals(admin_id):
 
         return jsonify({
             'success': True,
-            'withdrawals': withdrawal_list
+            'withdrawals': withdrawal_list,
+            'next_cursor': next_cursor
         }), 200
 
     except Exception as e:
         logger.error(f"Get withdrawals error: {e}")
-        if connection:
-            close_db_connection(connection, cursor)
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
+@app.route('/api/wallet/reports/summary', methods=['GET'])
+@require_auth(session_tokens, role='admin')
+def get_wallet_report():
+    """Wallet totals from the rollup tables.
+
+    ?period=day|month, ?from= / ?to= (dates, inclusive; default the last 30 days),
+    ?group_by=rider|category|rider_category|total, optional ?user_id= and ?category=.
+    """
+    period = request.args.get('period', 'day')
+    group_by = request.args.get('group_by', 'rider_category')
+    if period not in ROLLUP_PERIODS or group_by not in ROLLUP_GROUPINGS:
+        return jsonify({'success': False,
+                        'message': f'period must be one of {ROLLUP_PERIODS}, group_by one of {ROLLUP_GROUPINGS}'}), 400
+    try:
+        end = datetime.fromisoformat(request.args['to']).date() if request.args.get('to') else datetime.now().date()
+        start = datetime.fromisoformat(request.args['from']).date() if request.args.get('from') \
+            else end - timedelta(days=30)
+        user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid from/to date or user_id'}), 400
+    if start > end:
+        return jsonify({'success': False, 'message': "'from' must not be after 'to'"}), 400
+
+    try:
+        started = time.perf_counter()
+        with db_connection() as connection:
+            cursor = connection.cursor()
+            rows = wallet_rollups.report(cursor, period, start, end, group_by=group_by,
+                                         user_id=user_id, category=request.args.get('category'))
+        query_ms = (time.perf_counter() - started) * 1000
+
+        totals = []
+        for row in rows:
+            r = dict(row)
+            r['period'] = r['period'].isoformat()
+            r['total'] = float(r['total'])
+            r['tx_count'] = int(r['tx_count'])
+            totals.append(r)
+
+        return jsonify({
+            'success': True,
+            'period': period,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'group_by': group_by,
+            'query_ms': round(query_ms, 3),
+            # Rows still being backfilled are missing from the totals
+            'backfill_remaining': wallet_rollups.backfill_remaining,
+            'count': len(totals),
+            'totals': totals
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Wallet report error: {e}")
+        return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
+
+
+@app.route('/api/admin/reconciliation', methods=['GET'])
+@require_auth(session_tokens, role='admin')
+def reconciliation_report():
+    """Wallets whose balance disagrees with their ledger, plus the last run's report"""
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+
+    try:
+        with db_connection() as connection:
+            cursor = connection.cursor()
+            rows = ledger_reconciler.drifting(cursor, limit=min(max(limit, 1), 1000))
+
+        wallets = []
+        for row in rows:
+            r = dict(row)
+            for key in ('balance', 'ledger_sum', 'drift'):
+                r[key] = float(r[key])
+            r['checked_at'] = r['checked_at'].isoformat()
+            wallets.append(r)
+
+        return jsonify({
+            'success': True,
+            'reconciliation': ledger_reconciler.stats(),
+            'count': len(wallets),
+            'drifting': wallets
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Reconciliation report error: {e}")
+        return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
+
+
+@app.route('/api/admin/export/<dataset>', methods=['GET'])
+@require_auth(session_tokens, role='admin')
+def export_ledger(dataset):
+    """Stream 'transactions' or 'withdrawals' as ?format=csv|ndjson, optionally
+    limited by ?from= / ?to= (ISO 8601) and ?user_id="""
+    fmt = request.args.get('format', 'csv').lower()
+    if dataset not in ledger_export.DATASETS:
+        return jsonify({'success': False, 'message': f"Unknown dataset, expected one of {tuple(ledger_export.DATASETS)}"}), 404
+    if fmt not in ledger_export.FORMATS:
+        return jsonify({'success': False, 'message': f"Unknown format, expected one of {ledger_export.FORMATS}"}), 400
+    try:
+        start = datetime.fromisoformat(request.args['from'].replace('Z', '+00:00')) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to'].replace('Z', '+00:00')) if request.args.get('to') else None
+        user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid from/to timestamp or user_id'}), 400
+
+    admin_id = g.auth['user_id']
+
+    def generate():
+        started = time.perf_counter()
+        try:
+            with db_connection() as connection:
+                yield from ledger_export.stream_export(connection, dataset, fmt, start, end, user_id,
+                                                       LEDGER_EXPORT_FETCH_SIZE)
+        except Exception as e:
+            # Headers are already sent; end the file with an error marker
+            logger.error(f"Ledger export error: {e}")
+            yield (f'# export aborted: {e}\n' if fmt == 'csv' else json.dumps({'error': str(e)}) + '\n')
+            return
+        logger.info(f"Admin {admin_id} exported {dataset} as {fmt} in {time.perf_counter() - started:.2f}s")
+
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=ledger_export.MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 # ------------------- Socket.IO Events ------------------- #
 
 @socketio.on('connect')
-def handle_connect():
-    logger.info(f'Client connected: {request.sid}')
-    emit('connection_response', {'status': 'connected', 'sid': request.sid})
+def handle_connect(auth=None):
+    """Clients pass their session token as the Socket.IO auth payload
+    ({"token": ...}) or ?token=; authenticated sockets join their role rooms."""
+    claims, rooms = service.socket_connected(request.sid, rider_service.socket_token(auth, request.args.get('token')))
+    for room in rooms:
+        join_room(room)
+    emit('connection_response', service.connection_response(request.sid, claims))
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    user_id = None
-    for uid, sid in active_users.items():
-        if sid == request.sid:
-            user_id = uid
-            break
-    if user_id:
-        del active_users[user_id]
-        logger.info(f'User {user_id} disconnected')
-        socketio.emit('rider_status_changed', {
-            'user_id': user_id,
-            'rider_id': user_id,
-            'is_online': False,
-            'timestamp': datetime.now().isoformat()
-        }, broadcast=True)
+    service.socket_disconnected(request.sid)
+
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    return service.socket_heartbeat(request.sid)
+
+
+@socketio.on('location_update')
+def handle_location_ingest(data):
+    """Persisted fixes with seq acks; the rider app's main location channel"""
+    return service.socket_locations(request.sid, data)
 
 
 # Handle Realtime location from Frontend Socket
 @socketio.on('update_location_realtime')
 def handle_location_update(data):
-    # Support both key styles
-    user_id = data.get('user_id') or data.get('rider_id')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
+    service.realtime_location(request.sid, data)
 
-    if user_id and latitude and longitude:
-        payload = {
-            'user_id': user_id,
-            'rider_id': user_id,
-            'latitude': latitude,
-            'longitude': longitude,
-            'timestamp': datetime.now().isoformat()
-        }
-        # Emit back to Admin Dashboard
-        # Admin is listening to 'update_location_realtime' based on your fix
-        emit('update_location_realtime', payload, broadcast=True)
-        # Emit standard event too
-        emit('rider_location_updated', payload, broadcast=True)
+
+def _move_rooms(result):
+    """Apply a viewport change (ack, rooms to join, rooms to leave) to this socket"""
+    ack, joined, left = result
+    for room in joined:
+        join_room(room)
+    for room in left:
+        leave_room(room)
+    return ack
+
+
+@socketio.on('subscribe_viewport')
+def handle_subscribe_viewport(data):
+    return _move_rooms(service.subscribe_viewport(request.sid, data))
+
+
+@socketio.on('set_location_format')
+def handle_set_location_format(data):
+    return _move_rooms(service.set_location_format(request.sid, data))
+
+
+@socketio.on('unsubscribe_viewport')
+def handle_unsubscribe_viewport(data=None):
+    return _move_rooms(service.unsubscribe_viewport(request.sid))
 
 
 @app.route('/')
@@ -880,32 +954,34 @@ def index():
     return jsonify({
         'status': 'running',
         'message': 'Rider API Server is running (Schema Updated)',
-        'active_users': len(active_users),
+        'active_users': presence.online_count(),
         'version': '2.0'
     })
 
 
 @app.route('/health')
 def health_check():
-    connection = None
     try:
-        connection = get_db_connection()
-        if connection:
+        with db_connection() as connection:
             cursor = connection.cursor()
             cursor.execute("SELECT 1")
             cursor.fetchone()
-            close_db_connection(connection, cursor)
-            db_status = 'connected'
-        else:
-            db_status = 'disconnected'
+        db_status = 'connected'
     except Exception as e:
         db_status = f'error: {str(e)}'
-        if connection:
-            close_db_connection(connection)
 
     return jsonify({
         'status': 'healthy',
         'database': db_status,
+        'db_pool': db_pool.stats(),
+        'db_green_mode': DB_GREEN_MODE,
+        'db_round_trips': round_trips.stats(),
+        **service.stats(),
+        'location_upload': location_uploader.stats(),
+        'wallet_credit_journal': credit_journal.stats() if WALLET_CREDIT_JOURNAL else 'disabled',
+        'wallet_rollups': wallet_rollups.stats(),
+        'ledger_reconciliation': ledger_reconciler.stats(),
+        'message_bus': message_bus.stats() if message_bus else 'disabled',
         'timestamp': datetime.now().isoformat()
     }), 200
 
@@ -914,4 +990,6 @@ application = app
 
 if __name__ == '__main__':
     logger.info("Starting API Server...")
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    db_pool.prefill()
+    start_background_jobs()
+    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
@@ -0,0 +1,721 @@
+"""Rider logic shared by the eventlet app (rider_backend) and the asyncio app (rider_asgi).
+
+Handlers in either server parse the transport, run their database I/O with
+their own driver and call in here for validation, the in-memory state
+updates and the socket events that follow. Validation failures are raised
+as RequestError carrying the HTTP status.
+
+RiderService owns the live subsystems (rider state, presence, location
+pipeline and fan-out, viewports, session tokens). It emits through any
+object with emit(event, data, to=None): flask_socketio.SocketIO, or
+rider_asgi's adapter around socketio.AsyncServer.
+"""
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import socket_rooms
+import wallet_history
+from auth_tokens import TokenManager, TokenError
+from location_broadcaster import LocationBroadcaster
+from location_codec import FORMAT_JSON, FORMATS as LOCATION_FORMATS
+from location_filter import LocationFilter
+from location_history import LocationHistory
+from location_pipeline import LocationWriter, QueueFull
+from presence import PresenceRegistry
+from rider_state import RiderStateStore, RIDER_SNAPSHOT_QUERY
+from socket_rooms import user_room
+from spatial_index import GridIndex
+from viewport_rooms import ViewportRooms
+
+logger = logging.getLogger(__name__)
+
+# Ledger columns sent with 'wallet_updated'
+WALLET_EVENT_FIELDS = ('transaction_id', 'amount', 'transaction_type', 'category', 'description', 'created_at')
+
+# Transactions embedded in /api/wallet/details; older ones via /api/wallet/transactions
+WALLET_DETAILS_TRANSACTIONS = 20
+
+# SQL fallbacks while the rider state store is disabled or still loading; no parameters,
+# so psycopg2 and asyncpg run them as they are
+ONLINE_RIDERS_QUERY = """
+    SELECT
+        u.user_id,
+        u.username,
+        u.role,
+        COALESCE(rs.is_online, FALSE) as is_online,
+        rs.last_updated,
+        rl_latest.latitude,
+        rl_latest.longitude,
+        rl_latest.location_time as last_location_time
+    FROM users u
+    LEFT JOIN rider_status rs ON u.user_id = rs.user_id
+    LEFT JOIN rider_latest_location rl_latest ON rl_latest.user_id = u.user_id
+    WHERE rs.is_online = TRUE AND u.role = 'rider'
+"""
+ALL_RIDERS_QUERY = RIDER_SNAPSHOT_QUERY + " ORDER BY rs.is_online DESC, u.username ASC"
+
+# Upper bound on points in one 'location_update' message
+SOCKET_LOCATION_MAX_POINTS = 500
+
+UNAUTHORIZED_FLEET = {'success': False, 'message': 'Unauthorized: Only admins can watch the fleet'}
+
+
+class RequestError(Exception):
+    """Invalid request; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+    def response(self):
+        return {'success': False, 'message': str(self)}
+
+
+def secret_key(shared=False):
+    """SECRET_KEY, or a random key for this process when it is not set.
+
+    With MESSAGE_BUS several processes serve the same sessions and must sign
+    them with the same key, so a missing SECRET_KEY refuses to start instead;
+    shared=True does the same for a process that always runs beside others.
+    """
+    key = os.environ.get('SECRET_KEY')
+    if not key and (shared or os.environ.get('MESSAGE_BUS')):
+        raise RuntimeError("SECRET_KEY must be set: every process serving these sessions has to sign them "
+                           "with the same key")
+    if not key:
+        logger.warning("SECRET_KEY is not set; using a random key, sessions will not survive a restart")
+        key = secrets.token_hex(32)
+    return key
+
+
+def _parse_time(value):
+    """ISO 8601 from the client, 'Z' allowed"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+# ------------------- Request parsing ------------------- #
+
+def parse_login(data):
+    """Returns (username, password)"""
+    data = data or {}
+    username = data.get('username')  # Changed from rider_name
+    password = data.get('password')
+    if not username or not password:
+        raise RequestError('Username and password are required')
+    return username, password
+
+
+def parse_status_update(data):
+    """Returns (user_id, is_online)"""
+    data = data or {}
+    user_id = data.get('user_id')  # Changed from rider_id
+    is_online = data.get('is_online')
+
+    if user_id is None:
+        raise RequestError('User ID is required')
+    if is_online is None:
+        raise RequestError('Status is required')
+
+    # Handle boolean conversion
+    if isinstance(is_online, int):
+        is_online = bool(is_online)
+    elif isinstance(is_online, str):
+        is_online = is_online.lower() == 'true'
+
+    try:
+        user_id = int(user_id)
+    except (ValueError, TypeError):
+        raise RequestError('Invalid user ID')
+    return user_id, is_online
+
+
+def parse_location(data):
+    """Returns (user_id, lat, lng, location_time); a bad device timestamp means now"""
+    data = data or {}
+    user_id = data.get('user_id')  # Changed from rider_id
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    device_timestamp = data.get('timestamp')
+
+    if user_id is None or latitude is None or longitude is None:
+        raise RequestError('User ID, latitude, and longitude are required')
+
+    # Validate lat/lng
+    try:
+        lat = float(latitude)
+        lng = float(longitude)
+    except (ValueError, TypeError):
+        raise RequestError('Invalid coordinates')
+
+    # A bad id would fail the whole batch later, so reject it here
+    try:
+        user_id = int(user_id)
+    except (ValueError, TypeError):
+        raise RequestError('Invalid user ID')
+
+    location_time = datetime.now()
+    if device_timestamp:
+        try:
+            location_time = _parse_time(device_timestamp)
+        except (ValueError, AttributeError):
+            pass
+    return user_id, lat, lng, location_time
+
+
+def parse_nearby(args):
+    """Query string of /api/riders/nearby; returns (lat, lng, radius_km, k or None)"""
+    try:
+        lat = float(args['lat'])
+        lng = float(args['lng'])
+        radius_km = float(args.get('radius_km', 5))
+        k = int(args['k']) if args.get('k') else None
+    except (KeyError, ValueError):
+        raise RequestError('lat and lng are required; k and radius_km must be numbers')
+
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radius_km <= 0 or (k is not None and k <= 0):
+        raise RequestError('Invalid query parameters')
+    return lat, lng, radius_km, k
+
+
+def socket_token(auth, query_token=None):
+    """Session token from the Socket.IO auth payload ({"token": ...}) or ?token="""
+    token = (auth or {}).get('token') if isinstance(auth, dict) else None
+    return token or query_token
+
+
+# ------------------- Row shapes ------------------- #
+
+def transaction_to_json(row):
+    """Wallet transaction row to JSON (Decimal amount, datetime created_at)"""
+    t = dict(row)
+    t.pop('balance', None)
+    t['created_at'] = t['created_at'].isoformat()
+    t['amount'] = float(t['amount'])  # Convert Decimal to float for JSON
+    return t
+
+
+def rider_to_json(row):
+    """Convert a rider row (SQL or in-memory) to the frontend JSON shape"""
+    r_dict = dict(row)
+    # Map new DB columns to expected Frontend JSON keys
+    r_dict['rider_id'] = r_dict['user_id']
+    r_dict['rider_name'] = r_dict['username']
+
+    # Convert Decimal/float values
+    for key in ('latitude', 'longitude', 'balance'):
+        if r_dict.get(key) is not None:
+            r_dict[key] = float(r_dict[key])
+
+    # Convert datetime to ISO string
+    for key in ('last_updated', 'last_location_time'):
+        if r_dict.get(key):
+            r_dict[key] = r_dict[key].isoformat()
+    return r_dict
+
+
+def riders_response(rows):
+    riders_list = [rider_to_json(row) for row in rows]
+    return {'success': True, 'count': len(riders_list), 'riders': riders_list}
+
+
+def wallet_details_response(rows, limit=WALLET_DETAILS_TRANSACTIONS):
+    """Body of /api/wallet/details from the wallet_details statement (limit + 1 rows)"""
+    # A missing wallet reads as 0.00; it is created by the first recharge or deduction
+    balance = rows[0]['balance'] if rows and rows[0]['balance'] is not None else Decimal('0.00')
+    transactions, next_cursor = wallet_history.page([r for r in rows if r['created_at'] is not None],
+                                                    limit, 'transaction_id')
+    return {
+        'success': True,
+        'balance': float(balance),
+        'transactions': [transaction_to_json(tx) for tx in transactions],
+        'next_cursor': next_cursor
+    }
+
+
+# ------------------- Live state ------------------- #
+
+class RiderService:
+    """The live, in-process side of the API, independent of the server it runs in"""
+
+    def __init__(self, emitter, session_tokens, rider_state, spatial_index, location_history,
+                 location_writer, viewport_rooms, location_broadcaster, presence, location_filter,
+                 state_store=True, state_reconcile_seconds=30.0, anonymous_fleet=False,
+                 socket_max_points=SOCKET_LOCATION_MAX_POINTS):
+        self.emitter = emitter
+        self.session_tokens = session_tokens
+        self.rider_state = rider_state
+        self.spatial_index = spatial_index
+        self.location_history = location_history
+        self.location_writer = location_writer
+        self.viewport_rooms = viewport_rooms
+        self.location_broadcaster = location_broadcaster
+        self.presence = presence
+        self.location_filter = location_filter
+        self.state_store = state_store
+        self.state_reconcile_seconds = state_reconcile_seconds
+        self.anonymous_fleet = anonymous_fleet
+        self.socket_max_points = socket_max_points
+        # Session claims of sockets that authenticated on connect, by sid
+        self.socket_sessions = {}
+        # Highest 'location_update' seq handled per socket
+        self._acked = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'messages': 0,
+            'points': 0,
+            'accepted': 0,
+            'rejected': 0,
+            'retransmitted': 0,
+            'overloaded': 0,
+            'filtered': 0
+        }
+        presence.on_offline = self.riders_went_offline
+
+    @classmethod
+    def from_env(cls, emitter, secret_key):
+        """Build every subsystem from the environment, the same way for both servers"""
+        # Signed session tokens: role checks without a users lookup per request
+        session_tokens = TokenManager(secret_key, max_age=int(os.environ.get('SESSION_TOKEN_MAX_AGE', 12 * 3600)))
+
+        # Grid of online rider positions for nearest-rider queries, maintained by the store
+        spatial_index = GridIndex(cell_deg=float(os.environ.get('SPATIAL_CELL_DEG', 0.01)))
+
+        # Latest position per rider plus day-partitioned history with retention
+        location_history = LocationHistory(
+            retention_days=int(os.environ.get('LOCATION_HISTORY_RETENTION_DAYS', 30)),
+            days_ahead=int(os.environ.get('LOCATION_HISTORY_DAYS_AHEAD', 2)),
+            accept_past_days=int(os.environ.get('LOCATION_HISTORY_ACCEPT_PAST_DAYS', 2))
+        )
+
+        # Dashboards receive location fixes only for the grid cells they are looking at
+        viewport_rooms = ViewportRooms(
+            cell_deg=float(os.environ.get('VIEWPORT_CELL_DEG', 0.05)),
+            max_cells=int(os.environ.get('VIEWPORT_MAX_CELLS', 400))
+        )
+
+        # Location fan-out: newest fix per rider, one 'rider_locations_batch' per room per tick.
+        # LOCATION_LEGACY_EVENTS keeps the per-fix events for clients not on the batch event yet.
+        location_broadcaster = LocationBroadcaster(
+            emitter,
+            viewport_rooms,
+            tick=float(os.environ.get('LOCATION_BROADCAST_TICK', 0.25)),
+            min_interval=float(os.environ.get('LOCATION_BROADCAST_MIN_INTERVAL', 1.0)),
+            min_distance_m=float(os.environ.get('LOCATION_BROADCAST_MIN_DISTANCE_M', 5)),
+            legacy_events=os.environ.get('LOCATION_LEGACY_EVENTS', '1') == '1'
+        )
+
+        # GPS fixes are acknowledged immediately and written in batches
+        location_writer = LocationWriter(
+            location_history,
+            flush_interval=float(os.environ.get('LOCATION_FLUSH_INTERVAL', 0.5)),
+            max_batch=int(os.environ.get('LOCATION_FLUSH_MAX_BATCH', 500)),
+            max_pending=int(os.environ.get('LOCATION_MAX_PENDING', 20000)),
+            max_history_pending=int(os.environ.get('LOCATION_MAX_HISTORY_PENDING', 100000)),
+            overload=os.environ.get('LOCATION_OVERLOAD_POLICY', 'reject')
+        )
+
+        # Riders set online must heartbeat (socket 'heartbeat' or a location fix) within the TTL;
+        # expired ones are marked offline in batches by presence.run
+        presence = PresenceRegistry(
+            ttl=float(os.environ.get('PRESENCE_TTL_SECONDS', 90)),
+            disconnect_grace=float(os.environ.get('PRESENCE_DISCONNECT_GRACE_SECONDS', 30)),
+            batch_size=int(os.environ.get('PRESENCE_OFFLINE_BATCH', 500))
+        )
+
+        # Stale, duplicate, jittery and impossible fixes are dropped before the pipeline and fan-out
+        location_filter = LocationFilter(
+            min_distance_m=float(os.environ.get('LOCATION_FILTER_MIN_DISTANCE_M', 5)),
+            min_interval=float(os.environ.get('LOCATION_FILTER_MIN_INTERVAL', 0.5)),
+            keepalive=float(os.environ.get('LOCATION_FILTER_KEEPALIVE_SECONDS', 60)),
+            max_speed_mps=float(os.environ.get('LOCATION_FILTER_MAX_SPEED_MPS', 70)),
+            max_future=float(os.environ.get('LOCATION_FILTER_MAX_FUTURE_SECONDS', 300)),
+            max_past=float(os.environ.get('LOCATION_FILTER_MAX_PAST_SECONDS', 3600)),
+            # Consecutive rejected jumps that agree with each other replace a glitched reference
+            jump_reset=int(os.environ.get('LOCATION_FILTER_JUMP_RESET', 3))
+        )
+
+        return cls(
+            emitter, session_tokens,
+            rider_state=RiderStateStore(spatial_index=spatial_index),
+            spatial_index=spatial_index,
+            location_history=location_history,
+            location_writer=location_writer,
+            viewport_rooms=viewport_rooms,
+            location_broadcaster=location_broadcaster,
+            presence=presence,
+            location_filter=location_filter,
+            # Live rider state served from memory; set RIDER_STATE_STORE=0 to use the SQL path
+            state_store=os.environ.get('RIDER_STATE_STORE', '1') == '1',
+            state_reconcile_seconds=float(os.environ.get('RIDER_STATE_RECONCILE_SECONDS', 30)),
+            # Fleet traffic (locations, status changes) goes to admin sockets only; '1' also
+            # sends it to sockets that connect without a token, for older dashboards
+            anonymous_fleet=os.environ.get('SOCKET_ANONYMOUS_FLEET', '0') == '1',
+            socket_max_points=int(os.environ.get('SOCKET_LOCATION_MAX_POINTS', SOCKET_LOCATION_MAX_POINTS))
+        )
+
+    def background_jobs(self, pool):
+        """(function, args) for every loop the live state needs; the server decides how to run them"""
+        jobs = [
+            (self.location_history.run_maintenance, (pool,)),
+            (self.location_writer.run, (pool,)),
+            (self.location_broadcaster.run, ()),
+            (self.presence.run, (pool,))
+        ]
+        if self.state_store:
+            jobs.append((self.rider_state.run_reconciler, (pool, self.state_reconcile_seconds)))
+        return jobs
+
+    @property
+    def serving_state(self):
+        """Whether rider lists come from memory rather than SQL"""
+        return self.state_store and self.rider_state.ready
+
+    # Events
+
+    def emit_rider_status(self, user_id, is_online):
+        """Online/offline change: to dashboards and the rider's own devices, not every socket"""
+        self.emitter.emit('rider_status_changed', {
+            'user_id': user_id,
+            'rider_id': user_id,  # Keep for backward compatibility if needed temporarily
+            'is_online': is_online,
+            'timestamp': datetime.now().isoformat()
+        }, to=socket_rooms.status_rooms(user_id, self.anonymous_fleet))
+
+    def push_wallet_update(self, user_id, balance, row=None):
+        """Tell the wallet owner's apps about a committed balance change.
+
+        row carries the ledger row written (statement result); bulk changes send
+        only the balance and the app fetches history when it needs it.
+        """
+        transaction = None
+        if row is not None and row.get('transaction_id') is not None:
+            transaction = transaction_to_json({key: row[key] for key in WALLET_EVENT_FIELDS})
+        self.emitter.emit('wallet_updated', {
+            'user_id': user_id,
+            'balance': float(balance),
+            'transaction': transaction,
+            'timestamp': datetime.now().isoformat()
+        }, to=user_room(user_id))
+
+    def riders_went_offline(self, user_ids):
+        """presence.run marked these riders offline in the DB (TTL lapsed)"""
+        now = datetime.now()
+        for user_id in user_ids:
+            self.rider_state.set_status(user_id, False, now)
+            self.location_broadcaster.forget(user_id)
+            self.emit_rider_status(user_id, False)
+        logger.info(f"Presence: {len(user_ids)} rider(s) timed out")
+
+    # REST
+
+    def login_response(self, user, password):
+        """Body for a login_user row (None when the username is unknown)"""
+        if not user or user['password'] != password:
+            raise RequestError('Invalid username or password', 401)
+        return {
+            'success': True,
+            'user_id': user['user_id'],
+            'username': user['username'],
+            'role': user['role'],  # Return the role
+            'is_online': user['is_online'],
+            # Send as "Authorization: Bearer <token>" on protected endpoints
+            'token': self.session_tokens.issue(user['user_id'], user['role']),
+            'expires_in': self.session_tokens.max_age,
+            'message': 'Login successful'
+        }
+
+    def status_changed(self, user_id, is_online, user):
+        """After set_rider_status committed; user is its row (None: unknown user)"""
+        if not user:
+            raise RequestError('User not found', 404)
+
+        self.rider_state.set_status(user_id, is_online, datetime.now(),
+                                    username=user['username'], role=user['role'])
+        if is_online:
+            self.presence.set_online(user_id)
+        else:
+            self.presence.set_offline(user_id)
+            self.location_broadcaster.forget(user_id)
+        logger.info(f"✓ Status updated for user {user_id}: is_online={is_online}")
+
+        self.emit_rider_status(user_id, is_online)
+        return {
+            'success': True,
+            'message': 'Status updated successfully',
+            'user_id': user_id,
+            'is_online': is_online
+        }
+
+    def accept_location(self, user_id, lat, lng, location_time):
+        """Queue a fix for persistence and fan-out; no database I/O.
+
+        A fix the location filter drops still counts as a heartbeat and is
+        answered with success (plus the reason in 'filtered'), so the app
+        does not resend it.
+        """
+        reason = self.location_filter.check(user_id, lat, lng, location_time)
+        if reason:
+            self.presence.heartbeat(user_id)
+            return {
+                'success': True,
+                'message': 'Location not stored',
+                'filtered': reason,
+                'timestamp': location_time.isoformat()
+            }
+
+        # Write-behind: the fix is persisted by the next pipeline flush
+        try:
+            self.location_writer.submit(user_id, lat, lng, location_time)
+        except QueueFull as e:
+            raise RequestError(str(e), 503)
+        self.location_filter.remember(user_id, lat, lng, location_time)
+
+        self.rider_state.set_location(user_id, lat, lng, location_time)
+        self.presence.heartbeat(user_id)
+
+        # Fan-out happens on the broadcaster's next tick
+        self.location_broadcaster.publish(user_id, lat, lng, location_time)
+        return {
+            'success': True,
+            'message': 'Location updated successfully',
+            'timestamp': location_time.isoformat()
+        }
+
+    def location_uploaded(self, user_id, lat, lng, location_time):
+        """An uploaded buffer moved the stored latest position: only its final point goes live"""
+        self.location_filter.remember(user_id, lat, lng, location_time)
+        self.rider_state.set_location(user_id, lat, lng, location_time)
+        self.presence.heartbeat(user_id)
+        self.location_broadcaster.publish(user_id, lat, lng, location_time)
+
+    def nearby_response(self, args):
+        if not self.serving_state:
+            raise RequestError('Rider state store is not available', 503)
+        lat, lng, radius_km, k = parse_nearby(args)
+
+        started = time.perf_counter()
+        if k is not None:
+            matches = self.spatial_index.nearest(lat, lng, k, max_radius_km=radius_km)
+        else:
+            matches = self.spatial_index.within(lat, lng, radius_km)
+        query_ms = (time.perf_counter() - started) * 1000
+
+        riders_list = []
+        for distance_km, user_id, r_lat, r_lng in matches:
+            rider = self.rider_state.get(user_id) or {}
+            riders_list.append({
+                'user_id': user_id,
+                'rider_id': user_id,
+                'username': rider.get('username'),
+                'rider_name': rider.get('username'),
+                'latitude': r_lat,
+                'longitude': r_lng,
+                'distance_km': round(distance_km, 4)
+            })
+
+        return {
+            'success': True,
+            'count': len(riders_list),
+            'query_ms': round(query_ms, 4),
+            'riders': riders_list
+        }
+
+    # Sockets
+
+    def socket_connected(self, sid, token):
+        """Authenticate a new socket; returns (claims or None, rooms to join).
+
+        Raises ConnectionRefusedError for a bad token, which both servers turn
+        into a refused connection.
+        """
+        claims = None
+        if token:
+            try:
+                claims = self.session_tokens.verify(token)
+            except TokenError as e:
+                raise ConnectionRefusedError(str(e))
+            self.socket_sessions[sid] = claims
+            self.presence.add_sid(sid, claims['user_id'])
+            self.presence.heartbeat(claims['user_id'])
+
+        logger.info(f"Client connected: {sid}" + (f" (user {claims['user_id']})" if claims else ''))
+        # Fleet watchers get the whole fleet until they subscribe to a viewport
+        return claims, socket_rooms.connect_rooms(claims, self.anonymous_fleet)
+
+    def connection_response(self, sid, claims):
+        return {
+            'status': 'connected',
+            'sid': sid,
+            'user_id': claims['user_id'] if claims else None
+        }
+
+    def socket_disconnected(self, sid):
+        self.viewport_rooms.forget(sid)
+        self.socket_sessions.pop(sid, None)
+        self._acked.pop(sid, None)
+        # Going offline is left to presence: the last device gets a grace period to reconnect
+        user_id, last_device = self.presence.remove_sid(sid)
+        if user_id is not None:
+            logger.info(f"User {user_id} disconnected{' (last device)' if last_device else ''}")
+
+    def socket_heartbeat(self, sid):
+        """Keeps an online rider's presence alive; online False means it lapsed and the
+        app should call /api/update_status again"""
+        user_id = self.presence.user_of(sid)
+        if user_id is None:
+            return {'success': False, 'message': 'Authenticate on connect to send heartbeats'}
+        return {'success': True, 'online': self.presence.heartbeat(user_id)}
+
+    def socket_locations(self, sid, data):
+        """'location_update': fixes over the rider's socket, validated and persisted
+        like POST /api/update_location.
+
+        data is one point or {'points': [...]}, each point {'seq', 'latitude',
+        'longitude', 'timestamp'} with seq increasing per socket. The ack
+        {'success', 'ack', 'rejected'} carries the highest seq handled, and the
+        app drops every buffered point up to it. Invalid points count as handled
+        and are listed in 'rejected'. When the pipeline is saturated handling
+        stops there; the rest stay unacknowledged for the app to resend later.
+        Points at or below the last ack are resends of handled ones and are skipped.
+        Points the location filter drops are handled as well (counted as 'filtered').
+        """
+        claims = self.socket_sessions.get(sid)
+        if claims is None:
+            return {'success': False, 'message': 'Authenticate on connect to send locations'}
+        data = data if isinstance(data, dict) else {}
+        points = data.get('points') if 'points' in data else [data]
+        if not isinstance(points, list) or not points:
+            return {'success': False, 'message': 'points must be a non-empty list'}
+        if len(points) > self.socket_max_points:
+            return {'success': False, 'message': f'At most {self.socket_max_points} points per message'}
+        if not all(isinstance(p, dict) and isinstance(p.get('seq'), int) and not isinstance(p['seq'], bool)
+                   for p in points):
+            return {'success': False, 'message': 'Every point needs an integer seq'}
+
+        acked = self._acked.get(sid, -1)
+        rejected = []
+        accepted = resent = filtered = 0
+        overloaded = False
+        for point in sorted(points, key=lambda p: p['seq']):
+            seq = point['seq']
+            if seq <= acked:
+                resent += 1
+                continue
+            # Riders can only report themselves; admin tools may name the rider
+            if claims['role'] != 'admin' or point.get('user_id') is None:
+                point = dict(point, user_id=claims['user_id'])
+            try:
+                if 'filtered' in self.accept_location(*parse_location(point)):
+                    filtered += 1
+                else:
+                    accepted += 1
+            except RequestError as e:
+                if e.status == 503:
+                    overloaded = True
+                    break
+                rejected.append({'seq': seq, 'message': str(e)})
+            acked = seq
+        self._acked[sid] = acked
+
+        with self._lock:
+            c = self._counters
+            c['messages'] += 1
+            c['points'] += len(points)
+            c['accepted'] += accepted
+            c['rejected'] += len(rejected)
+            c['retransmitted'] += resent
+            c['overloaded'] += overloaded
+            c['filtered'] += filtered
+
+        ack = {'success': not overloaded, 'ack': acked, 'rejected': rejected}
+        if overloaded:
+            ack['message'] = 'Location pipeline is saturated, resend unacknowledged points later'
+        return ack
+
+    def realtime_location(self, sid, data):
+        """'update_location_realtime': live-only position (not persisted); reconciliation
+        restores the DB view. Apps should send 'location_update' instead.
+
+        Like 'location_update' it needs an authenticated socket and only moves
+        the caller's own rider, unless the caller is an admin naming one.
+        """
+        claims = self.socket_sessions.get(sid)
+        if claims is None:
+            return
+        data = data if isinstance(data, dict) else {}
+        point = {'user_id': claims['user_id'], 'latitude': data.get('latitude'), 'longitude': data.get('longitude')}
+        if claims['role'] == 'admin':
+            # Support both key styles
+            point['user_id'] = data.get('user_id') or data.get('rider_id') or claims['user_id']
+        try:
+            user_id, lat, lng, now = parse_location(point)
+        except RequestError:
+            return
+        self.presence.heartbeat(user_id)
+        # Checked against the persisted trail but not remembered: a live-only
+        # fix must not make the next persisted one look stationary
+        if self.location_filter.check(user_id, lat, lng, now):
+            return
+        self.rider_state.set_location(user_id, lat, lng, now, live_only=True)
+        self.location_broadcaster.publish(user_id, lat, lng, now)
+
+    def watches_fleet(self, sid):
+        return socket_rooms.watches_fleet(self.socket_sessions.get(sid), self.anonymous_fleet)
+
+    def subscribe_viewport(self, sid, data):
+        """Dashboard map moved: receive fixes only for this bounding box.
+        Returns (ack, rooms to join, rooms to leave)."""
+        if not self.watches_fleet(sid):
+            return UNAUTHORIZED_FLEET, [], []
+        try:
+            joined, left = self.viewport_rooms.subscribe(
+                sid,
+                float(data['min_lat']), float(data['min_lng']),
+                float(data['max_lat']), float(data['max_lng'])
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            return {'success': False, 'message': f'Invalid viewport: {e}'}, [], []
+        return {'success': True, 'joined': len(joined), 'left': len(left)}, joined, left
+
+    def set_location_format(self, sid, data):
+        """Negotiate the location wire format: 'json' (default) or 'packed'"""
+        if not self.watches_fleet(sid):
+            return UNAUTHORIZED_FLEET, [], []
+        fmt = (data or {}).get('format', FORMAT_JSON)
+        try:
+            joined, left = self.viewport_rooms.set_format(sid, fmt)
+        except ValueError as e:
+            return {'success': False, 'message': str(e), 'formats': list(LOCATION_FORMATS)}, [], []
+        return {'success': True, 'format': fmt}, joined, left
+
+    def unsubscribe_viewport(self, sid):
+        """Go back to receiving every fix"""
+        if not self.watches_fleet(sid):
+            return UNAUTHORIZED_FLEET, [], []
+        joined, left = self.viewport_rooms.unsubscribe(sid)
+        return {'success': True}, joined, left
+
+    def stats(self):
+        """The live subsystems' part of /health"""
+        with self._lock:
+            socket_ingest = dict(self._counters)
+        return {
+            'socket_location_ingest': socket_ingest,
+            'rider_state': self.rider_state.stats() if self.state_store else 'disabled',
+            'location_pipeline': self.location_writer.stats(),
+            'spatial_index': self.spatial_index.stats(),
+            'viewports': self.viewport_rooms.stats(),
+            'location_broadcast': self.location_broadcaster.stats(),
+            'session_tokens': self.session_tokens.stats(),
+            'presence': self.presence.stats(),
+            'location_filter': self.location_filter.stats(),
+            'location_history': {
+                'retention_days': self.location_history.retention_days,
+                'days_ahead': self.location_history.days_ahead
+            }
+        }
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Same shape as the /api/riders/all SQL path
+RIDER_SNAPSHOT_QUERY = """
+    SELECT
+        u.user_id,
+        u.username,
+        u.role,
+        COALESCE(rs.is_online, FALSE) as is_online,
+        rs.last_updated,
+        rl_latest.latitude,
+        rl_latest.longitude,
+        rl_latest.location_time as last_location_time,
+        COALESCE(w.balance, 0.00) as balance
+    FROM users u
+    LEFT JOIN rider_status rs ON u.user_id = rs.user_id
+    LEFT JOIN rider_latest_location rl_latest ON rl_latest.user_id = u.user_id
+    LEFT JOIN wallets w ON u.user_id = w.user_id
+    WHERE u.role = 'rider'
+"""
+
+
+def _is_newer(a, b):
+    """a is a later location_time than b; fixes may carry naive (server local) or aware times"""
+    if a is None:
+        return False
+    if b is None:
+        return True
+    return a.timestamp() > b.timestamp()
+
+
+def _rider_key(user_id):
+    """Request bodies may carry ids as strings; rows are keyed by int"""
+    try:
+        return int(user_id)
+    except (ValueError, TypeError):
+        return user_id
+
+
+class RiderStateStore:
+    """In-process live view of every rider's status, position and balance.
+
+    Consistency model:
+    - Write-through: handlers commit to Postgres first and only then call
+      the set_* methods, so the store never shows uncommitted data.
+    - Reconciliation: a background job reloads the snapshot from Postgres
+      periodically. Riders written locally after the snapshot query started
+      keep their in-memory values, so a reconcile never rolls back a newer
+      write. Positions are written behind (LocationWriter), so a fix accepted
+      before the snapshot may still be queued: a position newer than the
+      snapshot's is kept too, unless it was set live_only (never queued for
+      the database): those are replaced by the snapshot's position. Anything
+      missed (other processes, manual SQL) converges within one reconcile
+      interval.
+
+    If a spatial index is given it is kept in step with the store and holds
+    exactly the online riders that have a position.
+    """
+
+    def __init__(self, spatial_index=None):
+        self._lock = threading.Lock()
+        self._riders = {}   # user_id -> row dict
+        self._touched = {}  # user_id -> monotonic time of the last local write
+        self._live_only = set()  # user_ids whose position will never reach the database
+        self.spatial_index = spatial_index
+        self.ready = False
+        self.last_reconciled = None
+
+    # ---- loading ----
+
+    def load(self, connection):
+        """(Re)load the snapshot from Postgres; returns the number of riders"""
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            cursor.execute(RIDER_SNAPSHOT_QUERY)
+            rows = cursor.fetchall()
+        connection.rollback()
+
+        fresh = {}
+        for row in rows:
+            r = dict(row)
+            for key in ('latitude', 'longitude', 'balance'):
+                if r[key] is not None:
+                    r[key] = float(r[key])
+            fresh[r['user_id']] = r
+
+        with self._lock:
+            for user_id, rider in fresh.items():
+                current = self._riders.get(user_id)
+                if (current is not None and user_id not in self._live_only
+                        and _is_newer(current['last_location_time'], rider['last_location_time'])):
+                    rider['latitude'] = current['latitude']
+                    rider['longitude'] = current['longitude']
+                    rider['last_location_time'] = current['last_location_time']
+            for user_id, touched_at in self._touched.items():
+                if touched_at >= started and user_id in self._riders:
+                    fresh[user_id] = self._riders[user_id]
+            self._riders = fresh
+            if self.spatial_index is not None:
+                self.spatial_index.rebuild(
+                    (uid, r['latitude'], r['longitude']) for uid, r in fresh.items()
+                    if r['is_online'] and r['latitude'] is not None and r['longitude'] is not None
+                )
+            self._touched = {uid: t for uid, t in self._touched.items() if t >= started}
+            self._live_only &= set(self._touched)
+            self.ready = True
+            self.last_reconciled = time.time()
+        return len(fresh)
+
+    def run_reconciler(self, pool, interval):
+        """Warm the store, then keep reconciling it every interval seconds"""
+        while True:
+            try:
+                with pool.connection() as connection:
+                    count = self.load(connection)
+                logger.info(f"Rider state reconciled: {count} riders")
+            except Exception as e:
+                logger.error(f"Rider state reconcile error: {e}")
+            time.sleep(interval)
+
+    # ---- write-through updates ----
+
+    def _index(self, rider):
+        """Reflect one rider in the spatial index. Caller holds the lock."""
+        if self.spatial_index is None:
+            return
+        if rider['is_online'] and rider['latitude'] is not None and rider['longitude'] is not None:
+            self.spatial_index.update(rider['user_id'], rider['latitude'], rider['longitude'])
+        else:
+            self.spatial_index.remove(rider['user_id'])
+
+    def _touch(self, user_id):
+        rider = self._riders.get(_rider_key(user_id))
+        if rider is not None:
+            self._touched[rider['user_id']] = time.monotonic()
+        return rider
+
+    def set_status(self, user_id, is_online, updated_at, username=None, role=None):
+        with self._lock:
+            rider = self._touch(user_id)
+            if rider is None:
+                if role != 'rider':
+                    return
+                user_id = _rider_key(user_id)
+                rider = self._riders[user_id] = {
+                    'user_id': user_id, 'username': username, 'role': role,
+                    'is_online': False, 'last_updated': None, 'latitude': None,
+                    'longitude': None, 'last_location_time': None, 'balance': 0.0
+                }
+                self._touched[user_id] = time.monotonic()
+            rider['is_online'] = is_online
+            rider['last_updated'] = updated_at
+            self._index(rider)
+
+    def set_location(self, user_id, latitude, longitude, location_time, live_only=False):
+        """live_only: the position is not being persisted, so the next reconcile may replace it"""
+        with self._lock:
+            rider = self._touch(user_id)
+            if rider is not None:
+                rider['latitude'] = float(latitude)
+                rider['longitude'] = float(longitude)
+                rider['last_location_time'] = location_time
+                if live_only:
+                    self._live_only.add(rider['user_id'])
+                else:
+                    self._live_only.discard(rider['user_id'])
+                self._index(rider)
+
+    def set_balance(self, user_id, balance):
+        with self._lock:
+            rider = self._touch(user_id)
+            if rider is not None:
+                rider['balance'] = float(balance)
+
+    # ---- reads ----
+
+    def get(self, user_id):
+        with self._lock:
+            rider = self._riders.get(_rider_key(user_id))
+            return dict(rider) if rider is not None else None
+
+    def online(self):
+        with self._lock:
+            return [dict(r) for r in self._riders.values() if r['is_online']]
+
+    def all(self):
+        with self._lock:
+            riders = [dict(r) for r in self._riders.values()]
+        # Matches ORDER BY rs.is_online DESC, u.username ASC
+        riders.sort(key=lambda r: (not r['is_online'], r['username'] or ''))
+        return riders
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'riders': len(self._riders),
+                'online': sum(1 for r in self._riders.values() if r['is_online']),
+                'last_reconciled': self.last_reconciled
+            }
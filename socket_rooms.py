@@ -0,0 +1,47 @@
+"""Role-based Socket.IO rooms.
+
+A socket that authenticates on connect joins its user room plus one role
+room: admins also join FLEET_ROOM (and may subscribe to viewports), so
+fleet-wide location and status traffic only reaches dashboards; riders
+join RIDERS_ROOM and otherwise only receive events about themselves.
+Anonymous sockets get no fleet traffic unless anonymous_fleet is on, for
+dashboards that do not send a token yet.
+"""
+from viewport_rooms import FLEET_ROOM
+
+ADMINS_ROOM = 'admins'
+RIDERS_ROOM = 'riders'
+# Tokenless dashboards, only populated when anonymous_fleet is enabled
+ANONYMOUS_ROOM = 'anonymous'
+
+
+def user_room(user_id):
+    """Room holding every authenticated connection of one user"""
+    return f'user_{user_id}'
+
+
+def watches_fleet(claims, anonymous_fleet=False):
+    """Whether a socket with these session claims (None: anonymous) may see the whole fleet"""
+    if claims is None:
+        return anonymous_fleet
+    return claims['role'] == 'admin'
+
+
+def connect_rooms(claims, anonymous_fleet=False):
+    """Rooms a socket joins on connect"""
+    if claims is None:
+        return [ANONYMOUS_ROOM, FLEET_ROOM] if anonymous_fleet else []
+    rooms = [user_room(claims['user_id'])]
+    if watches_fleet(claims):
+        rooms += [ADMINS_ROOM, FLEET_ROOM]
+    else:
+        rooms.append(RIDERS_ROOM)
+    return rooms
+
+
+def status_rooms(user_id, anonymous_fleet=False):
+    """Where a rider's online/offline change goes: dashboards and the rider's own devices"""
+    rooms = [ADMINS_ROOM, user_room(user_id)]
+    if anonymous_fleet:
+        rooms.append(ANONYMOUS_ROOM)
+    return rooms
@@ -0,0 +1,158 @@
+import heapq
+import math
+import threading
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.32
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Uniform lat/lng grid of rider positions, updated incrementally.
+
+    Each cell is cell_deg x cell_deg degrees and holds {user_id: (lat, lng)}.
+    Queries only visit the cells around the query point. Longitudes are not
+    wrapped across the antimeridian.
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._cells = {}      # (row, col) -> {user_id: (lat, lng)}
+        self._positions = {}  # user_id -> (row, col)
+
+    def cell_of(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def __len__(self):
+        return len(self._positions)
+
+    # ---- maintenance ----
+
+    def update(self, user_id, lat, lng):
+        cell = self.cell_of(lat, lng)
+        with self._lock:
+            old = self._positions.get(user_id)
+            if old is not None and old != cell:
+                bucket = self._cells.get(old)
+                if bucket is not None:
+                    bucket.pop(user_id, None)
+                    if not bucket:
+                        del self._cells[old]
+            self._cells.setdefault(cell, {})[user_id] = (lat, lng)
+            self._positions[user_id] = cell
+
+    def remove(self, user_id):
+        with self._lock:
+            cell = self._positions.pop(user_id, None)
+            if cell is None:
+                return
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.pop(user_id, None)
+                if not bucket:
+                    del self._cells[cell]
+
+    def rebuild(self, points):
+        """Replace the contents with an iterable of (user_id, lat, lng)"""
+        cells = {}
+        positions = {}
+        for user_id, lat, lng in points:
+            cell = self.cell_of(lat, lng)
+            cells.setdefault(cell, {})[user_id] = (lat, lng)
+            positions[user_id] = cell
+        with self._lock:
+            self._cells = cells
+            self._positions = positions
+
+    # ---- queries ----
+
+    def _km_per_deg_lng(self, lat):
+        return KM_PER_DEG_LAT * max(math.cos(math.radians(min(abs(lat), 89.9))), 1e-6)
+
+    def within(self, lat, lng, radius_km, limit=None):
+        """All riders within radius_km, nearest first: [(distance_km, user_id, lat, lng)]"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        # Widest longitude span happens at the pole-most edge of the box
+        dlng = radius_km / self._km_per_deg_lng(abs(lat) + dlat)
+        row_lo, col_lo = self.cell_of(lat - dlat, lng - dlng)
+        row_hi, col_hi = self.cell_of(lat + dlat, lng + dlng)
+
+        found = []
+        with self._lock:
+            for row in range(row_lo, row_hi + 1):
+                for col in range(col_lo, col_hi + 1):
+                    bucket = self._cells.get((row, col))
+                    if not bucket:
+                        continue
+                    for user_id, (plat, plng) in bucket.items():
+                        d = haversine_km(lat, lng, plat, plng)
+                        if d <= radius_km:
+                            found.append((d, user_id, plat, plng))
+        found.sort()
+        return found[:limit] if limit else found
+
+    def nearest(self, lat, lng, k, max_radius_km=20.0):
+        """k nearest riders within max_radius_km: [(distance_km, user_id, lat, lng)]
+
+        Searches square rings of cells outward from the query cell and stops
+        once the k-th best distance is closer than anything an unvisited ring
+        could contain.
+        """
+        row0, col0 = self.cell_of(lat, lng)
+        max_rings = int(math.ceil(max_radius_km / (self.cell_deg * self._km_per_deg_lng(abs(lat) + max_radius_km / KM_PER_DEG_LAT)))) + 1
+        best = []  # max-heap of (-distance, user_id, lat, lng)
+
+        with self._lock:
+            for ring in range(max_rings + 1):
+                for row, col in self._ring_cells(row0, col0, ring):
+                    bucket = self._cells.get((row, col))
+                    if not bucket:
+                        continue
+                    for user_id, (plat, plng) in bucket.items():
+                        d = haversine_km(lat, lng, plat, plng)
+                        if d > max_radius_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-d, user_id, plat, plng))
+                        elif d < -best[0][0]:
+                            heapq.heapreplace(best, (-d, user_id, plat, plng))
+
+                # Anything outside rings 0..ring is at least this far away
+                edge_lat = abs(lat) + (ring + 1) * self.cell_deg
+                reach_km = ring * self.cell_deg * min(KM_PER_DEG_LAT, self._km_per_deg_lng(edge_lat))
+                if len(best) == k and -best[0][0] <= reach_km:
+                    break
+                if reach_km > max_radius_km:
+                    break
+
+        return sorted((-neg_d, user_id, plat, plng) for neg_d, user_id, plat, plng in best)
+
+    @staticmethod
+    def _ring_cells(row0, col0, ring):
+        if ring == 0:
+            yield row0, col0
+            return
+        for col in range(col0 - ring, col0 + ring + 1):
+            yield row0 - ring, col
+            yield row0 + ring, col
+        for row in range(row0 - ring + 1, row0 + ring):
+            yield row, col0 - ring
+            yield row, col0 + ring
+
+    def stats(self):
+        with self._lock:
+            return {
+                'riders': len(self._positions),
+                'cells': len(self._cells),
+                'cell_deg': self.cell_deg
+            }
@@ -0,0 +1,59 @@
+import pytest
+
+from auth_tokens import TokenError, TokenManager
+from message_bus import PostgresBus
+from test_message_bus import NotifyConnection
+
+SECRET = 'test-secret'
+
+
+def deliver(sender_bus, receiver_bus):
+    """Flush the sender's queued NOTIFYs into the receiver, as its listener would"""
+    connection = NotifyConnection()
+    sender_bus.flush(connection)
+    channels = {receiver_bus._pg_channel(c): c for c in receiver_bus._subscribers}
+    for pg_channel, payload in connection.sent:
+        receiver_bus._deliver(channels[pg_channel], payload, None)
+
+
+@pytest.fixture
+def workers():
+    """Two workers' token managers sharing one secret and a bus"""
+    managers = []
+    for _ in range(2):
+        tokens = TokenManager(SECRET)
+        bus = PostgresBus({})
+        tokens.attach_bus(bus)
+        managers.append((tokens, bus))
+    return managers
+
+
+def test_logout_on_one_worker_holds_on_the_other(workers):
+    (first, first_bus), (second, second_bus) = workers
+    token = first.issue(7, 'rider')
+    first.revoke(first.verify(token))
+    deliver(first_bus, second_bus)
+
+    with pytest.raises(TokenError, match='logged out'):
+        second.verify(token)
+    # Only that token; the rider's other session is untouched
+    assert second.verify(first.issue(7, 'rider'))['user_id'] == 7
+    assert second.stats()['remote_revocations'] == 1
+
+
+def test_revoke_user_reaches_every_worker(workers):
+    (first, first_bus), (second, second_bus) = workers
+    token = second.issue(8, 'rider')
+    first.revoke_user(8)
+    deliver(first_bus, second_bus)
+
+    with pytest.raises(TokenError, match='no longer valid'):
+        second.verify(token)
+
+
+def test_own_messages_are_skipped(workers):
+    (first, first_bus), _ = workers
+    first.revoke_user(9)
+    deliver(first_bus, first_bus)
+    assert first.stats()['remote_revocations'] == 0
+    assert first.stats()['bus_messages'] == 1
@@ -0,0 +1,91 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import ledger_reconciliation
+from ledger_reconciliation import LedgerReconciler
+from test_wallet_journal import ScriptedConnection
+
+NOW = datetime(2026, 3, 1, 12, 0)
+
+
+def check_row(wallet_id, last_id, ledger_sum, delta_all, delta_settled, settled_last, balance, scanned=1):
+    return {'wallet_id': wallet_id, 'last_id': last_id, 'ledger_sum': Decimal(ledger_sum),
+            'delta_all': Decimal(delta_all), 'delta_settled': Decimal(delta_settled),
+            'settled_last': settled_last, 'scanned': scanned, 'balance': Decimal(balance)}
+
+
+@pytest.fixture
+def checkpoints(monkeypatch):
+    saved = []
+    monkeypatch.setattr(ledger_reconciliation, 'execute_values',
+                        lambda cursor, sql, rows, **kwargs: saved.extend(rows))
+    return saved
+
+
+def run(reconciler, check_rows, full_checks=()):
+    """One reconcile over check_rows, answered batch_size rows per CHECK_BATCH"""
+    batches = [check_rows[i:i + reconciler.batch_size] for i in range(0, len(check_rows), reconciler.batch_size)]
+    connection = ScriptedConnection([
+        ('pg_try_advisory_lock', {'locked': True}),
+        ('FROM wallet_reconciliation_state', None),
+        ('NOW()::timestamp', {'now': NOW}),
+        ('AS settled', {'settled': 40}),
+        ('UNION', [{'wallet_id': row['wallet_id']} for row in check_rows]),
+    ] + [('unnest(%(wallet_ids)s', batch) for batch in batches] + [('ledger_all', full) for full in full_checks])
+    return reconciler.reconcile(connection), connection
+
+
+def test_checkpoints_advance_over_settled_rows_only(checkpoints):
+    report, connection = run(LedgerReconciler(), [
+        # 30 settled + 5 newer, unsettled: the checkpoint moves to the last settled id
+        check_row(1, 10, '100.00', '35.00', '30.00', 38, '135.00'),
+        # Nothing settled since the checkpoint: it stays where it was
+        check_row(2, 12, '20.00', '5.00', '0.00', None, '25.00'),
+    ])
+    assert checkpoints == [
+        (1, 38, Decimal('130.00'), Decimal('135.00'), Decimal('0.00'), 'ok'),
+        (2, 12, Decimal('20.00'), Decimal('25.00'), Decimal('0.00'), 'ok'),
+    ]
+    assert report['drifting'] == report['full_rechecks'] == 0
+    assert report['watermark'] == 40
+    # The run's watermark and start time are stored for the next one, then the lock released
+    assert connection.ran('INSERT INTO wallet_reconciliation_state') == [(40, NOW)]
+    assert connection.ran('pg_advisory_unlock')
+
+
+def test_late_commit_below_the_checkpoint_is_settled_by_a_full_recheck(checkpoints):
+    full = {'ledger_all': Decimal('60.00'), 'ledger_settled': Decimal('60.00'), 'settled_last': 39,
+            'scanned': 6, 'balance': Decimal('60.00')}
+    report, _ = run(LedgerReconciler(), [check_row(3, 20, '50.00', '0.00', '0.00', None, '60.00')], [full])
+    assert checkpoints == [(3, 39, Decimal('60.00'), Decimal('60.00'), Decimal('0.00'), 'ok')]
+    assert report['full_rechecks'] == 1
+    assert report['drifting'] == 0
+    assert report['transactions_scanned'] == 7
+
+
+def test_real_drift_is_flagged(checkpoints):
+    full = {'ledger_all': Decimal('50.00'), 'ledger_settled': Decimal('50.00'), 'settled_last': 20,
+            'scanned': 5, 'balance': Decimal('60.00')}
+    reconciler = LedgerReconciler()
+    report, _ = run(reconciler, [check_row(3, 20, '50.00', '0.00', '0.00', None, '60.00')], [full])
+    assert checkpoints == [(3, 20, Decimal('50.00'), Decimal('60.00'), Decimal('10.00'), 'drift')]
+    assert report['drifting'] == 1
+    assert reconciler.stats()['last_run']['drifting'] == 1
+
+
+def test_batches_split_the_candidates(checkpoints):
+    rows = [check_row(i, 0, '0', '0', '0', None, '0') for i in range(1, 6)]
+    report, connection = run(LedgerReconciler(batch_size=2), rows)
+    assert (report['wallets_checked'], report['batches']) == (5, 3)
+    assert len(checkpoints) == 5
+    assert [params['wallet_ids'] for params in connection.ran('unnest(%(wallet_ids)s')] == [[1, 2], [3, 4], [5]]
+
+
+def test_run_skips_while_another_worker_reconciles():
+    reconciler = LedgerReconciler()
+    connection = ScriptedConnection([('pg_try_advisory_lock', {'locked': False})])
+    assert reconciler.reconcile(connection) is None
+    assert reconciler.stats()['skipped_locked'] == 1
+    assert not connection.ran('wallet_reconciliation_state')
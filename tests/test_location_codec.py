@@ -0,0 +1,41 @@
+import pytest
+
+from location_codec import MAX_ENTRIES, MAX_SPAN_MS, MAX_USER_ID, decode_packed, encode_packed
+
+BASE_MS = 1_700_000_000_000
+
+
+def test_round_trip_keeps_order_and_micro_degrees():
+    fixes = [(7, 12.971612, 77.594612, BASE_MS + 250), (8, -33.868820, 151.209296, BASE_MS),
+             (MAX_USER_ID, 0.0, -179.999999, BASE_MS + 1000)]
+    data = encode_packed(fixes)
+    assert len(data) == 11 + 16 * len(fixes)
+    decoded = decode_packed(data)
+    assert [(f[0], f[3]) for f in decoded] == [(f[0], f[3]) for f in fixes]
+    for (_, lat, lng, _), (_, lat0, lng0, _) in zip(decoded, fixes):
+        assert lat == pytest.approx(lat0, abs=1e-6)
+        assert lng == pytest.approx(lng0, abs=1e-6)
+
+
+def test_empty_batch():
+    assert decode_packed(encode_packed([])) == []
+
+
+def test_fixes_the_layout_cannot_hold_are_left_out():
+    newest = BASE_MS + MAX_SPAN_MS + 10
+    fixes = [(7, 1.0, 2.0, newest), (-1, 1.0, 2.0, newest), (MAX_USER_ID + 1, 1.0, 2.0, newest),
+             ('7', 1.0, 2.0, newest), (8, 1.0, 2.0, BASE_MS)]
+    assert [f[0] for f in decode_packed(encode_packed(fixes))] == [7]
+    assert decode_packed(encode_packed([(-1, 1.0, 2.0, BASE_MS)])) == []
+
+
+def test_too_many_entries_are_refused():
+    with pytest.raises(ValueError):
+        encode_packed([(1, 0.0, 0.0, BASE_MS)] * (MAX_ENTRIES + 1))
+
+
+def test_unknown_version_is_refused():
+    data = bytearray(encode_packed([(7, 1.0, 2.0, BASE_MS)]))
+    data[0] = 2
+    with pytest.raises(ValueError, match='version 2'):
+        decode_packed(bytes(data))
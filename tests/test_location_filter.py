@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from location_filter import (
+    DUPLICATE, FUTURE, IMPOSSIBLE_JUMP, OUT_OF_ORDER, STALE, STATIONARY, TOO_FREQUENT, LocationFilter
+)
+
+LAT, LNG = 12.9716, 77.5946
+# About 100 km north
+FAR_LAT = LAT + 0.9
+
+
+@pytest.fixture
+def base():
+    return datetime.now(timezone.utc) - timedelta(minutes=10)
+
+
+def feed(location_filter, user_id, lat, lng, t):
+    """What RiderService.accept_location does with the filter; returns the drop reason"""
+    reason = location_filter.check(user_id, lat, lng, t)
+    if reason is None:
+        location_filter.remember(user_id, lat, lng, t)
+    return reason
+
+
+def test_order_duplicates_and_rate(base):
+    f = LocationFilter()
+    assert feed(f, 1, LAT, LNG, base) is None
+    assert feed(f, 1, LAT, LNG, base) == DUPLICATE
+    assert feed(f, 1, LAT + 0.001, LNG, base - timedelta(seconds=5)) == OUT_OF_ORDER
+    assert feed(f, 1, LAT + 0.0005, LNG, base + timedelta(seconds=0.2)) == TOO_FREQUENT
+    assert feed(f, 2, LAT, LNG, base - timedelta(seconds=5)) is None
+
+
+def test_stationary_until_keepalive(base):
+    f = LocationFilter(min_distance_m=5, keepalive=60)
+    assert feed(f, 1, LAT, LNG, base) is None
+    assert feed(f, 1, LAT + 1e-5, LNG, base + timedelta(seconds=10)) == STATIONARY
+    assert feed(f, 1, LAT + 1e-5, LNG, base + timedelta(seconds=60)) is None
+    # ~110 m in 10 s is a normal move
+    assert feed(f, 1, LAT + 0.001, LNG, base + timedelta(seconds=70)) is None
+
+
+def test_naive_and_aware_timestamps_compare(base):
+    f = LocationFilter()
+    assert feed(f, 1, LAT, LNG, base) is None
+    naive_same_instant = base.astimezone().replace(tzinfo=None)
+    assert feed(f, 1, LAT, LNG, naive_same_instant) == DUPLICATE
+
+
+def test_future_and_stale_first_fix():
+    f = LocationFilter(max_future=300, max_past=3600)
+    now = datetime.now(timezone.utc)
+    assert f.check(1, LAT, LNG, now + timedelta(hours=1)) == FUTURE
+    assert f.check(1, LAT, LNG, now - timedelta(hours=2)) == STALE
+    assert feed(f, 1, LAT, LNG, now - timedelta(minutes=30)) is None
+    # Only the first fix is bounded in the past; later ones are ordered against it
+    assert feed(f, 1, LAT + 0.001, LNG, now - timedelta(minutes=29)) is None
+
+
+def test_check_does_not_record(base):
+    f = LocationFilter()
+    assert f.check(1, LAT, LNG, base) is None
+    # Not remembered (e.g. the pipeline refused it), so the resend is not a duplicate
+    assert f.check(1, LAT, LNG, base) is None
+
+
+def test_glitched_reference_is_replaced_by_agreeing_fixes(base):
+    f = LocationFilter(jump_reset=3)
+    # The first fix after a reconnect is a glitch 100 km away
+    assert feed(f, 1, FAR_LAT, LNG, base) is None
+    real = [(LAT + i * 1e-4, base + timedelta(seconds=1 + i)) for i in range(4)]
+    assert feed(f, 1, real[0][0], LNG, real[0][1]) == IMPOSSIBLE_JUMP
+    assert feed(f, 1, real[1][0], LNG, real[1][1]) == IMPOSSIBLE_JUMP
+    assert feed(f, 1, real[2][0], LNG, real[2][1]) is None
+    assert feed(f, 1, real[3][0], LNG, real[3][1]) is None
+    assert f.stats()['jump_resets'] == 1
+
+
+def test_scattered_jumps_do_not_replace_the_reference(base):
+    f = LocationFilter(jump_reset=3)
+    assert feed(f, 1, LAT, LNG, base) is None
+    # Glitches that disagree with each other keep restarting the streak
+    for i, lat in enumerate([FAR_LAT, LAT - 0.9, FAR_LAT, LAT - 0.9, FAR_LAT]):
+        assert feed(f, 1, lat, LNG, base + timedelta(seconds=1 + i)) == IMPOSSIBLE_JUMP
+    assert feed(f, 1, LAT + 1e-4, LNG, base + timedelta(seconds=7)) is None
+    assert f.stats()['jump_resets'] == 0
+
+
+def test_old_reference_still_judges_jumps(base):
+    f = LocationFilter(keepalive=60, jump_reset=3)
+    assert feed(f, 1, LAT, LNG, base) is None
+    # 100 km in 61 s is too fast even though the reference is past keepalive
+    assert feed(f, 1, FAR_LAT, LNG, base + timedelta(seconds=61)) == IMPOSSIBLE_JUMP
+    assert feed(f, 1, FAR_LAT + 1e-4, LNG, base + timedelta(seconds=62)) == IMPOSSIBLE_JUMP
+    # A rider who really moved gets through once the fixes agree
+    assert feed(f, 1, FAR_LAT + 2e-4, LNG, base + timedelta(seconds=63)) is None
+
+
+def test_thin_recovers_from_a_glitch_and_keeps_the_final_row(base):
+    f = LocationFilter(jump_reset=3)
+    rows = [(base, FAR_LAT, LNG)]
+    rows += [(base + timedelta(seconds=1 + i), LAT + i * 1e-4, LNG) for i in range(5)]
+    rows += [(base + timedelta(seconds=7), LAT + 4e-4, LNG)]
+    kept = f.thin(rows)
+    assert kept[0] == rows[0]
+    # Third agreeing fix replaces the glitch, later moves are kept, the stationary final row too
+    assert kept[1:] == rows[3:]
+    assert f.stats()['upload_dropped'] == 2
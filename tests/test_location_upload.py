@@ -0,0 +1,75 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from location_upload import decode_body, prepare
+
+NOW = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+WINDOW = (NOW - timedelta(days=1), NOW + timedelta(minutes=5))
+
+
+def point(seconds_ago, lat=12.97, lng=77.59, **extra):
+    return dict({'latitude': lat, 'longitude': lng,
+                 'timestamp': (NOW - timedelta(seconds=seconds_ago)).isoformat().replace('+00:00', 'Z')}, **extra)
+
+
+def test_decode_plain_and_gzip_bodies():
+    document = {'points': [point(1)]}
+    raw = json.dumps(document).encode()
+    assert decode_body(raw) == document
+    assert decode_body(gzip.compress(raw), 'gzip') == document
+    assert decode_body(gzip.compress(raw), ' GZIP ') == document
+
+
+@pytest.mark.parametrize('raw, encoding, message', [
+    (b'{"points": []}', 'br', "Unsupported Content-Encoding 'br'"),
+    (b'not gzip', 'gzip', 'Invalid gzip body'),
+    (b'{"points": [', None, 'Body is not valid JSON'),
+    (b'\xff\xfe', None, 'Body is not valid JSON'),
+])
+def test_bad_bodies_are_refused(raw, encoding, message):
+    with pytest.raises(ValueError, match=message):
+        decode_body(raw, encoding)
+
+
+def test_size_limit_holds_after_decompression():
+    raw = json.dumps({'pad': ' ' * 5000}).encode()
+    compressed = gzip.compress(raw)
+    assert len(compressed) < 1000
+    with pytest.raises(ValueError, match='larger than 1000 bytes uncompressed'):
+        decode_body(compressed, 'gzip', max_bytes=1000)
+    with pytest.raises(ValueError, match='larger than 1000 bytes'):
+        decode_body(raw, max_bytes=1000)
+
+
+def test_prepare_sorts_dedupes_and_rejects():
+    points = [
+        point(10, lat=1.0),
+        point(30),
+        point(10, lat=2.0),                      # same device time: the last one sent wins
+        {'latitude': 91, 'longitude': 0, 'timestamp': point(5)['timestamp']},
+        {'latitude': True, 'longitude': 0, 'timestamp': point(5)['timestamp']},
+        point(5, timestamp='yesterday'),
+        point(2 * 86400),                        # older than history accepts
+        'not a point',
+        point(0, timestamp=int((NOW - timedelta(seconds=20)).timestamp() * 1000)),
+    ]
+    rows, rejected, duplicates = prepare(points, WINDOW)
+    assert [(t, lat) for t, lat, _ in rows] == [
+        (NOW - timedelta(seconds=30), 12.97), (NOW - timedelta(seconds=20), 12.97), (NOW - timedelta(seconds=10), 2.0)]
+    assert all(t.tzinfo is not None for t, _, _ in rows)
+    assert duplicates == 1
+    assert rejected == [
+        {'index': 3, 'message': 'Invalid coordinates'},
+        {'index': 4, 'message': 'Invalid coordinates'},
+        {'index': 5, 'message': 'Invalid or missing timestamp'},
+        {'index': 6, 'message': 'Timestamp outside the accepted window'},
+        {'index': 7, 'message': 'Invalid coordinates'},
+    ]
+
+
+def test_prepare_needs_a_list():
+    with pytest.raises(ValueError, match='points must be a list'):
+        prepare({'latitude': 1}, WINDOW)
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+import socketio.manager
+
+import message_bus
+from location_codec import decode_packed, encode_packed
+from message_bus import BusManager, PostgresBus
+
+PACKED = encode_packed([(7, 12.97, 77.59, 1_700_000_000_000), (8, 12.98, 77.6, 1_700_000_000_250)])
+
+
+class NotifyCursor:
+    """Records pg_notify calls the way PostgresBus.flush makes them"""
+
+    def __init__(self, sent):
+        self.sent = sent
+
+    def execute(self, query, params=None):
+        if 'pg_notify' in query:
+            self.sent.extend(zip(*params))
+
+    def fetchone(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NotifyConnection:
+    def __init__(self):
+        self.sent = []
+
+    def cursor(self):
+        return NotifyCursor(self.sent)
+
+
+@pytest.fixture
+def local_emits(monkeypatch):
+    """Emits a manager hands to its own sockets, as (event, data, room)"""
+    emitted = []
+    monkeypatch.setattr(socketio.manager.Manager, 'emit',
+                        lambda self, event, data, namespace=None, room=None, **kw: emitted.append((event, data, room)))
+    return emitted
+
+
+def test_bytes_survive_encoding():
+    message = {'blob': PACKED, 'nested': [b'\x00\xff', {'x': bytearray(b'ab')}], 'n': 1}
+    assert message_bus._loads(message_bus._dumps(message)) == {
+        'blob': PACKED, 'nested': [b'\x00\xff', {'x': b'ab'}], 'n': 1}
+
+
+def test_postgres_bus_round_trip_through_bus_manager(local_emits):
+    sender_bus, receiver_bus = PostgresBus({}), PostgresBus({})
+    sender = BusManager(sender_bus)
+    receiver = BusManager(receiver_bus)
+
+    sender.emit('rider_locations_packed', PACKED, room='admins|packed')
+    sender.emit('rider_status_changed', {'user_id': 7, 'is_online': True}, room='admins')
+    sender_bus.publish('presence', {'op': 'heartbeat', 'raw': b'\x01\x02'})
+    connection = NotifyConnection()
+    assert sender_bus.flush(connection) == 3
+
+    presence = []
+    receiver_bus.subscribe('presence', presence.append)
+    channels = {receiver_bus._pg_channel(c): c for c in receiver_bus._subscribers}
+    for pg_channel, payload in connection.sent:
+        receiver_bus._deliver(channels[pg_channel], payload, None)
+
+    while not receiver._inbox.empty():
+        receiver._handle_emit(receiver._inbox.get_nowait())
+    remote = local_emits[2:]  # the first two are the sender's own local delivery
+    assert remote[0] == ('rider_locations_packed', PACKED, 'admins|packed')
+    assert decode_packed(remote[0][1])[0][0] == 7
+    assert remote[1] == ('rider_status_changed', {'user_id': 7, 'is_online': True}, 'admins')
+    assert presence == [{'op': 'heartbeat', 'raw': b'\x01\x02'}]
+
+
+def test_kombu_bus_round_trip_reuses_connection(local_emits):
+    pytest.importorskip('kombu')
+    url = 'memory://'
+    sender_bus, receiver_bus = message_bus.KombuBus(url), message_bus.KombuBus(url)
+    sender = BusManager(sender_bus)
+    receiver = BusManager(receiver_bus)
+    receiver_bus.start(lambda fn: threading.Thread(target=fn, daemon=True).start())
+    time.sleep(0.3)  # let the listener bind its queue
+
+    for _ in range(3):
+        sender.emit('rider_locations_packed', PACKED, room='admins|packed')
+    messages = [receiver._inbox.get(timeout=5) for _ in range(3)]
+    for message in messages:
+        receiver._handle_emit(message)
+
+    assert local_emits[-1] == ('rider_locations_packed', PACKED, 'admins|packed')
+    stats = sender_bus.stats()
+    assert stats['published'] == 3
+    assert stats['connects'] == 1
+
+
+def test_kombu_bus_reconnects_after_publish_error():
+    pytest.importorskip('kombu')
+    bus = message_bus.KombuBus('memory://')
+    bus.publish('presence', {'n': 1})
+    bus._producer.publish = lambda *a, **kw: (_ for _ in ()).throw(ConnectionError('broker went away'))
+    bus.publish('presence', {'n': 2})
+    stats = bus.stats()
+    assert stats['published'] == 2
+    assert stats['publish_failures'] == 0
+    assert stats['connects'] == 2
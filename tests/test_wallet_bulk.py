@@ -0,0 +1,100 @@
+from decimal import Decimal
+
+import pytest
+
+import wallet_bulk
+from test_wallet_journal import ScriptedConnection
+
+ADMIN = 1
+
+
+def test_valid_operations_are_normalised():
+    valid, rejected = wallet_bulk.parse_operations([
+        {'rider_id': 5, 'amount': '10.5', 'category': 'FUEL'},
+        {'rider_id': '6', 'amount': 3, 'type': 'credit', 'description': 'bonus'},
+        {'rider_id': 7, 'amount': 0.1, 'category': 'FEE'},
+    ], ADMIN)
+    assert rejected == []
+    assert valid == [
+        (0, 5, Decimal('10.50'), 'DEBIT', 'FUEL', None),
+        (1, 6, Decimal('3.00'), 'CREDIT', 'RECHARGE', 'bonus'),
+        (2, 7, Decimal('0.10'), 'DEBIT', 'FEE', None),
+    ]
+    # Exact cents, so the sums match the DECIMAL(10,2) rows
+    assert all(op[2].as_tuple().exponent == -2 for op in valid)
+
+
+@pytest.mark.parametrize('item, message', [
+    ({'rider_id': 5, 'amount': '1.005', 'category': 'FUEL'}, 'Amount must have at most 2 decimal places'),
+    ({'rider_id': 5, 'amount': 0, 'category': 'FUEL'}, 'Amount must be positive'),
+    ({'rider_id': 5, 'amount': 'NaN', 'category': 'FUEL'}, 'Amount must be positive'),
+    ({'rider_id': 5, 'amount': 'ten', 'category': 'FUEL'}, 'Invalid rider_id or amount format'),
+    ({'rider_id': 5, 'amount': True, 'category': 'FUEL'}, 'Invalid rider_id or amount format'),
+    ({'rider_id': True, 'amount': 1, 'category': 'FUEL'}, 'Invalid rider_id or amount format'),
+    ({'rider_id': 3.7, 'amount': 1, 'category': 'FUEL'}, 'Invalid rider_id or amount format'),
+    ({'rider_id': None, 'amount': 1, 'category': 'FUEL'}, 'Invalid rider_id or amount format'),
+    ({'rider_id': ADMIN, 'amount': 1, 'category': 'FUEL'}, 'Cannot apply to your own wallet'),
+    ({'rider_id': 5, 'amount': 1, 'type': 'REFUND'}, "Type must be one of ('CREDIT', 'DEBIT')"),
+    ({'rider_id': 5, 'amount': 1}, 'Category is required for debits'),
+])
+def test_invalid_operations_are_rejected(item, message):
+    valid, rejected = wallet_bulk.parse_operations([item], ADMIN)
+    assert valid == []
+    assert rejected == [{'index': 0, 'rider_id': item['rider_id'], 'status': 'rejected', 'message': message}]
+
+
+def test_rejections_keep_their_index():
+    valid, rejected = wallet_bulk.parse_operations(['nope', {'rider_id': 5, 'amount': 2, 'category': 'FUEL'}], ADMIN)
+    assert [op[0] for op in valid] == [1]
+    assert rejected[0]['index'] == 0
+    assert rejected[0]['message'] == 'Operation must be an object'
+
+
+@pytest.fixture
+def statements(monkeypatch):
+    """execute_values calls as (sql, rows), answering APPLY_OPERATIONS with one row per applied operation"""
+    calls = []
+
+    def execute_values(cursor, sql, rows, template=None, page_size=100, fetch=False):
+        calls.append((sql, list(rows)))
+        if fetch:
+            # Rider 9 does not exist: nothing is applied for it
+            return [{'idx': op[0], 'user_id': op[1], 'balance': None if op[1] == 9 else Decimal('50.00'),
+                     'transactions': 4} for op in rows]
+
+    monkeypatch.setattr(wallet_bulk, 'execute_values', execute_values)
+    return calls
+
+
+def test_apply_credits_the_admin_once_for_applied_debits(statements):
+    operations, _ = wallet_bulk.parse_operations([
+        {'rider_id': 5, 'amount': '10.10', 'category': 'FUEL'},
+        {'rider_id': 6, 'amount': '0.20', 'category': 'FUEL'},
+        {'rider_id': 6, 'amount': '99', 'type': 'CREDIT'},
+        {'rider_id': 9, 'amount': '7', 'category': 'FUEL'},
+    ], ADMIN)
+    connection = ScriptedConnection()
+    results, transactions = wallet_bulk.apply_operations(connection.cursor(), ADMIN, operations)
+
+    ensure, apply = statements
+    assert ensure[1] == [(ADMIN,), (5,), (6,), (9,)]
+    assert apply[1] == operations
+    assert transactions == 4
+    assert [r['balance'] for r in results] == [Decimal('50.00')] * 3 + [None]
+    # Debits of riders that exist, summed in cents; journaled by default
+    assert connection.ran('INSERT INTO wallet_credit_journal') == [(Decimal('10.30'), ADMIN)]
+
+
+def test_apply_without_journal_updates_the_admin_wallet(statements):
+    operations, _ = wallet_bulk.parse_operations([{'rider_id': 5, 'amount': 4, 'category': 'FUEL'}], ADMIN)
+    connection = ScriptedConnection()
+    wallet_bulk.apply_operations(connection.cursor(), ADMIN, operations, journaled=False)
+    assert connection.ran('UPDATE wallets SET balance') == [(Decimal('4.00'), ADMIN)]
+
+
+def test_apply_credits_nothing_without_debits(statements):
+    operations, _ = wallet_bulk.parse_operations([{'rider_id': 5, 'amount': 4, 'type': 'CREDIT'}], ADMIN)
+    connection = ScriptedConnection()
+    wallet_bulk.apply_operations(connection.cursor(), ADMIN, operations)
+    assert connection.executed == []
+    assert wallet_bulk.apply_operations(connection.cursor(), ADMIN, []) == ([], 0)
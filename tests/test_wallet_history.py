@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import wallet_history
+from test_wallet_journal import ScriptedConnection
+from wallet_history import CursorError, decode_cursor, encode_cursor
+
+CREATED = datetime(2026, 3, 1, 9, 30, 15, 123456)
+
+
+def rows(count, id_column='transaction_id'):
+    """Newest first, one second apart"""
+    return [{id_column: 100 - i, 'created_at': CREATED - timedelta(seconds=i)} for i in range(count)]
+
+
+def test_cursor_round_trip():
+    token = encode_cursor(CREATED, 42)
+    assert '=' not in token
+    assert decode_cursor(token) == (CREATED.isoformat(), 42)
+
+
+@pytest.mark.parametrize('token', ['', 'not a cursor', encode_cursor(CREATED, 42)[:-3],
+                                   'WyJ5ZXN0ZXJkYXkiLCAxXQ'])  # ["yesterday", 1]
+def test_bad_cursors_are_rejected(token):
+    with pytest.raises(CursorError):
+        decode_cursor(token)
+
+
+def test_page_with_more_rows_hands_out_a_cursor_to_the_last_one():
+    fetched = rows(4)
+    page, next_cursor = wallet_history.page(fetched, 3, 'transaction_id')
+    assert page == fetched[:3]
+    assert decode_cursor(next_cursor) == (fetched[2]['created_at'].isoformat(), 98)
+
+
+def test_last_page_has_no_cursor():
+    fetched = rows(3)
+    assert wallet_history.page(fetched, 3, 'transaction_id') == (fetched, None)
+    assert wallet_history.page([], 3, 'transaction_id') == ([], None)
+
+
+def test_next_page_starts_after_the_cursor():
+    connection = ScriptedConnection([('FROM wallet_transactions', rows(3))])
+    page, next_cursor = wallet_history.transactions_page(connection.cursor(), 7, limit=2, tx_type='DEBIT')
+    assert len(page) == 2
+
+    connection = ScriptedConnection([('FROM withdrawal_requests', [])])
+    wallet_history.withdrawals_page(connection.cursor(), 7, limit=2, after=next_cursor)
+    (query, params), = connection.executed
+    assert '(created_at, request_id) < (%s, %s)' in query
+    # One extra row tells whether there is a next page
+    assert params == [7, page[-1]['created_at'].isoformat(), 99, 3]
+
+
+def test_unknown_type_filter_is_refused():
+    connection = ScriptedConnection()
+    with pytest.raises(ValueError, match='type must be one of'):
+        wallet_history.transactions_page(connection.cursor(), 7, tx_type='REFUND')
+
+
+def test_page_size_bounds():
+    assert wallet_history.page_size(None) == 20
+    assert wallet_history.page_size('100') == 100
+    with pytest.raises(ValueError):
+        wallet_history.page_size('101')
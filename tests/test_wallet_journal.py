@@ -0,0 +1,132 @@
+from decimal import Decimal
+
+import pytest
+
+import wallet_journal
+from wallet_journal import CreditJournal
+
+
+class ScriptedCursor:
+    """RealDictCursor stand-in: each statement gets the first scripted result whose SQL fragment it contains"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = None
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((query, params))
+        self.result = None
+        for i, (fragment, result) in enumerate(self.connection.script):
+            if fragment in query:
+                del self.connection.script[i]
+                self.result = result
+                break
+
+    def fetchone(self):
+        return self.result[0] if isinstance(self.result, list) else self.result
+
+    def fetchall(self):
+        return self.result or []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class ScriptedConnection:
+    """Connection stand-in answering from script, a list of (SQL fragment, row or rows)"""
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.executed = []
+        self.prepared_statements = set()
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return ScriptedCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def ran(self, fragment):
+        return [params for query, params in self.executed if fragment in query]
+
+
+def deduct(connection, journaled=True):
+    return wallet_journal.deduct(connection, connection.cursor(), 7, 1, Decimal('25.00'), 'FUEL', 'note', journaled)
+
+
+def test_deduct_with_admin_wallet_runs_once():
+    connection = ScriptedConnection([
+        ('EXECUTE wallet_deduct_journaled', {'transactions': 2, 'balance': Decimal('75.00')}),
+    ])
+    assert deduct(connection)['balance'] == Decimal('75.00')
+    assert connection.ran('EXECUTE wallet_deduct_journaled') == [
+        (7, 1, Decimal('25.00'), 'FUEL', 'note', 'From Rider 7: FUEL')]
+    assert connection.rollbacks == 0
+    assert not connection.ran('create_wallet')
+
+
+def test_deduct_creates_the_admin_wallet_and_retries():
+    connection = ScriptedConnection([
+        # Only the debit row: the admin has no wallet to credit yet
+        ('EXECUTE wallet_deduct_journaled', {'transactions': 1, 'balance': Decimal('75.00')}),
+        ('EXECUTE wallet_deduct_journaled', {'transactions': 2, 'balance': Decimal('75.00')}),
+    ])
+    assert deduct(connection)['transactions'] == 2
+    # The half-applied attempt is rolled back before the wallet is created
+    assert connection.rollbacks == 1
+    assert connection.ran('EXECUTE create_wallet') == [(1,)]
+    assert len(connection.ran('EXECUTE wallet_deduct_journaled')) == 2
+    # Each statement is prepared once per connection
+    assert len(connection.ran('PREPARE wallet_deduct_journaled')) == 1
+
+
+def test_deduct_gives_up_when_the_admin_wallet_cannot_be_credited():
+    connection = ScriptedConnection([
+        ('EXECUTE wallet_deduct_journaled', {'transactions': 1, 'balance': Decimal('75.00')}),
+        ('EXECUTE wallet_deduct_journaled', {'transactions': 1, 'balance': Decimal('75.00')}),
+    ])
+    with pytest.raises(RuntimeError, match='Wallet of admin 1'):
+        deduct(connection)
+
+
+def test_direct_deduct_uses_the_plain_statement():
+    connection = ScriptedConnection([('EXECUTE wallet_deduct ', {'transactions': 2, 'balance': Decimal('5.00')})])
+    assert deduct(connection, journaled=False)['balance'] == Decimal('5.00')
+    assert not connection.ran('wallet_deduct_journaled')
+
+
+def test_fold_applies_a_batch_and_counts_it():
+    journal = CreditJournal(batch_size=100)
+    connection = ScriptedConnection([
+        ('pg_try_advisory_xact_lock', {'locked': True}),
+        ('DELETE FROM wallet_credit_journal', {'wallets': 2, 'entries': Decimal('5')}),
+    ])
+    assert journal.fold(connection) == 5
+    assert connection.ran('LIMIT %s') == [(100,)]
+    assert connection.commits == 1
+    stats = journal.stats()
+    assert (stats['folds'], stats['entries_folded'], stats['wallets_updated']) == (1, 5, 2)
+
+
+def test_fold_skips_while_another_worker_folds():
+    journal = CreditJournal()
+    connection = ScriptedConnection([('pg_try_advisory_xact_lock', {'locked': False})])
+    assert journal.fold(connection) == 0
+    assert not connection.ran('DELETE FROM wallet_credit_journal')
+    assert connection.rollbacks == 1
+    assert journal.stats()['skipped_locked'] == 1
+
+
+def test_fold_user_runs_in_the_callers_transaction():
+    connection = ScriptedConnection()
+    CreditJournal.fold_user(connection.cursor(), 1)
+    assert connection.ran('WHERE user_id = %s') == [(1,)]
+    assert connection.commits == connection.rollbacks == 0
@@ -0,0 +1,112 @@
+import math
+import threading
+
+from location_codec import FORMAT_JSON, FORMATS
+
+# Sockets that never sent a viewport (legacy dashboards) get every fix
+FLEET_ROOM = 'fleet'
+
+
+def format_room(room, fmt):
+    """Room variant for clients that negotiated a non-JSON wire format"""
+    return room if fmt == FORMAT_JSON else f'{room}#{fmt}'
+
+
+class ViewportRooms:
+    """Maps map viewports onto coarse grid-cell Socket.IO rooms.
+
+    A dashboard subscribes with a bounding box and joins one room per grid
+    cell the box touches. A location fix is emitted to the room of the cell
+    the rider is in (plus FLEET_ROOM), so each dashboard only receives fixes
+    inside, or just around, what it is showing. Boxes covering more than
+    max_cells cells fall back to FLEET_ROOM.
+
+    Clients that negotiated another wire format sit in per-format variants
+    of the same rooms (see format_room), so the broadcaster can encode a
+    batch once per format.
+    """
+
+    def __init__(self, cell_deg=0.05, max_cells=400):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # sid -> set of rooms
+        self._formats = {}        # sid -> wire format, when not JSON
+
+    def cell_of(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def room_for(self, lat, lng):
+        row, col = self.cell_of(lat, lng)
+        return f'geo:{row}:{col}'
+
+    def location_rooms(self, lat, lng):
+        """Rooms a fix at (lat, lng) must be emitted to"""
+        return [FLEET_ROOM, self.room_for(lat, lng)]
+
+    def rooms_for_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        if min_lat > max_lat or min_lng > max_lng:
+            raise ValueError("Bounding box minimum must not exceed maximum")
+        row_lo, col_lo = self.cell_of(min_lat, min_lng)
+        row_hi, col_hi = self.cell_of(max_lat, max_lng)
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > self.max_cells:
+            return {FLEET_ROOM}
+        return {f'geo:{row}:{col}'
+                for row in range(row_lo, row_hi + 1)
+                for col in range(col_lo, col_hi + 1)}
+
+    def subscribe(self, sid, min_lat, min_lng, max_lat, max_lng):
+        """Record a new viewport for sid; returns (rooms_to_join, rooms_to_leave)"""
+        rooms = self.rooms_for_bbox(min_lat, min_lng, max_lat, max_lng)
+        with self._lock:
+            # A socket with no viewport yet is in FLEET_ROOM from connect
+            current = self._subscriptions.get(sid, {FLEET_ROOM})
+            self._subscriptions[sid] = rooms
+            fmt = self._formats.get(sid, FORMAT_JSON)
+        return ({format_room(r, fmt) for r in rooms - current},
+                {format_room(r, fmt) for r in current - rooms})
+
+    def unsubscribe(self, sid):
+        """Drop sid's viewport; returns (rooms_to_join, rooms_to_leave)"""
+        with self._lock:
+            current = self._subscriptions.pop(sid, None)
+            fmt = self._formats.get(sid, FORMAT_JSON)
+        if current is None:
+            return set(), set()
+        return ({format_room(r, fmt) for r in {FLEET_ROOM} - current},
+                {format_room(r, fmt) for r in current - {FLEET_ROOM}})
+
+    def set_format(self, sid, fmt):
+        """Switch sid's wire format; returns (rooms_to_join, rooms_to_leave)"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown location format '{fmt}', expected one of {FORMATS}")
+        with self._lock:
+            old = self._formats.get(sid, FORMAT_JSON)
+            if fmt == FORMAT_JSON:
+                self._formats.pop(sid, None)
+            else:
+                self._formats[sid] = fmt
+            rooms = self._subscriptions.get(sid, {FLEET_ROOM})
+        if old == fmt:
+            return set(), set()
+        return {format_room(r, fmt) for r in rooms}, {format_room(r, old) for r in rooms}
+
+    def uses_format(self, fmt):
+        """Whether any socket currently wants fmt (JSON always counts)"""
+        with self._lock:
+            return fmt == FORMAT_JSON or fmt in self._formats.values()
+
+    def forget(self, sid):
+        """Disconnect cleanup; the server removes the sid from its rooms itself"""
+        with self._lock:
+            self._subscriptions.pop(sid, None)
+            self._formats.pop(sid, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribed_sockets': len(self._subscriptions),
+                'subscribed_rooms': sum(len(r) for r in self._subscriptions.values()),
+                'non_json_sockets': len(self._formats),
+                'cell_deg': self.cell_deg
+            }
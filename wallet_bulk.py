@@ -0,0 +1,181 @@
+from decimal import Decimal, InvalidOperation
+
+from psycopg2.extras import execute_values
+
+TRANSACTION_TYPES = ('CREDIT', 'DEBIT')
+
+# wallets.balance and wallet_transactions.amount are DECIMAL(10,2)
+CENT = Decimal('0.01')
+
+ENSURE_WALLETS = """
+    INSERT INTO wallets (user_id, balance, last_updated)
+    SELECT u.user_id, 0.00, NOW()
+    FROM (VALUES %s) AS o (user_id)
+    JOIN users u ON u.user_id = o.user_id
+    ON CONFLICT (user_id) DO NOTHING
+"""
+
+# One statement for the whole batch. Balances move by the net delta per wallet
+# (UPDATE ... FROM applies only one matching row per target, so deltas are summed
+# first); every operation still gets its own ledger row. Debits credit the admin
+# the same way /api/wallet/deduct does: one EARNING row per debit.
+APPLY_OPERATIONS = """
+    WITH ops (idx, user_id, amount, tx_type, category, description) AS (
+        VALUES %s
+    ), w AS (
+        -- Lock in wallet_id order so overlapping batches cannot deadlock each other
+        SELECT wallet_id, user_id FROM wallets
+        WHERE user_id IN (SELECT user_id FROM ops)
+        ORDER BY wallet_id
+        FOR UPDATE
+    ), d AS (
+        SELECT w.wallet_id,
+               SUM(CASE WHEN o.tx_type = 'CREDIT' THEN o.amount ELSE -o.amount END) AS delta
+        FROM ops o JOIN w ON w.user_id = o.user_id
+        GROUP BY w.wallet_id
+    ), u AS (
+        UPDATE wallets
+        SET balance = wallets.balance + d.delta, last_updated = NOW()
+        FROM d
+        WHERE wallets.wallet_id = d.wallet_id
+        RETURNING wallets.user_id, wallets.balance
+    ), t AS (
+        INSERT INTO wallet_transactions
+        (wallet_id, amount, transaction_type, category, description, performed_by)
+        SELECT w.wallet_id, o.amount, o.tx_type, o.category, o.description, {admin_id}
+        FROM ops o JOIN w ON w.user_id = o.user_id
+        UNION ALL
+        SELECT a.wallet_id, o.amount, 'CREDIT', 'EARNING',
+               'From Rider ' || o.user_id || ': ' || o.category, {admin_id}
+        FROM ops o JOIN w ON w.user_id = o.user_id
+        CROSS JOIN (SELECT wallet_id FROM wallets WHERE user_id = {admin_id}) a
+        WHERE o.tx_type = 'DEBIT'
+        RETURNING transaction_id
+    )
+    SELECT o.idx, o.user_id, u.balance, (SELECT COUNT(*) FROM t) AS transactions
+    FROM ops o
+    LEFT JOIN u ON u.user_id = o.user_id
+    ORDER BY o.idx
+"""
+
+CREDIT_ADMIN = """
+    UPDATE wallets SET balance = balance + %s, last_updated = NOW() WHERE user_id = %s
+"""
+
+JOURNAL_ADMIN = """
+    INSERT INTO wallet_credit_journal (wallet_id, amount)
+    SELECT wallet_id, %s FROM wallets WHERE user_id = %s
+"""
+
+RULE_TARGETS = {
+    'online_riders': """
+        SELECT u.user_id FROM users u
+        JOIN rider_status rs ON rs.user_id = u.user_id
+        WHERE u.role = 'rider' AND rs.is_online = TRUE
+        ORDER BY u.user_id
+    """,
+    'all_riders': "SELECT user_id FROM users WHERE role = 'rider' ORDER BY user_id",
+}
+
+
+def _rider_id(value):
+    """rider_id as an int; bools, fractions and other types are refused instead of coerced"""
+    if isinstance(value, bool):
+        raise TypeError('rider_id must be an integer')
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise TypeError('rider_id must be an integer')
+
+
+def _amount(value):
+    """Amount as a Decimal in cents; more than 2 decimal places raises ValueError.
+
+    Refused rather than rounded, so the balance deltas and the admin's
+    earnings summed here match the rows the database stores.
+    """
+    if isinstance(value, bool):
+        raise TypeError('amount must be a number')
+    amount = Decimal(str(value))
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError('Amount must be positive')
+    cents = amount.quantize(CENT)
+    if cents != amount:
+        raise ValueError('Amount must have at most 2 decimal places')
+    return cents
+
+
+def _validate(item, admin_id):
+    """Reason an operation cannot be applied, or None"""
+    if _rider_id(item.get('rider_id')) == admin_id:
+        return 'Cannot apply to your own wallet'
+    try:
+        _amount(item.get('amount'))
+    except ValueError as e:
+        return str(e)
+    tx_type = str(item.get('type', 'DEBIT')).upper()
+    if tx_type not in TRANSACTION_TYPES:
+        return f"Type must be one of {TRANSACTION_TYPES}"
+    if tx_type == 'DEBIT' and not item.get('category'):
+        return 'Category is required for debits'
+    return None
+
+
+def parse_operations(items, admin_id):
+    """Validate request rows; returns (valid [(idx, user_id, amount, type, category, description)], rejected results)"""
+    valid = []
+    rejected = []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            rejected.append({'index': idx, 'rider_id': None, 'status': 'rejected', 'message': 'Operation must be an object'})
+            continue
+        try:
+            message = _validate(item, admin_id)
+        except (TypeError, ValueError, InvalidOperation):
+            message = 'Invalid rider_id or amount format'
+        if message:
+            rejected.append({'index': idx, 'rider_id': item.get('rider_id'), 'status': 'rejected', 'message': message})
+            continue
+        tx_type = str(item.get('type', 'DEBIT')).upper()
+        category = item.get('category') or 'RECHARGE'
+        valid.append((idx, _rider_id(item['rider_id']), _amount(item['amount']), tx_type, category,
+                      item.get('description')))
+    return valid, rejected
+
+
+def rule_operations(cursor, rule):
+    """Expand {'target', 'amount', 'type', 'category', 'description'} into request rows"""
+    target = rule.get('target', 'online_riders')
+    if target not in RULE_TARGETS:
+        raise ValueError(f"Unknown target '{target}', expected one of {tuple(RULE_TARGETS)}")
+    cursor.execute(RULE_TARGETS[target])
+    return [dict(rule, rider_id=row['user_id']) for row in cursor.fetchall()]
+
+
+def apply_operations(cursor, admin_id, operations, journaled=True):
+    """Apply validated operations in the caller's transaction.
+
+    Returns one result row per operation: {'idx', 'user_id', 'balance'},
+    balance being None when the rider does not exist (nothing was applied
+    for it), plus the number of ledger rows written. The admin's earnings
+    from the applied debits are credited once for the whole batch.
+    """
+    if not operations:
+        return [], 0
+    admin_id = int(admin_id)
+    user_ids = sorted({op[1] for op in operations} | {admin_id})
+    execute_values(cursor, ENSURE_WALLETS, [(user_id,) for user_id in user_ids], page_size=len(user_ids))
+
+    rows = execute_values(
+        cursor, APPLY_OPERATIONS.format(admin_id=admin_id), operations,
+        template='(%s, %s::integer, %s::numeric, %s, %s, %s)',
+        page_size=len(operations), fetch=True
+    )
+    transactions = rows[0]['transactions'] if rows else 0
+    applied = {r['user_id'] for r in rows if r['balance'] is not None}
+    earnings = sum(op[2] for op in operations if op[3] == 'DEBIT' and op[1] in applied)
+    if earnings:
+        # Journaled: one entry for the whole batch instead of holding the admin row lock
+        cursor.execute(JOURNAL_ADMIN if journaled else CREDIT_ADMIN, (earnings, admin_id))
+    return [{'idx': r['idx'], 'user_id': r['user_id'], 'balance': r['balance']} for r in rows], transactions
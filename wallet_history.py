@@ -0,0 +1,126 @@
+"""Keyset pagination over wallet transactions and withdrawal requests.
+
+Pages are ordered newest first on (created_at, id) and the next page starts
+strictly after the last row returned, so page N is one index range scan
+of `limit` rows however deep it is, unlike OFFSET which reads and throws
+away every earlier row. The cursor handed to clients is opaque.
+"""
+import base64
+import json
+from datetime import datetime
+
+TRANSACTION_TYPES = ('CREDIT', 'DEBIT')
+MAX_PAGE_SIZE = 100
+
+SCHEMA_STATEMENTS = [
+    # Serves the wallet filter, the keyset order and the type/category filters
+    # without touching the heap. description stays out: free text could push
+    # index tuples past the btree size limit and fail the ledger insert.
+    # CONCURRENTLY so building it on a large ledger does not block writes.
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wallet_transactions_wallet_keyset
+    ON wallet_transactions (wallet_id, created_at DESC, transaction_id DESC)
+    INCLUDE (amount, transaction_type, category)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_withdrawal_requests_user_keyset
+    ON withdrawal_requests (user_id, created_at DESC, request_id DESC)
+    """,
+]
+
+
+class CursorError(ValueError):
+    """Raised for a malformed or tampered page cursor"""
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; returns (created_at ISO string, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, row_id = json.loads(raw)
+        datetime.fromisoformat(created_at)
+        return created_at, int(row_id)
+    except (ValueError, TypeError):
+        raise CursorError('Invalid page cursor')
+
+
+def page_size(value, default=20):
+    limit = int(value) if value else default
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+
+def transactions_page(cursor, user_id, limit=20, after=None, category=None, tx_type=None,
+                      start=None, end=None):
+    """One page of a user's wallet transactions, newest first.
+
+    after is a cursor from a previous page; start/end bound created_at
+    (inclusive/exclusive). Returns (rows, next_cursor or None).
+    """
+    # Rows without a timestamp have no keyset position (and DESC would sort them first)
+    conditions = ["t.wallet_id = (SELECT wallet_id FROM wallets WHERE user_id = %s)", "t.created_at IS NOT NULL"]
+    params = [user_id]
+    if after:
+        created_at, transaction_id = decode_cursor(after)
+        conditions.append("(t.created_at, t.transaction_id) < (%s, %s)")
+        params += [created_at, transaction_id]
+    if category:
+        conditions.append("t.category = %s")
+        params.append(category)
+    if tx_type:
+        if tx_type not in TRANSACTION_TYPES:
+            raise ValueError(f"type must be one of {TRANSACTION_TYPES}")
+        conditions.append("t.transaction_type = %s")
+        params.append(tx_type)
+    if start:
+        conditions.append("t.created_at >= %s")
+        params.append(start)
+    if end:
+        conditions.append("t.created_at < %s")
+        params.append(end)
+
+    # One extra row tells whether there is a next page
+    cursor.execute(f"""
+        SELECT t.transaction_id, t.amount, t.transaction_type, t.category, t.description, t.created_at
+        FROM wallet_transactions t
+        WHERE {' AND '.join(conditions)}
+        ORDER BY t.created_at DESC, t.transaction_id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cursor.fetchall()
+    return page(rows, limit, 'transaction_id')
+
+
+def withdrawals_page(cursor, user_id, limit=50, after=None):
+    """One page of a user's withdrawal requests, newest first"""
+    conditions = ["user_id = %s", "created_at IS NOT NULL"]
+    params = [user_id]
+    if after:
+        created_at, request_id = decode_cursor(after)
+        conditions.append("(created_at, request_id) < (%s, %s)")
+        params += [created_at, request_id]
+
+    cursor.execute(f"""
+        SELECT request_id, amount, method, account_details, notes, status, created_at, processed_at
+        FROM withdrawal_requests
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, request_id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cursor.fetchall()
+    return page(rows, limit, 'request_id')
+
+
+def page(rows, limit, id_column):
+    """Trim a limit + 1 row fetch to limit rows; returns (rows, next_cursor or None)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last['created_at'], last[id_column])
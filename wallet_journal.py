@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+# Only one worker folds at a time, so two folds never lock wallets in different orders
+FOLD_LOCK_KEY = 'wallet_credit_journal_fold'
+
+FOLD_PENDING = """
+    WITH j AS (
+        DELETE FROM wallet_credit_journal
+        WHERE journal_id IN (
+            SELECT journal_id FROM wallet_credit_journal
+            ORDER BY journal_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING wallet_id, amount
+    ), s AS (
+        SELECT wallet_id, SUM(amount) AS total, COUNT(*) AS entries FROM j GROUP BY wallet_id
+    ), u AS (
+        UPDATE wallets w
+        SET balance = w.balance + s.total, last_updated = NOW()
+        FROM s
+        WHERE w.wallet_id = s.wallet_id
+        RETURNING w.wallet_id
+    )
+    SELECT (SELECT COUNT(*) FROM u) AS wallets, COALESCE((SELECT SUM(entries) FROM s), 0) AS entries
+"""
+
+FOLD_USER = """
+    WITH j AS (
+        DELETE FROM wallet_credit_journal
+        WHERE wallet_id IN (SELECT wallet_id FROM wallets WHERE user_id = %s)
+        RETURNING wallet_id, amount
+    )
+    UPDATE wallets w
+    SET balance = w.balance + s.total, last_updated = NOW()
+    FROM (SELECT wallet_id, SUM(amount) AS total FROM j GROUP BY wallet_id) s
+    WHERE w.wallet_id = s.wallet_id
+"""
+
+
+def deduct(connection, cursor, rider_id, admin_id, amount, category, description, journaled=True):
+    """Debit the rider and credit the admin in the caller's transaction; returns the statement's row.
+
+    The journaled statement only reads the admin's wallet, so before the
+    admin's first earning it writes just the debit: that attempt is rolled
+    back, the wallet created and the deduction run again.
+    """
+    statement = 'wallet_deduct_journaled' if journaled else 'wallet_deduct'
+    params = (rider_id, admin_id, amount, category, description, f"From Rider {rider_id}: {category}")
+    result = queries.execute(cursor, statement, params).fetchone()
+    if result['transactions'] != 2:
+        connection.rollback()
+        queries.execute(cursor, 'create_wallet', (admin_id,))
+        result = queries.execute(cursor, statement, params).fetchone()
+        if result['transactions'] != 2:
+            raise RuntimeError(f'Wallet of admin {admin_id} could not be credited')
+    return result
+
+
+class CreditJournal:
+    """Folds deferred wallet credits into wallets.balance in the background.
+
+    Credits to hot wallets (the admin side of every deduction) are not
+    applied with UPDATE wallets, which would make every concurrent
+    deduction queue on that one row lock. They are written to
+    wallet_transactions as usual plus an append-only wallet_credit_journal
+    row, and this job periodically moves journal rows into the balance.
+
+    Invariant: wallets.balance + SUM(pending journal rows for the wallet)
+    equals the ledger, and readers add the pending sum in the same
+    statement. Anything that debits a journaled wallet must fold_user()
+    first, in its own transaction, so the balance check sees every credit.
+    """
+
+    def __init__(self, interval=1.0, batch_size=5000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._counters = {
+            'folds': 0,
+            'fold_failures': 0,
+            'skipped_locked': 0,
+            'entries_folded': 0,
+            'wallets_updated': 0,
+            'last_fold_ms': 0.0,
+            'max_fold_ms': 0.0
+        }
+
+    def fold(self, connection):
+        """Apply up to batch_size pending credits; returns how many were folded"""
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked", (FOLD_LOCK_KEY,))
+            if not cursor.fetchone()['locked']:
+                connection.rollback()
+                with self._lock:
+                    self._counters['skipped_locked'] += 1
+                return 0
+            cursor.execute(FOLD_PENDING, (self.batch_size,))
+            result = cursor.fetchone()
+        connection.commit()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            c = self._counters
+            c['folds'] += 1
+            c['entries_folded'] += int(result['entries'])
+            c['wallets_updated'] += result['wallets']
+            c['last_fold_ms'] = round(elapsed_ms, 2)
+            c['max_fold_ms'] = max(c['max_fold_ms'], c['last_fold_ms'])
+        return int(result['entries'])
+
+    @staticmethod
+    def fold_user(cursor, user_id):
+        """Apply all of one user's pending credits in the caller's transaction"""
+        cursor.execute(FOLD_USER, (user_id,))
+
+    def run(self, pool):
+        while True:
+            try:
+                with pool.connection() as connection:
+                    # Keep going while there is a backlog, then wait for the next tick
+                    while self.fold(connection) >= self.batch_size:
+                        pass
+            except Exception as e:
+                with self._lock:
+                    self._counters['fold_failures'] += 1
+                logger.error(f"Credit journal fold error: {e}")
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c['interval'] = self.interval
+        return c
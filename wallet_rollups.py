@@ -0,0 +1,261 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Single folder across workers, like the credit journal fold
+FOLD_LOCK_KEY = 'wallet_rollup_fold'
+PERIODS = ('day', 'month')
+GROUPINGS = ('rider', 'category', 'rider_category', 'total')
+
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS wallet_rollup_daily (
+        day DATE NOT NULL,
+        user_id INTEGER NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        transaction_type VARCHAR(10) NOT NULL,
+        total DECIMAL(14, 2) NOT NULL,
+        tx_count INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id, category, transaction_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS wallet_rollup_monthly (
+        month DATE NOT NULL,
+        user_id INTEGER NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        transaction_type VARCHAR(10) NOT NULL,
+        total DECIMAL(14, 2) NOT NULL,
+        tx_count INTEGER NOT NULL,
+        PRIMARY KEY (month, user_id, category, transaction_type)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_wallet_rollup_daily_user ON wallet_rollup_daily (user_id, day)",
+    "CREATE INDEX IF NOT EXISTS idx_wallet_rollup_monthly_user ON wallet_rollup_monthly (user_id, month)",
+    # Ids of ledger rows not rolled up yet, filled by a trigger so every writer is covered
+    """
+    CREATE TABLE IF NOT EXISTS wallet_rollup_queue (
+        transaction_id INTEGER PRIMARY KEY
+    )
+    """,
+    # Ledger rows that predate the trigger: (backfilled_through, backfill_upto]
+    """
+    CREATE TABLE IF NOT EXISTS wallet_rollup_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        backfill_upto INTEGER NOT NULL,
+        backfilled_through INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION wallet_rollup_enqueue() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO wallet_rollup_queue (transaction_id) SELECT transaction_id FROM new_rows;
+        RETURN NULL;
+    END
+    $$
+    """,
+]
+
+CREATE_TRIGGER = """
+    CREATE TRIGGER wallet_transactions_rollup
+    AFTER INSERT ON wallet_transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE wallet_rollup_enqueue()
+"""
+
+# Aggregates the ledger rows in `source` (a CTE yielding transaction_id) into both
+# rollup tables. Rows are upserted in key order so concurrent folds cannot deadlock.
+APPLY_ROLLUP = """
+    , t AS (
+        SELECT tx.created_at::date AS day, w.user_id,
+               COALESCE(tx.category, 'UNCATEGORIZED') AS category, tx.transaction_type, tx.amount
+        FROM source s
+        JOIN wallet_transactions tx ON tx.transaction_id = s.transaction_id
+        JOIN wallets w ON w.wallet_id = tx.wallet_id
+        WHERE tx.created_at IS NOT NULL
+    ), d AS (
+        INSERT INTO wallet_rollup_daily (day, user_id, category, transaction_type, total, tx_count)
+        SELECT day, user_id, category, transaction_type, SUM(amount), COUNT(*)
+        FROM t GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        ON CONFLICT (day, user_id, category, transaction_type) DO UPDATE
+            SET total = wallet_rollup_daily.total + EXCLUDED.total,
+                tx_count = wallet_rollup_daily.tx_count + EXCLUDED.tx_count
+    ), m AS (
+        INSERT INTO wallet_rollup_monthly (month, user_id, category, transaction_type, total, tx_count)
+        SELECT date_trunc('month', day)::date, user_id, category, transaction_type, SUM(amount), COUNT(*)
+        FROM t GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        ON CONFLICT (month, user_id, category, transaction_type) DO UPDATE
+            SET total = wallet_rollup_monthly.total + EXCLUDED.total,
+                tx_count = wallet_rollup_monthly.tx_count + EXCLUDED.tx_count
+    )
+    SELECT (SELECT COUNT(*) FROM source) AS transactions
+"""
+
+FOLD_QUEUE = """
+    WITH source AS (
+        DELETE FROM wallet_rollup_queue
+        WHERE transaction_id IN (
+            SELECT transaction_id FROM wallet_rollup_queue
+            ORDER BY transaction_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING transaction_id
+    )
+""" + APPLY_ROLLUP
+
+CATCH_UP = """
+    WITH source AS (
+        SELECT transaction_id FROM wallet_transactions
+        WHERE transaction_id > %s AND transaction_id <= %s
+    )
+""" + APPLY_ROLLUP
+
+
+class WalletRollups:
+    """Daily and monthly wallet totals per rider, category and type.
+
+    A statement-level trigger queues the id of every new wallet_transactions
+    row in the writer's own transaction (an append, no hot rows). This job
+    folds the queue into wallet_rollup_daily / wallet_rollup_monthly, woken
+    by the wallet endpoints right after they commit, so reports lag the
+    ledger by about one fold. Rows that existed before the trigger was
+    installed are backfilled in id ranges by the same job.
+    """
+
+    def __init__(self, interval=2.0, batch_size=5000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.backfill_remaining = None
+        self._counters = {
+            'folds': 0,
+            'fold_failures': 0,
+            'skipped_locked': 0,
+            'transactions_rolled_up': 0,
+            'backfilled': 0,
+            'last_fold_ms': 0.0,
+            'max_fold_ms': 0.0
+        }
+
+    def ensure_schema(self, connection):
+        with connection.cursor() as cursor:
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'wallet_transactions_rollup'")
+            if cursor.fetchone() is None:
+                # Waits out in-flight ledger writers, so every row is either older
+                # than the trigger (<= backfill_upto) or queued by it
+                cursor.execute("LOCK TABLE wallet_transactions IN SHARE ROW EXCLUSIVE MODE")
+                cursor.execute(CREATE_TRIGGER)
+                cursor.execute("""
+                    INSERT INTO wallet_rollup_state (id, backfill_upto, backfilled_through)
+                    SELECT 1, COALESCE(MAX(transaction_id), 0), 0 FROM wallet_transactions
+                    ON CONFLICT (id) DO NOTHING
+                """)
+        connection.commit()
+
+    def wake(self):
+        """Called after a ledger write commits: fold soon instead of at the next tick"""
+        self._wake.set()
+
+    def fold(self, connection):
+        """Roll up one batch of queued transactions, then one backfill batch; returns rows processed"""
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked", (FOLD_LOCK_KEY,))
+            if not cursor.fetchone()['locked']:
+                connection.rollback()
+                with self._lock:
+                    self._counters['skipped_locked'] += 1
+                return 0
+
+            cursor.execute(FOLD_QUEUE, (self.batch_size,))
+            queued = cursor.fetchone()['transactions']
+
+            backfilled = 0
+            cursor.execute("SELECT backfill_upto, backfilled_through FROM wallet_rollup_state WHERE id = 1 FOR UPDATE")
+            state = cursor.fetchone()
+            if state and state['backfilled_through'] < state['backfill_upto']:
+                upto = min(state['backfilled_through'] + self.batch_size, state['backfill_upto'])
+                cursor.execute(CATCH_UP, (state['backfilled_through'], upto))
+                backfilled = cursor.fetchone()['transactions']
+                cursor.execute("UPDATE wallet_rollup_state SET backfilled_through = %s WHERE id = 1", (upto,))
+                self.backfill_remaining = state['backfill_upto'] - upto
+            elif state:
+                self.backfill_remaining = 0
+        connection.commit()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            c = self._counters
+            c['folds'] += 1
+            c['transactions_rolled_up'] += queued
+            c['backfilled'] += backfilled
+            c['last_fold_ms'] = round(elapsed_ms, 2)
+            c['max_fold_ms'] = max(c['max_fold_ms'], c['last_fold_ms'])
+        return queued + backfilled
+
+    def run(self, pool):
+        schema_ready = False
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with pool.connection() as connection:
+                    if not schema_ready:
+                        self.ensure_schema(connection)
+                        schema_ready = True
+                    # Drain backlogs (bursts, backfill) before waiting again. A fold that did
+                    # nothing (another worker holds the fold lock) ends the drain; the next
+                    # interval retries instead of spinning on the database.
+                    while True:
+                        processed = self.fold(connection)
+                        if not processed or (processed < self.batch_size and not self.backfill_remaining):
+                            break
+            except Exception as e:
+                with self._lock:
+                    self._counters['fold_failures'] += 1
+                logger.error(f"Wallet rollup error: {e}")
+
+    def report(self, cursor, period, start, end, group_by='rider_category', user_id=None, category=None):
+        """Totals per period between start and end (dates, inclusive) from the rollup tables"""
+        table, column = ('wallet_rollup_daily', 'day') if period == 'day' else ('wallet_rollup_monthly', 'month')
+        if period == 'month':
+            start = start.replace(day=1)
+        keys = {
+            'rider': ['user_id'],
+            'category': ['category'],
+            'rider_category': ['user_id', 'category'],
+            'total': []
+        }[group_by]
+        group = ', '.join([column] + keys + ['transaction_type'])
+
+        conditions = [f'{column} >= %s', f'{column} <= %s']
+        params = [start, end]
+        if user_id is not None:
+            conditions.append('user_id = %s')
+            params.append(user_id)
+        if category:
+            conditions.append('category = %s')
+            params.append(category)
+
+        cursor.execute(f"""
+            SELECT {column} AS period, {', '.join(keys + ['transaction_type'])},
+                   SUM(total) AS total, SUM(tx_count) AS tx_count
+            FROM {table}
+            WHERE {' AND '.join(conditions)}
+            GROUP BY {group}
+            ORDER BY {group}
+        """, params)
+        return cursor.fetchall()
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c['backfill_remaining'] = self.backfill_remaining
+        c['interval'] = self.interval
+        return c